@@ -5,8 +5,25 @@ import asyncio
 import base64
 import logging
 import random
+import math
 import time
+import heapq
+import threading
+import struct
+import socket
+import hashlib
+import mmap
+import fcntl
+import tempfile
+import bisect
+import copy
+import contextlib
+import gzip
+import zlib
+from collections import OrderedDict, deque
+from http.cookiejar import CookieJar, DefaultCookiePolicy
 from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
 from uuid import uuid4
 from urllib.parse import urlparse, quote
 from urllib.parse import quote as url_quote
@@ -15,16 +32,42 @@ from urllib.parse import quote as url_quote
 import httpx
 import yaml
 from fastapi import FastAPI, HTTPException, Request, Query, Body, Path, Depends, File, UploadFile, Form
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response, PlainTextResponse
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field, ValidationError, field_validator
-from typing import Dict, Optional, List, Any, Tuple
+from typing import Dict, Optional, List, Any, Set, Tuple, AsyncIterator, Mapping
 from sqlalchemy import (
-    create_engine, Column, String, Integer, Boolean, JSON as SAJSON, ForeignKey, ForeignKeyConstraint, text, or_
+    create_engine, Column, String, Integer, BigInteger, Float, Boolean, JSON as SAJSON, ForeignKey, ForeignKeyConstraint, text, or_, event
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from starlette.datastructures import MutableHeaders
+from serialization import JSON_BACKEND, ORJSONResponse, dumps as json_dumps, dumps_bytes as json_dumps_bytes, loads as json_loads
+
+# Необязательные кодеки сжатия: без них доступен только gzip
+try:
+    import brotli
+except ImportError:  # pragma: no cover - зависит от окружения
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - зависит от окружения
+    zstandard = None
+# Необязательный NumPy: векторная генерация задержек по профилю (без него — модуль random)
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - зависит от окружения
+    np = None
+# uvicorn нужен только для плоскости данных на отдельном порту (MOCKL_DATA_PLANE_PORT)
+try:
+    import uvicorn
+except ImportError:  # pragma: no cover - зависит от окружения
+    uvicorn = None
 
 
 
@@ -48,10 +91,99 @@ DATABASE_URL = (
 DEFAULT_CACHE_TTL_SECONDS = int(os.getenv("MOCKL_DEFAULT_CACHE_TTL", "0"))
 RATE_LIMIT_REQUESTS = int(os.getenv("MOCKL_RATE_LIMIT_REQUESTS", "0"))  # 0 = выключено
 RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("MOCKL_RATE_LIMIT_WINDOW_SECONDS", "60"))
+# Алгоритм глобального лимита: token_bucket или sliding_log; ёмкость корзины (0 — равна числу запросов)
+RATE_LIMIT_ALGORITHM = os.getenv("MOCKL_RATE_LIMIT_ALGORITHM", "token_bucket").strip().lower()
+RATE_LIMIT_BURST = int(os.getenv("MOCKL_RATE_LIMIT_BURST", "0"))
+# Заголовок с ключом клиента для лимитов (например X-Api-Key); по умолчанию — IP
+RATE_LIMIT_KEY_HEADER = os.getenv("MOCKL_RATE_LIMIT_KEY_HEADER", "").strip().lower() or None
+# Максимум ключей в состоянии лимитов (local — вытеснение LRU, shm — число слотов)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("MOCKL_RATE_LIMIT_MAX_KEYS", "10000"))
+# Ограничение одновременных запросов к мокам (0 = выключено): всего и на корневую папку
+MAX_IN_FLIGHT = int(os.getenv("MOCKL_MAX_IN_FLIGHT", "0"))
+MAX_IN_FLIGHT_PER_FOLDER = int(os.getenv("MOCKL_MAX_IN_FLIGHT_PER_FOLDER", "0"))
+# Очередь ожидания свободного места: длина и максимальное ожидание до ответа 503
+ADMISSION_QUEUE_SIZE = int(os.getenv("MOCKL_ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("MOCKL_ADMISSION_QUEUE_TIMEOUT_MS", "100"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("MOCKL_ADMISSION_RETRY_AFTER_SECONDS", "1"))
+# Плоскость данных (только моки) на отдельном порту в том же процессе (0 — выключено)
+DATA_PLANE_PORT = int(os.getenv("MOCKL_DATA_PLANE_PORT", "0"))
+DATA_PLANE_HOST = os.getenv("MOCKL_DATA_PLANE_HOST", "0.0.0.0")
+# Обслуживает ли основное приложение моки (false — только API управления, моки — в плоскости данных)
+ADMIN_SERVES_MOCKS = os.getenv("MOCKL_ADMIN_SERVES_MOCKS", "true").lower() in ("1", "true", "yes")
 MAX_REQUEST_BODY_BYTES = int(os.getenv("MOCKL_MAX_REQUEST_BODY_BYTES", "0"))  # 0 = нет ограничения
+# Профили задержки: размер буфера заранее сгенерированных значений и период обновления эмпирических профилей
+DELAY_SAMPLE_BUFFER = int(os.getenv("MOCKL_DELAY_SAMPLE_BUFFER", "4096"))
+DELAY_EMPIRICAL_REFRESH_SECONDS = float(os.getenv("MOCKL_DELAY_EMPIRICAL_REFRESH_SECONDS", "300"))
+# Шаг колеса таймеров задержанных ответов (точность задержки); 0 — asyncio.sleep на каждый ответ
+TIMER_WHEEL_TICK_MS = float(os.getenv("MOCKL_TIMER_WHEEL_TICK_MS", "1"))
+# Размер порции тела при ограничении скорости ответа мока, если в моке не задан свой
+THROTTLE_CHUNK_BYTES = int(os.getenv("MOCKL_THROTTLE_CHUNK_BYTES", "16384"))
+# Виртуальное время для всех папок: задержки и ограничение скорости не выполняются, а только учитываются
+VIRTUAL_TIME = os.getenv("MOCKL_VIRTUAL_TIME", "0").lower() in ("1", "true", "yes")
+# Заголовок ответа с пропущенной (симулированной) задержкой в режиме виртуального времени
+SIMULATED_DELAY_HEADER = "X-Mockl-Simulated-Delay-Ms"
+CACHE_MAX_ENTRIES = int(os.getenv("MOCKL_CACHE_MAX_ENTRIES", "10000"))  # 0 = без ограничения по количеству
+CACHE_MAX_BYTES = int(os.getenv("MOCKL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 0 = без ограничения по объёму
+CACHE_SWEEP_INTERVAL_SECONDS = float(os.getenv("MOCKL_CACHE_SWEEP_INTERVAL_SECONDS", "1"))
+# Хранилище кэша: local (в памяти процесса), shm (общая память всех воркеров на хосте), redis
+CACHE_BACKEND = os.getenv("MOCKL_CACHE_BACKEND", "local").strip().lower()
+CACHE_SHM_PATH = os.getenv(
+    "MOCKL_CACHE_SHM_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "mockl_cache"),
+)
+CACHE_SHM_SLOTS = int(os.getenv("MOCKL_CACHE_SHM_SLOTS", "4096"))
+CACHE_SHM_SLOT_BYTES = int(os.getenv("MOCKL_CACHE_SHM_SLOT_BYTES", "32768"))
+CACHE_REDIS_URL = os.getenv("MOCKL_CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+CACHE_REDIS_PREFIX = os.getenv("MOCKL_CACHE_REDIS_PREFIX", "mockl:cache:")
+CACHE_REDIS_TIMEOUT_SECONDS = float(os.getenv("MOCKL_CACHE_REDIS_TIMEOUT_SECONDS", "1"))
+# Хранилище состояния лимитов запросов: local, shm или redis (по умолчанию — как у кэша)
+RATE_LIMIT_BACKEND = os.getenv("MOCKL_RATE_LIMIT_BACKEND", CACHE_BACKEND).strip().lower()
+RATE_LIMIT_SHM_PATH = os.getenv(
+    "MOCKL_RATE_LIMIT_SHM_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "mockl_ratelimit"),
+)
+RATE_LIMIT_REDIS_PREFIX = os.getenv("MOCKL_RATE_LIMIT_REDIS_PREFIX", "mockl:ratelimit:")
+# Предварительно сжатые варианты ответов статических моков (порядок = приоритет сервера)
+COMPRESSION_ENCODINGS = [
+    e.strip().lower()
+    for e in os.getenv("MOCKL_COMPRESSION_ENCODINGS", "br,zstd,gzip").split(",")
+    if e.strip()
+]
+COMPRESSION_MIN_BYTES = int(os.getenv("MOCKL_COMPRESSION_MIN_BYTES", "1024"))
 RULES_DIR = os.getenv("MOCKL_RULES_DIR")
 OPENAPI_SPECS_DIR = os.getenv("MOCKL_OPENAPI_SPECS_DIR")
 OPENAPI_SPECS_URLS = os.getenv("MOCKL_OPENAPI_SPECS_URLS", "")
+# Пул соединений прокси (один httpx‑клиент на upstream)
+PROXY_MAX_CONNECTIONS = int(os.getenv("MOCKL_PROXY_MAX_CONNECTIONS", "100"))
+PROXY_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("MOCKL_PROXY_MAX_KEEPALIVE_CONNECTIONS", "20"))
+PROXY_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("MOCKL_PROXY_KEEPALIVE_EXPIRY_SECONDS", "30"))
+PROXY_HTTP2 = os.getenv("MOCKL_PROXY_HTTP2", "false").strip().lower() in ("1", "true", "yes")
+PROXY_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MOCKL_PROXY_CONNECT_TIMEOUT_SECONDS", "5"))
+PROXY_READ_TIMEOUT_SECONDS = float(os.getenv("MOCKL_PROXY_READ_TIMEOUT_SECONDS", "30"))
+PROXY_POOL_TIMEOUT_SECONDS = float(os.getenv("MOCKL_PROXY_POOL_TIMEOUT_SECONDS", "5"))
+# Потоковый прокси: сколько первых байт тела запроса/ответа сохранять в журнал
+PROXY_LOG_BODY_MAX_BYTES = int(os.getenv("MOCKL_PROXY_LOG_BODY_MAX_BYTES", "65536"))
+# Базовая пауза перед повтором запроса к upstream (удваивается, со случайным разбросом)
+PROXY_RETRY_BACKOFF_SECONDS = float(os.getenv("MOCKL_PROXY_RETRY_BACKOFF_SECONDS", "0.05"))
+# Повторы, разрешённые за окно папки независимо от доли бюджета (при малом потоке запросов)
+PROXY_RETRY_BUDGET_MIN_RETRIES = int(os.getenv("MOCKL_PROXY_RETRY_BUDGET_MIN_RETRIES", "10"))
+# Пассивное исключение реплики upstream после ошибок подряд (0 — не исключать) и его длительность
+PROXY_EJECT_CONSECUTIVE_FAILURES = int(os.getenv("MOCKL_PROXY_EJECT_CONSECUTIVE_FAILURES", "5"))
+PROXY_EJECT_SECONDS = float(os.getenv("MOCKL_PROXY_EJECT_SECONDS", "30"))
+PROXY_HEALTH_CHECK_TIMEOUT_SECONDS = float(os.getenv("MOCKL_PROXY_HEALTH_CHECK_TIMEOUT_SECONDS", "2"))
+# Режим записи прокси: размер пачки вставки, период сохранения и предел очереди
+PROXY_RECORD_BATCH_SIZE = int(os.getenv("MOCKL_PROXY_RECORD_BATCH_SIZE", "200"))
+PROXY_RECORD_FLUSH_INTERVAL_SECONDS = float(os.getenv("MOCKL_PROXY_RECORD_FLUSH_INTERVAL_SECONDS", "1"))
+PROXY_RECORD_QUEUE_SIZE = int(os.getenv("MOCKL_PROXY_RECORD_QUEUE_SIZE", "10000"))
+# Теневой режим: число воркеров и предел очереди копий запросов к upstream
+PROXY_SHADOW_WORKERS = int(os.getenv("MOCKL_PROXY_SHADOW_WORKERS", "4"))
+PROXY_SHADOW_QUEUE_SIZE = int(os.getenv("MOCKL_PROXY_SHADOW_QUEUE_SIZE", "1000"))
+# Методы, копии которых уходят upstream; небезопасные (POST, DELETE и т.п.) — только явно
+PROXY_SHADOW_METHODS = {
+    m.strip().upper()
+    for m in os.getenv("MOCKL_PROXY_SHADOW_METHODS", "GET,HEAD,OPTIONS").split(",")
+    if m.strip()
+}
 ALLOWED_PROXY_HOSTS = {
     h.strip().lower()
     for h in os.getenv("MOCKL_ALLOWED_PROXY_HOSTS", "").split(",")
@@ -61,8 +193,8 @@ ALLOWED_PROXY_HOSTS = {
 
 # Глобальные структуры
 OPENAPI_SPECS: Dict[str, Dict[str, Any]] = {}
-RESPONSE_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = {}
-RATE_LIMIT_STATE: Dict[str, Dict[str, Any]] = {}
+BACKGROUND_TASKS: List[asyncio.Task] = []
+COMPILED_MOCKS: Dict[str, "CompiledMock"] = {}
 
 
 # Логирование в структурированном (JSON) виде
@@ -76,7 +208,7 @@ class JsonFormatter(logging.Formatter):
         }
         if record.exc_info:
             payload["exc_info"] = self.formatException(record.exc_info)
-        return json.dumps(payload, ensure_ascii=False)
+        return json_dumps(payload)
 
 
 logging.basicConfig(level=os.getenv("MOCKL_LOG_LEVEL", "INFO"))
@@ -111,6 +243,35 @@ RATE_LIMITED = Counter(
     "mockl_rate_limited_total",
     "Total rate limited requests",
 )
+RATE_LIMIT_REJECTED = Counter(
+    "mockl_rate_limit_rejections_total",
+    "Requests rejected with 429 by scope (global, folder, mock)",
+    ["scope", "folder"],
+)
+ADMISSION_SHED = Counter(
+    "mockl_admission_shed_total",
+    "Mock requests rejected with 503 by admission control",
+    ["scope", "folder", "reason"],
+)
+BULKHEAD_REJECTED = Counter(
+    "mockl_bulkhead_rejected_total",
+    "Mock requests rejected with 503 because a folder budget was exhausted",
+    ["folder", "resource", "reason"],
+)
+ADMISSION_WAIT = Histogram(
+    "mockl_admission_wait_seconds",
+    "Time mock requests spent waiting in the admission queue",
+    ["scope"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+RATE_LIMIT_EVICTIONS = Counter(
+    "mockl_rate_limit_evictions_total",
+    "Rate limit keys evicted because the state table was full",
+)
+RATE_LIMIT_KEYS = Gauge(
+    "mockl_rate_limit_keys",
+    "Rate limit keys currently tracked by this worker (local) or host (shm)",
+)
 CACHE_HITS = Counter(
     "mockl_cache_hits_total",
     "Total cache hits",
@@ -139,6 +300,2225 @@ PROXY_RESPONSE_TIME = Histogram(
     ["method", "path", "folder"],
     buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
 )
+PROXY_POOL_WAIT = Histogram(
+    "mockl_proxy_pool_wait_seconds",
+    "Time a proxied request waited for a pooled upstream connection",
+    ["upstream"],
+    buckets=[0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0],
+)
+TIMER_WHEEL_TICK_LAG = Histogram(
+    "mockl_timer_wheel_tick_lag_seconds",
+    "How late the timer wheel tick ran compared to its schedule (event loop saturation)",
+    buckets=[0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0],
+)
+VIRTUAL_TIME_SKIPPED = Counter(
+    "mockl_virtual_time_skipped_seconds_total",
+    "Delays skipped in virtual time mode (reported to clients but not slept)",
+    ["folder"],
+)
+CHAOS_FAULTS = Counter(
+    "mockl_chaos_faults_total",
+    "Connection-level faults injected into mock responses",
+    ["folder", "fault"],
+)
+THROTTLED_BYTES = Counter(
+    "mockl_throttled_bytes_total",
+    "Response body bytes sent by mocks with bandwidth throttling or chunked transfer",
+    ["folder"],
+)
+PROXY_CONNECTIONS_OPENED = Counter(
+    "mockl_proxy_connections_opened_total",
+    "New TCP connections opened to upstreams (the rest of the requests reuse pooled ones)",
+    ["upstream"],
+)
+PROXY_CIRCUIT_TRIPS = Counter(
+    "mockl_proxy_circuit_trips_total",
+    "Times the proxy circuit breaker of a folder opened",
+    ["folder"],
+)
+PROXY_CIRCUIT_REJECTED = Counter(
+    "mockl_proxy_circuit_rejected_total",
+    "Proxied requests rejected without calling the upstream because the circuit is open",
+    ["folder"],
+)
+PROXY_CIRCUIT_FALLBACKS = Counter(
+    "mockl_proxy_circuit_fallbacks_total",
+    "Requests answered by the folder fallback mock while the circuit is open",
+    ["folder"],
+)
+PROXY_RETRIES = Counter(
+    "mockl_proxy_retries_total",
+    "Retried upstream requests",
+    ["folder"],
+)
+PROXY_RETRY_BUDGET_EXHAUSTED = Counter(
+    "mockl_proxy_retry_budget_exhausted_total",
+    "Retries skipped because the folder retry budget was exhausted",
+    ["folder"],
+)
+PROXY_UPSTREAM_REQUESTS = Counter(
+    "mockl_proxy_upstream_requests_total",
+    "Proxied requests by upstream replica and result",
+    ["folder", "upstream", "result"],
+)
+PROXY_UPSTREAM_EJECTIONS = Counter(
+    "mockl_proxy_upstream_ejections_total",
+    "Upstream replicas taken out of rotation after consecutive errors",
+    ["folder", "upstream"],
+)
+PROXY_HEALTH_CHECKS = Counter(
+    "mockl_proxy_health_checks_total",
+    "Active upstream health checks by result",
+    ["folder", "upstream", "result"],
+)
+PROXY_RECORDED = Counter(
+    "mockl_proxy_recorded_total",
+    "Proxied requests handled by record mode by result",
+    ["folder", "result"],
+)
+PROXY_SHADOW_REQUESTS = Counter(
+    "mockl_proxy_shadow_requests_total",
+    "Shadow copies of mocked requests sent upstream by result",
+    ["folder", "result"],
+)
+SHADOW_DRIFT = Counter(
+    "mockl_shadow_drift_total",
+    "Differences between a mock and the real upstream response",
+    ["folder", "mock_id", "kind"],
+)
+PROXY_CACHE_RESULTS = Counter(
+    "mockl_proxy_cache_total",
+    "Proxy cache lookups by result (hit, stale, revalidate, stale_if_error, miss, coalesced)",
+    ["folder", "result"],
+)
+PROXY_STREAMED_BYTES = Counter(
+    "mockl_proxy_streamed_bytes_total",
+    "Bytes passed through the streaming proxy without buffering",
+    ["folder", "direction"],
+)
+PROXY_TIME_TO_FIRST_BYTE = Histogram(
+    "mockl_proxy_time_to_first_byte_seconds",
+    "Time until upstream response headers are forwarded by the streaming proxy",
+    ["folder"],
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+)
+CACHE_MISSES = Counter(
+    "mockl_cache_misses_total",
+    "Total cache misses",
+    ["folder"],
+)
+CACHE_EVICTIONS = Counter(
+    "mockl_cache_evictions_total",
+    "Total cache entries evicted by size limits",
+)
+CACHE_EXPIRATIONS = Counter(
+    "mockl_cache_expirations_total",
+    "Total cache entries removed after TTL expiry",
+)
+CACHE_ENTRIES = Gauge(
+    "mockl_cache_entries",
+    "Current number of cached responses",
+)
+CACHE_BYTES = Gauge(
+    "mockl_cache_bytes",
+    "Approximate size of cached responses in bytes",
+)
+MOCK_RENDERS = Counter(
+    "mockl_mock_renders_total",
+    "Mock responses served, by kind (static = pre-rendered bytes, dynamic = rendered per request)",
+    ["folder", "kind"],
+)
+NOT_MODIFIED = Counter(
+    "mockl_not_modified_total",
+    "Conditional requests answered with 304 Not Modified",
+    ["folder", "source"],
+)
+COMPRESSED_RESPONSES = Counter(
+    "mockl_compressed_responses_total",
+    "Mock responses served from a pre-compressed variant",
+    ["folder", "encoding"],
+)
+COMPRESSION_RATIO = Histogram(
+    "mockl_compression_ratio",
+    "Compressed/original size ratio of generated response variants",
+    ["encoding"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+COMPRESSION_BYTES_SAVED = Counter(
+    "mockl_compression_bytes_saved_total",
+    "Response bytes not sent thanks to compression",
+    ["encoding"],
+)
+COMPRESSION_TIME_SAVED = Counter(
+    "mockl_compression_time_saved_seconds_total",
+    "Compression time avoided by reusing pre-compressed variants",
+    ["encoding"],
+)
+COMPILED_MOCKS_GAUGE = Gauge(
+    "mockl_compiled_mocks",
+    "Compiled mocks held in memory, by kind",
+    ["kind"],
+)
+
+
+# Кэш ответов
+class CacheBackend:
+    """Интерфейс хранилища кэша ответов.
+
+    Payload — словарь с ключами status_code, content (bytes), media_type, headers.
+    Для блокирующих хранилищ (сеть) blocking = True: обработчики вызывают их
+    через пул потоков, чтобы не останавливать event loop.
+    """
+
+    name = "base"
+    blocking = False
+
+    def get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def set(self, key: str, payload: Dict[str, Any], ttl: float, tags: Optional["CacheTags"] = None) -> bool:
+        raise NotImplementedError
+
+    def pop(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def clear(self) -> int:
+        raise NotImplementedError
+
+    def keys(self) -> List[str]:
+        raise NotImplementedError
+
+    def invalidate(
+        self,
+        mock_id: Optional[str] = None,
+        folder: Optional[str] = None,
+        path_prefix: Optional[str] = None,
+    ) -> int:
+        """Удаляет записи по моку, папке и/или префиксу пути (критерии объединяются через И)."""
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        return 0
+
+    def items_preview(self, limit: int = 20) -> List[Tuple[str, float, Dict[str, Any]]]:
+        return []
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+# Теги записи кэша: (id мока, папка в формате name|parent, путь с query внутри папки)
+CacheTags = Tuple[str, str, str]
+
+
+def _cache_tags_match(
+    tags: Optional[CacheTags],
+    mock_id: Optional[str],
+    folder: Optional[str],
+    path_prefix: Optional[str],
+) -> bool:
+    if tags is None:
+        return False
+    return (
+        (mock_id is None or tags[0] == mock_id)
+        and (folder is None or tags[1] == folder)
+        and (path_prefix is None or tags[2].startswith(path_prefix))
+    )
+
+
+class CacheTagIndex:
+    """Вторичный индекс ключей кэша по моку, папке и пути.
+
+    Позволяет инвалидировать записи за O(затронутых записей): по моку и папке —
+    через множества ключей, по префиксу пути — через отсортированный список (bisect).
+    """
+
+    def __init__(self):
+        self.tags: Dict[str, CacheTags] = {}
+        self.by_mock: Dict[str, set] = {}
+        self.by_folder: Dict[str, set] = {}
+        self.paths: List[Tuple[str, str]] = []
+
+    def add(self, key: str, tags: CacheTags) -> None:
+        self.discard(key)
+        self.tags[key] = tags
+        self.by_mock.setdefault(tags[0], set()).add(key)
+        self.by_folder.setdefault(tags[1], set()).add(key)
+        bisect.insort(self.paths, (tags[2], key))
+
+    def discard(self, key: str) -> None:
+        tags = self.tags.pop(key, None)
+        if tags is None:
+            return
+        for index, value in ((self.by_mock, tags[0]), (self.by_folder, tags[1])):
+            keys = index.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[value]
+        pos = bisect.bisect_left(self.paths, (tags[2], key))
+        if pos < len(self.paths) and self.paths[pos] == (tags[2], key):
+            del self.paths[pos]
+
+    def clear(self) -> None:
+        self.tags.clear()
+        self.by_mock.clear()
+        self.by_folder.clear()
+        self.paths.clear()
+
+    def select(
+        self,
+        mock_id: Optional[str] = None,
+        folder: Optional[str] = None,
+        path_prefix: Optional[str] = None,
+    ) -> List[str]:
+        if mock_id is not None:
+            candidates = list(self.by_mock.get(mock_id, ()))
+        elif folder is not None:
+            candidates = list(self.by_folder.get(folder, ()))
+        elif path_prefix is not None:
+            candidates = []
+            pos = bisect.bisect_left(self.paths, (path_prefix, ""))
+            while pos < len(self.paths) and self.paths[pos][0].startswith(path_prefix):
+                candidates.append(self.paths[pos][1])
+                pos += 1
+            return candidates
+        else:
+            return list(self.tags.keys())
+        return [k for k in candidates if _cache_tags_match(self.tags.get(k), mock_id, folder, path_prefix)]
+
+
+def _encode_cache_payload(expires_at: float, payload: Dict[str, Any], tags: Optional[CacheTags] = None) -> bytes:
+    """Сериализует запись кэша для внешних хранилищ: длина мета‑JSON + мета + тело."""
+    meta = {k: v for k, v in payload.items() if k != "content"}
+    meta["expires_at"] = expires_at
+    if tags is not None:
+        meta["__tags__"] = list(tags)
+    meta_bytes = json_dumps_bytes(meta)
+    return struct.pack("<I", len(meta_bytes)) + meta_bytes + bytes(payload.get("content") or b"")
+
+
+def _decode_cache_payload(data: bytes) -> Tuple[float, Dict[str, Any]]:
+    (meta_len,) = struct.unpack_from("<I", data)
+    meta = json_loads(bytes(data[4:4 + meta_len]))
+    expires_at = meta.pop("expires_at")
+    meta.pop("__tags__", None)
+    meta["content"] = bytes(data[4 + meta_len:])
+    return expires_at, meta
+
+
+def _decode_cache_tags(data: bytes) -> Optional[CacheTags]:
+    """Читает только теги записи, не копируя тело ответа."""
+    (meta_len,) = struct.unpack_from("<I", data)
+    tags = json_loads(bytes(data[4:4 + meta_len])).get("__tags__")
+    return tuple(tags) if tags else None
+
+
+class LocalCacheBackend(CacheBackend):
+    """Ограниченный LRU‑кэш ответов с учётом объёма и удалением истёкших записей.
+
+    Записи хранятся в OrderedDict (порядок = порядок использования), сроки жизни —
+    в min-heap по expires_at, поэтому вытеснение и удаление истёкших записей не
+    требуют обхода всего кэша. Все счётчики поддерживаются инкрементально.
+    """
+
+    name = "local"
+
+    # Примерные накладные расходы на одну запись (dict, кортежи, ключи заголовков)
+    ENTRY_OVERHEAD_BYTES = 256
+
+    def __init__(self, max_entries: int = 0, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._index = CacheTagIndex()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def _estimate_size(cls, key: str, payload: Dict[str, Any]) -> int:
+        size = cls.ENTRY_OVERHEAD_BYTES + len(key)
+        content = payload.get("content")
+        if content:
+            size += len(content)
+        for k, v in (payload.get("headers") or {}).items():
+            size += len(k) + len(str(v))
+        return size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def keys(self) -> List[str]:
+        """Снимок ключей (от давно неиспользуемых к недавним)."""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def get(self, key: str, now: Optional[float] = None) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """Возвращает (expires_at, payload) или None, если записи нет или она истекла."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, payload, _ = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                CACHE_EXPIRATIONS.inc()
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return expires_at, payload
+
+    def set(self, key: str, payload: Dict[str, Any], ttl: float, tags: Optional[CacheTags] = None) -> bool:
+        """Сохраняет ответ на ttl секунд. Возвращает False, если запись не помещается в лимит."""
+        size = self._estimate_size(key, payload)
+        if self.max_bytes > 0 and size > self.max_bytes:
+            return False
+        expires_at = time.time() + ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, payload, size)
+            if tags is not None:
+                self._index.add(key, tags)
+            self.bytes += size
+            heapq.heappush(self._expiry_heap, (expires_at, key))
+            self._evict()
+            self._maybe_compact_heap()
+        self._update_gauges()
+        return True
+
+    def pop(self, key: str) -> bool:
+        with self._lock:
+            removed = self._remove(key)
+        self._update_gauges()
+        return removed
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._expiry_heap.clear()
+            self._index.clear()
+            self.bytes = 0
+        self._update_gauges()
+        return count
+
+    def invalidate(
+        self,
+        mock_id: Optional[str] = None,
+        folder: Optional[str] = None,
+        path_prefix: Optional[str] = None,
+    ) -> int:
+        with self._lock:
+            keys = self._index.select(mock_id, folder, path_prefix)
+            removed = sum(1 for key in keys if self._remove(key))
+        if removed:
+            self._update_gauges()
+        return removed
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Удаляет истёкшие записи, просматривая только вершину heap."""
+        now = now if now is not None else time.time()
+        removed = 0
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                expires_at, key = heapq.heappop(heap)
+                entry = self._entries.get(key)
+                # Элемент heap мог устареть (запись перезаписана или вытеснена)
+                if entry is not None and entry[0] == expires_at:
+                    self._remove(key)
+                    removed += 1
+            self.expirations += removed
+        if removed:
+            CACHE_EXPIRATIONS.inc(removed)
+            self._update_gauges()
+        return removed
+
+    def items_preview(self, limit: int = 20) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """Несколько последних использованных записей без обхода всего кэша."""
+        result = []
+        with self._lock:
+            for key in reversed(self._entries):
+                expires_at, payload, _ = self._entries[key]
+                result.append((key, expires_at, payload))
+                if len(result) >= limit:
+                    break
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._index.discard(key)
+        self.bytes -= entry[2]
+        return True
+
+    def _evict(self) -> None:
+        while self._entries and (
+            (self.max_entries > 0 and len(self._entries) > self.max_entries)
+            or (self.max_bytes > 0 and self.bytes > self.max_bytes)
+        ):
+            key, (_, _, size) = self._entries.popitem(last=False)
+            self._index.discard(key)
+            self.bytes -= size
+            self.evictions += 1
+            CACHE_EVICTIONS.inc()
+
+    def _maybe_compact_heap(self) -> None:
+        # Перезаписанные и вытесненные ключи оставляют «мёртвые» элементы в heap
+        if len(self._expiry_heap) > 2 * len(self._entries) + 64:
+            self._expiry_heap = [(exp, key) for key, (exp, _, _) in self._entries.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def _update_gauges(self) -> None:
+        CACHE_ENTRIES.set(len(self._entries))
+        CACHE_BYTES.set(self.bytes)
+
+
+class SharedMemoryCacheBackend(CacheBackend):
+    """Кэш в общей памяти (mmap файла в /dev/shm), общий для всех воркеров на хосте.
+
+    Таблица фиксированного размера: slots слотов по slot_size байт, открытая адресация
+    с окном из PROBE слотов. При переполнении окна вытесняется давно не использованный
+    слот. Межпроцессная синхронизация — flock на файле, внутри процесса — threading.Lock.
+    Счётчики (записи, байты, попадания и т.д.) хранятся в заголовке и общие для всех воркеров.
+    """
+
+    name = "shm"
+    MAGIC = b"MKC1"
+    PROBE = 8
+    # magic, slots, slot_size, entries, bytes, hits, misses, evictions, expirations, generation
+    _HEADER = struct.Struct("<4sIIqqqqqqq")
+    HEADER_SIZE = 128
+    # state, key_hash, expires_at, last_used, key_len, value_len
+    _SLOT = struct.Struct("<B7xQddII")
+
+    def __init__(self, path: str, slots: int, slot_size: int):
+        if slot_size <= self._SLOT.size + 64:
+            raise ValueError("slot_size is too small")
+        self.path = path
+        self.slots = max(1, slots)
+        self.slot_size = slot_size
+        self.size = self.HEADER_SIZE + self.slots * self.slot_size
+        self._thread_lock = threading.Lock()
+        self._purge_cursor = 0
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            if os.fstat(self._fd).st_size < self.size:
+                os.ftruncate(self._fd, self.size)
+            self._mm = mmap.mmap(self._fd, self.size)
+            magic, slots_hdr, slot_size_hdr = self._HEADER.unpack_from(self._mm, 0)[:3]
+            if magic != self.MAGIC or slots_hdr != self.slots or slot_size_hdr != self.slot_size:
+                if magic == self.MAGIC:
+                    logger.warning(f"Shared cache {path} has different geometry, reinitializing")
+                self._mm[:self.size] = bytes(self.size)
+                self._HEADER.pack_into(self._mm, 0, self.MAGIC, self.slots, self.slot_size, 0, 0, 0, 0, 0, 0, 0)
+
+    class _Lock:
+        def __init__(self, backend: "SharedMemoryCacheBackend"):
+            self.backend = backend
+
+        def __enter__(self):
+            self.backend._thread_lock.acquire()
+            fcntl.flock(self.backend._fd, fcntl.LOCK_EX)
+
+        def __exit__(self, *exc):
+            fcntl.flock(self.backend._fd, fcntl.LOCK_UN)
+            self.backend._thread_lock.release()
+
+    def _locked(self) -> "_Lock":
+        return self._Lock(self)
+
+    def _counters(self) -> List[int]:
+        return list(self._HEADER.unpack_from(self._mm, 0)[3:])
+
+    def _bump(self, index: int, delta: int) -> None:
+        # index — номер счётчика после magic/slots/slot_size
+        offset = 4 + 4 + 4 + 8 * index
+        (value,) = struct.unpack_from("<q", self._mm, offset)
+        struct.pack_into("<q", self._mm, offset, value + delta)
+
+    @staticmethod
+    def _hash(key_bytes: bytes) -> int:
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), "little")
+
+    def _slot_offset(self, index: int) -> int:
+        return self.HEADER_SIZE + index * self.slot_size
+
+    def _probe(self, key_hash: int) -> List[int]:
+        start = key_hash % self.slots
+        return [(start + i) % self.slots for i in range(min(self.PROBE, self.slots))]
+
+    def _find(self, key_bytes: bytes, key_hash: int) -> Optional[int]:
+        for index in self._probe(key_hash):
+            offset = self._slot_offset(index)
+            state, slot_hash, _, _, key_len, _ = self._SLOT.unpack_from(self._mm, offset)
+            if state == 1 and slot_hash == key_hash and key_len == len(key_bytes):
+                start = offset + self._SLOT.size
+                if self._mm[start:start + key_len] == key_bytes:
+                    return index
+        return None
+
+    def _free_slot(self, index: int) -> None:
+        offset = self._slot_offset(index)
+        state, _, _, _, key_len, value_len = self._SLOT.unpack_from(self._mm, offset)
+        if state == 1:
+            self._mm[offset] = 0
+            self._bump(0, -1)
+            self._bump(1, -(key_len + value_len))
+
+    def get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        key_bytes = key.encode("utf-8")
+        key_hash = self._hash(key_bytes)
+        now = time.time()
+        with self._locked():
+            index = self._find(key_bytes, key_hash)
+            if index is None:
+                self._bump(3, 1)
+                return None
+            offset = self._slot_offset(index)
+            _, _, expires_at, _, key_len, value_len = self._SLOT.unpack_from(self._mm, offset)
+            if expires_at <= now:
+                self._free_slot(index)
+                self._bump(3, 1)
+                self._bump(5, 1)
+                CACHE_EXPIRATIONS.inc()
+                return None
+            struct.pack_into("<d", self._mm, offset + 24, now)
+            start = offset + self._SLOT.size + key_len
+            data = self._mm[start:start + value_len]
+            self._bump(2, 1)
+        return _decode_cache_payload(data)
+
+    def set(self, key: str, payload: Dict[str, Any], ttl: float, tags: Optional[CacheTags] = None) -> bool:
+        key_bytes = key.encode("utf-8")
+        now = time.time()
+        expires_at = now + ttl
+        value = _encode_cache_payload(expires_at, payload, tags)
+        if self._SLOT.size + len(key_bytes) + len(value) > self.slot_size:
+            return False
+        key_hash = self._hash(key_bytes)
+        with self._locked():
+            index = self._find(key_bytes, key_hash)
+            if index is None:
+                victim, victim_used = None, None
+                for candidate in self._probe(key_hash):
+                    state, _, exp, last_used, _, _ = self._SLOT.unpack_from(self._mm, self._slot_offset(candidate))
+                    if state == 0:
+                        victim = candidate
+                        break
+                    if exp <= now:
+                        victim, victim_used = candidate, -1.0
+                        continue
+                    if victim_used is None or last_used < victim_used:
+                        victim, victim_used = candidate, last_used
+                index = victim
+                offset = self._slot_offset(index)
+                state, _, exp, _, _, _ = self._SLOT.unpack_from(self._mm, offset)
+                if state == 1:
+                    if exp <= now:
+                        self._bump(5, 1)
+                        CACHE_EXPIRATIONS.inc()
+                    else:
+                        self._bump(4, 1)
+                        CACHE_EVICTIONS.inc()
+            self._free_slot(index)
+            offset = self._slot_offset(index)
+            start = offset + self._SLOT.size
+            self._mm[start:start + len(key_bytes)] = key_bytes
+            self._mm[start + len(key_bytes):start + len(key_bytes) + len(value)] = value
+            self._SLOT.pack_into(self._mm, offset, 1, key_hash, expires_at, now, len(key_bytes), len(value))
+            self._bump(0, 1)
+            self._bump(1, len(key_bytes) + len(value))
+        self._update_gauges()
+        return True
+
+    def pop(self, key: str) -> bool:
+        key_bytes = key.encode("utf-8")
+        with self._locked():
+            index = self._find(key_bytes, self._hash(key_bytes))
+            if index is None:
+                return False
+            self._free_slot(index)
+        self._update_gauges()
+        return True
+
+    def clear(self) -> int:
+        with self._locked():
+            count = self._counters()[0]
+            for index in range(self.slots):
+                self._mm[self._slot_offset(index)] = 0
+            self._bump(0, -self._counters()[0])
+            self._bump(1, -self._counters()[1])
+            self._bump(6, 1)
+        self._update_gauges()
+        return count
+
+    def _iter_used(self):
+        for index in range(self.slots):
+            offset = self._slot_offset(index)
+            state, _, expires_at, last_used, key_len, value_len = self._SLOT.unpack_from(self._mm, offset)
+            if state == 1:
+                yield index, offset, expires_at, last_used, key_len, value_len
+
+    def keys(self) -> List[str]:
+        with self._locked():
+            result = []
+            for _, offset, _, _, key_len, _ in self._iter_used():
+                start = offset + self._SLOT.size
+                result.append(self._mm[start:start + key_len].decode("utf-8", errors="replace"))
+            return result
+
+    def invalidate(
+        self,
+        mock_id: Optional[str] = None,
+        folder: Optional[str] = None,
+        path_prefix: Optional[str] = None,
+    ) -> int:
+        # Индекс в общей памяти не ведётся: таблица фиксированного размера, теги читаются
+        # из заголовка записи без копирования тела, поэтому проход ограничен числом слотов.
+        removed = 0
+        with self._locked():
+            for index, offset, _, _, key_len, value_len in list(self._iter_used()):
+                start = offset + self._SLOT.size + key_len
+                (meta_len,) = struct.unpack_from("<I", self._mm, start)
+                tags = _decode_cache_tags(self._mm[start:start + 4 + meta_len])
+                if _cache_tags_match(tags, mock_id, folder, path_prefix):
+                    self._free_slot(index)
+                    removed += 1
+        if removed:
+            self._update_gauges()
+        return removed
+
+    def purge_expired(self) -> int:
+        """Удаляет истёкшие записи, проходя за один вызов не более 1024 слотов."""
+        now = time.time()
+        removed = 0
+        with self._locked():
+            for _ in range(min(self.slots, 1024)):
+                index = self._purge_cursor
+                self._purge_cursor = (self._purge_cursor + 1) % self.slots
+                state, _, expires_at, _, _, _ = self._SLOT.unpack_from(self._mm, self._slot_offset(index))
+                if state == 1 and expires_at <= now:
+                    self._free_slot(index)
+                    removed += 1
+            if removed:
+                self._bump(5, removed)
+        if removed:
+            CACHE_EXPIRATIONS.inc(removed)
+            self._update_gauges()
+        return removed
+
+    def items_preview(self, limit: int = 20) -> List[Tuple[str, float, Dict[str, Any]]]:
+        with self._locked():
+            used = sorted(self._iter_used(), key=lambda item: item[3], reverse=True)[:limit]
+            result = []
+            for _, offset, expires_at, _, key_len, value_len in used:
+                start = offset + self._SLOT.size
+                key = self._mm[start:start + key_len].decode("utf-8", errors="replace")
+                _, payload = _decode_cache_payload(self._mm[start + key_len:start + key_len + value_len])
+                result.append((key, expires_at, payload))
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._locked():
+            entries, used_bytes, hits, misses, evictions, expirations, generation = self._counters()
+        lookups = hits + misses
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "entries": entries,
+            "bytes": used_bytes,
+            "max_entries": self.slots,
+            "max_bytes": self.slots * self.slot_size,
+            "max_entry_bytes": self.slot_size - self._SLOT.size,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": (hits / lookups) if lookups else 0.0,
+            "evictions": evictions,
+            "expirations": expirations,
+            "clears": generation,
+        }
+
+    def __len__(self) -> int:
+        with self._locked():
+            return self._counters()[0]
+
+    def _update_gauges(self) -> None:
+        counters = self._counters()
+        CACHE_ENTRIES.set(counters[0])
+        CACHE_BYTES.set(counters[1])
+
+
+class _StaleRedisConnection(ConnectionError):
+    """Соединение оборвалось до первого байта ответа: сервер не получил и не выполнил команды."""
+
+
+class RespClient:
+    """Минимальный синхронный клиент протокола Redis (RESP2) с пулом соединений.
+
+    Достаточен для Redis, KeyDB, Dragonfly и локальных заглушек, говорящих на RESP.
+    """
+
+    def __init__(self, url: str, timeout: float = 1.0, max_idle: int = 8):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", ""):
+            raise ValueError(f"Unsupported Redis URL scheme: {parsed.scheme}")
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle: List[Tuple[socket.socket, Any]] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        try:
+            if self.password:
+                self._roundtrip(conn, [("AUTH", self.password)])
+            if self.db:
+                self._roundtrip(conn, [("SELECT", self.db)])
+        except BaseException:
+            self._close(conn)
+            raise
+        return conn
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            elif isinstance(arg, float):
+                data = repr(arg).encode("ascii")
+            else:
+                data = str(arg).encode("utf-8")
+            out.append(b"$%d\r\n" % len(data))
+            out.append(data)
+            out.append(b"\r\n")
+        return b"".join(out)
+
+    def _read_reply(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode("utf-8")
+        if prefix == b"-":
+            raise RuntimeError(f"Redis error: {rest.decode('utf-8', errors='replace')}")
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected RESP reply: {line!r}")
+
+    def _roundtrip(self, conn, commands) -> List[Any]:
+        sock, reader = conn
+        try:
+            sock.sendall(b"".join(self._encode(cmd) for cmd in commands))
+            first = reader.peek(1)[:1]
+        except socket.timeout:
+            # Сервер мог уже выполнить команды — повторять нельзя
+            raise
+        except OSError as e:
+            raise _StaleRedisConnection(f"Redis connection lost: {e}") from e
+        if not first:
+            raise _StaleRedisConnection("Redis connection closed")
+        replies = []
+        error = None
+        for _ in commands:
+            try:
+                replies.append(self._read_reply(reader))
+            except RuntimeError as e:
+                # Ошибку команды запоминаем, но дочитываем остальные ответы конвейера
+                error = error or e
+                replies.append(None)
+        if error:
+            raise error
+        return replies
+
+    @staticmethod
+    def _close(conn) -> None:
+        # Сокет закрывается только вместе с файловым объектом makefile
+        conn[1].close()
+        conn[0].close()
+
+    def _release(self, conn) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    def pipeline(self, *commands) -> List[Any]:
+        """Отправляет команды одним пакетом и возвращает ответы по порядку.
+
+        Повтор выполняется только если простаивавшее в пуле соединение оборвалось
+        до первого байта ответа: иначе команды (например, EVAL лимитов) могли
+        выполниться, и повтор выполнил бы их дважды.
+        """
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = self._connect()
+        while True:
+            try:
+                replies = self._roundtrip(conn, commands)
+            except RuntimeError:
+                # Ответ-ошибка Redis: все ответы конвейера дочитаны, соединение пригодно
+                self._release(conn)
+                raise
+            except BaseException as e:
+                self._close(conn)
+                if reused and isinstance(e, _StaleRedisConnection):
+                    reused = False
+                    conn = self._connect()
+                    continue
+                raise
+            self._release(conn)
+            return replies
+
+    def execute(self, *args) -> Any:
+        return self.pipeline(args)[0]
+
+
+class RedisCacheBackend(CacheBackend):
+    """Кэш во внешнем хранилище с протоколом Redis — общий для всех воркеров и хостов.
+
+    Сроки жизни записей контролирует сам Redis (SET ... PX). Дополнительно ведутся:
+    sorted set с expires_at (перечисление и очистка), hash с тегами записей,
+    множества ключей по моку и папке и лексикографический sorted set путей
+    (ZRANGEBYLEX) для инвалидации по префиксу.
+    """
+
+    name = "redis"
+    blocking = True
+    _SEP = "\x1f"
+
+    def __init__(self, client: RespClient, prefix: str):
+        self.client = client
+        self.prefix = prefix
+        self.index_key = f"{prefix}__index__"
+        self.tags_key = f"{prefix}__tags__"
+        self.paths_key = f"{prefix}__paths__"
+        self.tagsets_key = f"{prefix}__tagsets__"
+        self.hits = 0
+        self.misses = 0
+
+    def _mock_set(self, mock_id: str) -> str:
+        return f"{self.prefix}__mock__:{mock_id}"
+
+    def _folder_set(self, folder: str) -> str:
+        return f"{self.prefix}__folder__:{folder}"
+
+    def get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        data = self.client.execute("GET", self.prefix + key)
+        if data is None:
+            self.misses += 1
+            return None
+        expires_at, payload = _decode_cache_payload(data)
+        if expires_at <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return expires_at, payload
+
+    def set(self, key: str, payload: Dict[str, Any], ttl: float, tags: Optional[CacheTags] = None) -> bool:
+        expires_at = time.time() + ttl
+        value = _encode_cache_payload(expires_at, payload)
+        commands = [
+            ("SET", self.prefix + key, value, "PX", max(1, int(ttl * 1000))),
+            ("ZADD", self.index_key, expires_at, key),
+        ]
+        if tags is not None:
+            mock_set, folder_set = self._mock_set(tags[0]), self._folder_set(tags[1])
+            commands += [
+                ("HSET", self.tags_key, key, self._SEP.join(tags)),
+                ("SADD", mock_set, key),
+                ("SADD", folder_set, key),
+                ("SADD", self.tagsets_key, mock_set, folder_set),
+                ("ZADD", self.paths_key, 0, f"{tags[2]}\x00{key}"),
+            ]
+        self.client.pipeline(*commands)
+        return True
+
+    def _drop(self, keys: List[str]) -> int:
+        """Удаляет записи вместе со всеми ссылками на них из индексов."""
+        if not keys:
+            return 0
+        raw_tags = self.client.execute("HMGET", self.tags_key, *keys) or []
+        commands = []
+        for key, raw in zip(keys, raw_tags):
+            commands.append(("DEL", self.prefix + key))
+            commands.append(("ZREM", self.index_key, key))
+            if raw:
+                mock_id, folder, path = raw.decode("utf-8").split(self._SEP, 2)
+                commands.append(("SREM", self._mock_set(mock_id), key))
+                commands.append(("SREM", self._folder_set(folder), key))
+                commands.append(("ZREM", self.paths_key, f"{path}\x00{key}"))
+        commands.append(("HDEL", self.tags_key, *keys))
+        replies = self.client.pipeline(*commands)
+        return sum(1 for cmd, reply in zip(commands, replies) if cmd[0] == "DEL" and reply)
+
+    def pop(self, key: str) -> bool:
+        return bool(self._drop([key]))
+
+    def keys(self) -> List[str]:
+        raw = self.client.execute("ZRANGEBYSCORE", self.index_key, time.time(), "+inf")
+        return [k.decode("utf-8", errors="replace") for k in raw or []]
+
+    def invalidate(
+        self,
+        mock_id: Optional[str] = None,
+        folder: Optional[str] = None,
+        path_prefix: Optional[str] = None,
+    ) -> int:
+        if mock_id is not None:
+            raw = self.client.execute("SMEMBERS", self._mock_set(mock_id))
+        elif folder is not None:
+            raw = self.client.execute("SMEMBERS", self._folder_set(folder))
+        elif path_prefix is not None:
+            raw = self.client.execute(
+                "ZRANGEBYLEX", self.paths_key, b"[" + path_prefix.encode("utf-8"), b"[" + path_prefix.encode("utf-8") + b"\xff"
+            )
+            raw = [member.split(b"\x00", 1)[1] for member in raw or [] if b"\x00" in member]
+        else:
+            return self.clear()
+        keys = [k.decode("utf-8") for k in raw or []]
+        criteria = sum(1 for value in (mock_id, folder, path_prefix) if value is not None)
+        if keys and criteria > 1:
+            # Дополнительные критерии проверяем по тегам записей
+            raw_tags = self.client.execute("HMGET", self.tags_key, *keys) or []
+            keys = [
+                key for key, tags in zip(keys, raw_tags)
+                if tags and _cache_tags_match(tuple(tags.decode("utf-8").split(self._SEP, 2)), mock_id, folder, path_prefix)
+            ]
+        return self._drop(keys)
+
+    def clear(self) -> int:
+        keys = self.client.execute("ZRANGE", self.index_key, 0, -1) or []
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            self.client.execute("DEL", *[self.prefix.encode("utf-8") + k for k in batch])
+        tagsets = self.client.execute("SMEMBERS", self.tagsets_key) or []
+        for i in range(0, len(tagsets), 500):
+            self.client.execute("DEL", *tagsets[i:i + 500])
+        self.client.execute("DEL", self.index_key, self.tags_key, self.paths_key, self.tagsets_key)
+        return len(keys)
+
+    def purge_expired(self) -> int:
+        # Данные удаляет сам Redis, здесь чистим только индексы
+        expired = self.client.execute("ZRANGEBYSCORE", self.index_key, "-inf", time.time()) or []
+        if not expired:
+            return 0
+        self._drop([k.decode("utf-8") for k in expired])
+        CACHE_EXPIRATIONS.inc(len(expired))
+        return len(expired)
+
+    def items_preview(self, limit: int = 20) -> List[Tuple[str, float, Dict[str, Any]]]:
+        raw = self.client.execute("ZREVRANGE", self.index_key, 0, limit - 1, "WITHSCORES") or []
+        result = []
+        for i in range(0, len(raw), 2):
+            key = raw[i].decode("utf-8", errors="replace")
+            data = self.client.execute("GET", self.prefix + key)
+            if data is None:
+                continue
+            expires_at, payload = _decode_cache_payload(data)
+            result.append((key, expires_at, payload))
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        entries = len(self)
+        CACHE_ENTRIES.set(entries)
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "url": f"redis://{self.client.host}:{self.client.port}/{self.client.db}",
+            "entries": entries,
+            "bytes": None,
+            # Попадания и промахи — по текущему воркеру, суммарные значения см. в Prometheus
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "evictions": None,
+            "expirations": None,
+        }
+
+    def __len__(self) -> int:
+        return self.client.execute("ZCOUNT", self.index_key, time.time(), "+inf") or 0
+
+
+def _create_cache_backend() -> CacheBackend:
+    """Создаёт хранилище кэша по MOCKL_CACHE_BACKEND; при ошибке откатывается на local."""
+    try:
+        if CACHE_BACKEND == "shm":
+            return SharedMemoryCacheBackend(CACHE_SHM_PATH, CACHE_SHM_SLOTS, CACHE_SHM_SLOT_BYTES)
+        if CACHE_BACKEND == "redis":
+            client = RespClient(CACHE_REDIS_URL, timeout=CACHE_REDIS_TIMEOUT_SECONDS)
+            return RedisCacheBackend(client, CACHE_REDIS_PREFIX)
+        if CACHE_BACKEND != "local":
+            logger.warning(f"Unknown MOCKL_CACHE_BACKEND={CACHE_BACKEND}, using local cache")
+    except Exception as e:
+        logger.error(f"Failed to initialize {CACHE_BACKEND} cache backend, using local cache: {e}", exc_info=True)
+    return LocalCacheBackend(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES)
+
+
+RESPONSE_CACHE: CacheBackend = _create_cache_backend()
+
+
+async def _cache_call(method: str, *args) -> Any:
+    """Вызывает метод хранилища кэша, не блокируя event loop для сетевых хранилищ."""
+    fn = getattr(RESPONSE_CACHE, method)
+    if RESPONSE_CACHE.blocking:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+
+def _token_bucket_step(
+    tokens: Optional[float], updated: float, capacity: float, rate: float, now: float
+) -> Tuple[bool, float]:
+    """Шаг token bucket: пополняет корзину за прошедшее время и забирает токен, если он есть."""
+    tokens = capacity if tokens is None else min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+def _bucket_params(policy: Dict[str, Any]) -> Tuple[float, float]:
+    """Ёмкость корзины и скорость пополнения (токенов в секунду) для политики лимита."""
+    capacity = float(policy.get("burst") or policy["requests"])
+    return capacity, policy["requests"] / float(policy.get("window_seconds") or 60)
+
+
+def _bucket_result(allowed: bool, tokens: float, capacity: float, rate: float) -> Tuple[bool, int, float, float]:
+    return allowed, int(tokens), (capacity - tokens) / rate, 0.0 if allowed else (1 - tokens) / rate
+
+
+class RateLimitStore:
+    """Хранилище состояния лимитов запросов.
+
+    hit() учитывает запрос по ключу и возвращает (разрешён, осталось запросов,
+    секунд до полного восстановления лимита, секунд до следующей попытки).
+    """
+
+    name = "base"
+    # Методы выполняют сетевые вызовы и должны выполняться вне event loop
+    blocking = False
+
+    def hit(self, key: str, policy: Dict[str, Any], now: float) -> Tuple[bool, int, float, float]:
+        raise NotImplementedError
+
+    def purge_idle(self, now: float) -> int:
+        """Удаляет состояния ключей, лимит которых полностью восстановился."""
+        return 0
+
+    def size(self) -> int:
+        return 0
+
+
+class LocalRateLimitStore(RateLimitStore):
+    """Состояние лимитов в памяти процесса.
+
+    Не больше max_keys ключей: при переполнении вытесняется давно не использованный
+    (OrderedDict в порядке использования). Ключи, лимит которых полностью
+    восстановился, удаляются фоновой задачей.
+    """
+
+    name = "local"
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # ключ -> [момент простоя, состояние]: (tokens, updated) или deque моментов запросов
+        self._state: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, policy: Dict[str, Any], now: float) -> Tuple[bool, int, float, float]:
+        with self._lock:
+            entry = self._state.get(key)
+            if entry is not None:
+                self._state.move_to_end(key)
+            window = float(policy.get("window_seconds") or 60)
+            if policy.get("algorithm") == "sliding_log":
+                limit = policy["requests"]
+                log = entry[1] if entry is not None and isinstance(entry[1], deque) else deque()
+                while log and log[0] <= now - window:
+                    log.popleft()
+                allowed = len(log) < limit
+                if allowed:
+                    log.append(now)
+                reset = log[0] + window - now if log else 0.0
+                self._state[key] = [now + window, log]
+                result = (allowed, limit - len(log), reset, 0.0 if allowed else reset)
+            else:
+                capacity, rate = _bucket_params(policy)
+                tokens, updated = entry[1] if entry is not None and isinstance(entry[1], tuple) else (None, now)
+                allowed, tokens = _token_bucket_step(tokens, updated, capacity, rate, now)
+                self._state[key] = [now + capacity / rate, (tokens, now)]
+                result = _bucket_result(allowed, tokens, capacity, rate)
+            if self.max_keys and len(self._state) > self.max_keys:
+                self._state.popitem(last=False)
+                RATE_LIMIT_EVICTIONS.inc()
+            return result
+
+    def purge_idle(self, now: float) -> int:
+        with self._lock:
+            idle = [key for key, entry in self._state.items() if entry[0] <= now]
+            for key in idle:
+                del self._state[key]
+            return len(idle)
+
+    def size(self) -> int:
+        return len(self._state)
+
+
+class SharedMemoryRateLimitStore(RateLimitStore):
+    """Состояние лимитов в общей памяти (mmap файла в /dev/shm), общее для всех воркеров на хосте.
+
+    Таблица из slots слотов фиксированного размера (хэш ключа, момент простоя и три
+    числа состояния), открытая адресация с окном из PROBE слотов; при переполнении
+    окна вытесняется слот, простаивающий дольше всех. Блокировки — как у общего кэша.
+    sliding_log здесь приближается скользящим окном из двух счётчиков
+    (текущее и предыдущее окно) — точный журнал не помещается в слот.
+    """
+
+    name = "shm"
+    MAGIC = b"MKR1"
+    PROBE = 8
+    # magic, slots
+    _HEADER = struct.Struct("<4sI")
+    HEADER_SIZE = 64
+    # key_hash, idle_at, a, b, c
+    _SLOT = struct.Struct("<Qdddd")
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = max(1, slots)
+        self.size_bytes = self.HEADER_SIZE + self.slots * self._SLOT.size
+        self._thread_lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            if os.fstat(self._fd).st_size < self.size_bytes:
+                os.ftruncate(self._fd, self.size_bytes)
+            self._mm = mmap.mmap(self._fd, self.size_bytes)
+            magic, slots_hdr = self._HEADER.unpack_from(self._mm, 0)
+            if magic != self.MAGIC or slots_hdr != self.slots:
+                self._mm[:self.size_bytes] = bytes(self.size_bytes)
+                self._HEADER.pack_into(self._mm, 0, self.MAGIC, self.slots)
+
+    def _locked(self) -> "SharedMemoryCacheBackend._Lock":
+        return SharedMemoryCacheBackend._Lock(self)
+
+    def _offset(self, index: int) -> int:
+        return self.HEADER_SIZE + index * self._SLOT.size
+
+    def _slot_for(self, key_hash: int, now: float) -> Tuple[int, Optional[Tuple[float, float, float]]]:
+        """Слот ключа и его состояние (None — новый ключ в свободном или вытесненном слоте)."""
+        start = key_hash % self.slots
+        free = None
+        oldest = None
+        for i in range(min(self.PROBE, self.slots)):
+            index = (start + i) % self.slots
+            slot_hash, idle_at, a, b, c = self._SLOT.unpack_from(self._mm, self._offset(index))
+            if slot_hash == key_hash and idle_at > now:
+                return index, (a, b, c)
+            if free is None and (slot_hash == 0 or idle_at <= now):
+                free = index
+            if oldest is None or idle_at < oldest[1]:
+                oldest = (index, idle_at)
+        if free is None:
+            free = oldest[0]
+            RATE_LIMIT_EVICTIONS.inc()
+        return free, None
+
+    def hit(self, key: str, policy: Dict[str, Any], now: float) -> Tuple[bool, int, float, float]:
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") | 1
+        window = float(policy.get("window_seconds") or 60)
+        with self._locked():
+            index, state = self._slot_for(key_hash, now)
+            if policy.get("algorithm") == "sliding_log":
+                limit = policy["requests"]
+                start, prev, curr = state if state is not None else (now - now % window, 0.0, 0.0)
+                if now >= start + window:
+                    prev = curr if now < start + 2 * window else 0.0
+                    curr = 0.0
+                    start = now - now % window
+                elapsed = now - start
+                estimate = prev * (1 - elapsed / window) + curr
+                allowed = estimate + 1 <= limit
+                if allowed:
+                    curr += 1
+                    estimate += 1
+                retry = 0.0
+                if not allowed:
+                    # Через сколько вклад предыдущего окна упадёт настолько, что запрос поместится
+                    retry = window - elapsed
+                    if prev > 0 and limit - 1 - curr >= 0:
+                        retry = min(retry, max(0.0, window * (1 - (limit - 1 - curr) / prev) - elapsed))
+                self._SLOT.pack_into(self._mm, self._offset(index), key_hash, start + 2 * window, start, prev, curr)
+                return allowed, max(0, int(limit - estimate)), window - elapsed, retry
+            capacity, rate = _bucket_params(policy)
+            tokens, updated = (state[0], state[1]) if state is not None else (None, now)
+            allowed, tokens = _token_bucket_step(tokens, updated, capacity, rate, now)
+            self._SLOT.pack_into(self._mm, self._offset(index), key_hash, now + capacity / rate, tokens, now, 0.0)
+            return _bucket_result(allowed, tokens, capacity, rate)
+
+    def size(self) -> int:
+        now = time.time()
+        with self._locked():
+            return sum(
+                1 for index in range(self.slots)
+                if self._SLOT.unpack_from(self._mm, self._offset(index))[1] > now
+            )
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """Состояние лимитов в хранилище с протоколом Redis — общее для всех воркеров и хостов.
+
+    Каждый алгоритм выполняется одним Lua-скриптом (EVAL), то есть атомарно; простаивающие
+    ключи удаляет сам Redis по PEXPIRE.
+    """
+
+    name = "redis"
+    blocking = True
+
+    TOKEN_BUCKET = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1])
+if tokens == nil then tokens = capacity
+else tokens = math.min(capacity, tokens + math.max(0, now - tonumber(state[2])) * rate) end
+local allowed = 0
+if tokens >= 1 then tokens = tokens - 1; allowed = 1 end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+    SLIDING_LOG = """
+local limit, window, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tostring(now - window))
+local count = redis.call('ZCARD', KEYS[1])
+local allowed = 0
+if count < limit then redis.call('ZADD', KEYS[1], tostring(now), ARGV[4]); count = count + 1; allowed = 1 end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+return {allowed, count, oldest[2] or tostring(now)}
+"""
+
+    def __init__(self, client: "RespClient", prefix: str):
+        self.client = client
+        self.prefix = prefix
+
+    def hit(self, key: str, policy: Dict[str, Any], now: float) -> Tuple[bool, int, float, float]:
+        window = float(policy.get("window_seconds") or 60)
+        if policy.get("algorithm") == "sliding_log":
+            limit = policy["requests"]
+            allowed, count, oldest = self.client.execute(
+                "EVAL", self.SLIDING_LOG, 1, self.prefix + key, limit, window, now, f"{now}:{os.urandom(4).hex()}"
+            )
+            reset = max(0.0, float(oldest) + window - now)
+            return bool(allowed), max(0, limit - int(count)), reset, 0.0 if allowed else reset
+        capacity, rate = _bucket_params(policy)
+        allowed, tokens = self.client.execute("EVAL", self.TOKEN_BUCKET, 1, self.prefix + key, capacity, rate, now)
+        return _bucket_result(bool(allowed), float(tokens), capacity, rate)
+
+
+def _create_rate_limit_store() -> RateLimitStore:
+    """Создаёт хранилище лимитов по MOCKL_RATE_LIMIT_BACKEND; при ошибке откатывается на local."""
+    try:
+        if RATE_LIMIT_BACKEND == "shm":
+            return SharedMemoryRateLimitStore(RATE_LIMIT_SHM_PATH, RATE_LIMIT_MAX_KEYS or 10000)
+        if RATE_LIMIT_BACKEND == "redis":
+            client = RespClient(CACHE_REDIS_URL, timeout=CACHE_REDIS_TIMEOUT_SECONDS)
+            return RedisRateLimitStore(client, RATE_LIMIT_REDIS_PREFIX)
+        if RATE_LIMIT_BACKEND != "local":
+            logger.warning(f"Unknown MOCKL_RATE_LIMIT_BACKEND={RATE_LIMIT_BACKEND}, using local rate limits")
+    except Exception as e:
+        logger.error(f"Failed to initialize {RATE_LIMIT_BACKEND} rate limit store, using local: {e}", exc_info=True)
+    return LocalRateLimitStore(RATE_LIMIT_MAX_KEYS)
+
+
+RATE_LIMIT_STORE: RateLimitStore = _create_rate_limit_store()
+
+
+async def _rate_limit_sweep_loop() -> None:
+    """Фоновая задача: удаляет состояния простаивающих ключей лимитов."""
+    while True:
+        try:
+            RATE_LIMIT_STORE.purge_idle(time.time())
+            RATE_LIMIT_KEYS.set(RATE_LIMIT_STORE.size())
+        except Exception as e:
+            logger.warning(f"Rate limit sweep failed: {e}")
+        await asyncio.sleep(5)
+
+
+async def _cache_expiry_loop() -> None:
+    """Фоновая задача: периодически удаляет истёкшие записи кэша."""
+    while True:
+        try:
+            await _cache_call("purge_expired")
+        except Exception as e:
+            logger.warning(f"Cache expiry sweep failed: {e}")
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL_SECONDS)
+
+
+class TimerWheel:
+    """Иерархическое колесо таймеров для задержек ответов.
+
+    Вместо отдельного таймера event loop на каждый задержанный ответ все ожидания
+    раскладываются по слотам колёс (уровень 0 — по тику MOCKL_TIMER_WHEEL_TICK_MS,
+    каждый следующий уровень в SLOTS раз грубее), а один таймер раз в тик будит
+    весь слот разом. Записи верхних уровней при обороте нижнего колеса
+    переносятся вниз. Задержка округляется вверх до границы тика.
+    """
+
+    SLOTS = 256
+    LEVELS = 4
+
+    def __init__(self, tick_ms: float):
+        self.tick = tick_ms / 1000.0
+        self.pending = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.wheels: List[List[List[Tuple[int, asyncio.Future]]]] = [
+            [[] for _ in range(self.SLOTS)] for _ in range(self.LEVELS)
+        ]
+        self.current_tick = 0
+        self.pending = 0
+        self._start = 0.0
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def _now_tick(self) -> int:
+        return int((self._loop.time() - self._start) / self.tick)
+
+    def sleep(self, delay_ms: float) -> "asyncio.Future":
+        """Future, который завершится не раньше чем через delay_ms."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Колесо привязано к event loop (например, новый loop после перезапуска приложения)
+            self._loop = loop
+            self._reset()
+            self._start = loop.time()
+        future = loop.create_future()
+        if self._handle is None:
+            # Колесо простаивало: догоняем текущее время без срабатываний (слоты пусты)
+            self.current_tick = self._now_tick()
+        deadline = max(self.current_tick + 1, math.ceil((self._loop.time() - self._start + delay_ms / 1000.0) / self.tick))
+        self._insert(deadline, future)
+        self.pending += 1
+        if self._handle is None:
+            self._schedule()
+        return future
+
+    def _insert(self, deadline: int, future: asyncio.Future) -> None:
+        delta = deadline - self.current_tick
+        level, span = 0, self.SLOTS
+        while delta >= span and level < self.LEVELS - 1:
+            level += 1
+            span *= self.SLOTS
+        deadline = min(deadline, self.current_tick + span - 1)
+        slot = (deadline // (self.SLOTS ** level)) % self.SLOTS
+        self.wheels[level][slot].append((deadline, future))
+
+    def _schedule(self) -> None:
+        when = self._start + (self.current_tick + 1) * self.tick
+        self._handle = self._loop.call_at(when, self._advance, when)
+
+    def _advance(self, scheduled: float) -> None:
+        TIMER_WHEEL_TICK_LAG.observe(max(0.0, self._loop.time() - scheduled))
+        target = self._now_tick()
+        while self.current_tick < target and self.pending:
+            self.current_tick += 1
+            tick = self.current_tick
+            # Оборот колеса уровня: записи соответствующего слота следующего уровня переносятся вниз
+            for level in range(1, self.LEVELS):
+                if tick % (self.SLOTS ** level):
+                    break
+                slot = self.wheels[level][(tick // (self.SLOTS ** level)) % self.SLOTS]
+                entries, slot[:] = slot[:], []
+                for deadline, future in entries:
+                    self._insert(deadline, future)
+            slot = self.wheels[0][tick % self.SLOTS]
+            if slot:
+                entries, slot[:] = slot[:], []
+                for deadline, future in entries:
+                    if deadline > tick:
+                        self._insert(deadline, future)
+                        continue
+                    self.pending -= 1
+                    if not future.done():
+                        future.set_result(None)
+        if self.pending:
+            self.current_tick = max(self.current_tick, target)
+            self._schedule()
+        else:
+            self._handle = None
+
+
+# Общее колесо таймеров задержек моков (None — обычный asyncio.sleep на каждый ответ)
+DELAY_WHEEL: Optional[TimerWheel] = TimerWheel(TIMER_WHEEL_TICK_MS) if TIMER_WHEEL_TICK_MS > 0 else None
+
+
+async def _sleep_ms(delay_ms: float) -> None:
+    """Задержка ответа мока: через колесо таймеров, если оно включено."""
+    if DELAY_WHEEL is not None:
+        await DELAY_WHEEL.sleep(delay_ms)
+    else:
+        await asyncio.sleep(delay_ms / 1000.0)
+
+
+class TimerWheelCollector:
+    """Число задержанных ответов, ожидающих в колесе таймеров."""
+
+    def collect(self):
+        gauge = GaugeMetricFamily("mockl_timer_wheel_pending", "Delayed responses waiting in the timer wheel")
+        gauge.add_metric([], DELAY_WHEEL.pending if DELAY_WHEEL is not None else 0)
+        yield gauge
+
+
+REGISTRY.register(TimerWheelCollector())
+
+
+class UpstreamClientPool:
+    """Пул httpx‑клиентов прокси: один долгоживущий клиент на upstream (схема, хост, порт).
+
+    Клиенты держат keep-alive соединения между запросами, поэтому TCP/TLS
+    устанавливается только при нехватке свободных соединений в пуле. Клиент
+    привязан к event loop, в котором создан, и пересоздаётся для другого loop.
+    Папка с квотой соединений (pool=(тег, размер)) получает отдельный клиент
+    upstream#тег с таким размером пула и не расходует соединения остальных папок.
+    Заменённые клиенты (другая квота или другой loop) закрываются, как только
+    завершатся их запросы, и не позднее aclose().
+    Клиент общий для всех вызывающих, поэтому cookies upstream не сохраняет:
+    каждый запрос несёт только Cookie своего клиента (_proxy_request_headers).
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop, Optional[int]]] = {}
+        self._retired: List[Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = []
+        # Запросы, ещё не получившие заголовки ответа, по id клиента
+        self._in_flight: Dict[int, int] = {}
+        self.http2 = PROXY_HTTP2
+        if self.http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("MOCKL_PROXY_HTTP2 requires the 'h2' package (pip install httpx[http2]); using HTTP/1.1")
+                self.http2 = False
+
+    @staticmethod
+    def upstream_key(base_url: str) -> str:
+        parsed = urlparse(base_url)
+        return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+    def _create(self, max_connections: Optional[int] = None) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            follow_redirects=True,
+            # Set-Cookie одного ответа не должен уходить в запросы других клиентов
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections or PROXY_MAX_CONNECTIONS or None,
+                max_keepalive_connections=max_connections or PROXY_MAX_KEEPALIVE_CONNECTIONS or None,
+                keepalive_expiry=PROXY_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(
+                connect=PROXY_CONNECT_TIMEOUT_SECONDS,
+                read=PROXY_READ_TIMEOUT_SECONDS,
+                write=PROXY_READ_TIMEOUT_SECONDS,
+                pool=PROXY_POOL_TIMEOUT_SECONDS,
+            ),
+        )
+
+    def get(self, base_url: str, pool: Optional[Tuple[str, int]] = None) -> httpx.AsyncClient:
+        key = self.upstream_key(base_url)
+        max_connections = None
+        if pool is not None:
+            key = f"{key}#{pool[0]}"
+            max_connections = pool[1]
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(key)
+        if entry is None or entry[1] is not loop or entry[0].is_closed or entry[2] != max_connections:
+            if entry is not None and not entry[0].is_closed:
+                self._retired.append((entry[0], entry[1]))
+            client = self._create(max_connections)
+            self._clients[key] = (client, loop, max_connections)
+            return client
+        return entry[0]
+
+    async def request(
+        self, base_url: str, method: str, url: str, stream: bool = False,
+        pool: Optional[Tuple[str, int]] = None, **kwargs,
+    ) -> httpx.Response:
+        """Выполняет запрос через пул, измеряя ожидание свободного соединения.
+
+        При stream=True тело ответа не читается: вызывающий код итерирует
+        aiter_raw()/aiter_bytes() и обязан закрыть ответ (aclose).
+        """
+        upstream = self.upstream_key(base_url)
+        started = time.perf_counter()
+        waited = False
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            nonlocal waited
+            # Первое событие соединения: новое подключение или отправка по уже открытому
+            if not waited and event_name in (
+                "connection.connect_tcp.started",
+                "http11.send_request_headers.started",
+                "http2.send_request_headers.started",
+            ):
+                waited = True
+                PROXY_POOL_WAIT.labels(upstream=upstream).observe(time.perf_counter() - started)
+            if event_name == "connection.connect_tcp.complete":
+                PROXY_CONNECTIONS_OPENED.labels(upstream=upstream).inc()
+
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = trace
+        client = self.get(base_url, pool)
+        self._in_flight[id(client)] = self._in_flight.get(id(client), 0) + 1
+        try:
+            if stream:
+                req = client.build_request(method, url, extensions=extensions, **kwargs)
+                return await client.send(req, stream=True)
+            return await client.request(method, url, extensions=extensions, **kwargs)
+        finally:
+            remaining = self._in_flight.pop(id(client)) - 1
+            if remaining:
+                self._in_flight[id(client)] = remaining
+            if self._retired:
+                await self._close_retired()
+
+    @staticmethod
+    def _pool_connections(client: httpx.AsyncClient) -> list:
+        """Соединения пула httpcore клиента.
+
+        Публичного API у httpx для этого нет: читаются внутренние client._transport._pool
+        и его connections (httpx 0.28 / httpcore 1.0). Если устройство изменится,
+        список будет пустым — метрики пула обнулятся, а занятость клиента будет
+        определяться только по счётчику запросов без заголовков ответа.
+        """
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        return list(getattr(pool, "connections", []) or [])
+
+    def _busy(self, client: httpx.AsyncClient) -> bool:
+        """Есть ли у клиента запросы в работе (в том числе незакрытые потоковые ответы)."""
+        if self._in_flight.get(id(client)):
+            return True
+        # Незакрытый потоковый ответ держит соединение пула занятым
+        return any(not c.is_idle() for c in self._pool_connections(client))
+
+    async def _close_retired(self, force: bool = False) -> None:
+        """Закрывает заменённые клиенты без запросов в работе (force — все клиенты текущего loop)."""
+        loop = asyncio.get_running_loop()
+        retired, self._retired = self._retired, []
+        for client, client_loop in retired:
+            if client_loop.is_closed():
+                # Соединения клиента закрылись вместе с его event loop
+                continue
+            if not force and self._busy(client):
+                self._retired.append((client, client_loop))
+            elif client_loop is loop:
+                await client.aclose()
+            elif client_loop.is_running() and not self._busy(client):
+                asyncio.run_coroutine_threadsafe(client.aclose(), client_loop)
+            else:
+                # Остановленный loop не выполнит aclose: клиент ждёт его перезапуска или закрытия
+                self._retired.append((client, client_loop))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Число активных и простаивающих соединений по upstream."""
+        result = {}
+        for key, (client, _, _) in list(self._clients.items()):
+            connections = self._pool_connections(client)
+            idle = sum(1 for c in connections if c.is_idle())
+            result[key] = {"active": len(connections) - idle, "idle": idle}
+        return result
+
+    async def aclose(self) -> None:
+        clients, self._clients = list(self._clients.values()), {}
+        for client, loop, _ in clients:
+            if loop is asyncio.get_running_loop():
+                await client.aclose()
+            elif not client.is_closed:
+                self._retired.append((client, loop))
+        await self._close_retired(force=True)
+
+
+PROXY_CLIENTS = UpstreamClientPool()
+
+
+class ProxyPoolCollector:
+    """Метрики пула соединений прокси, снимаемые в момент запроса /metrics."""
+
+    def collect(self):
+        family = GaugeMetricFamily(
+            "mockl_proxy_pool_connections",
+            "Pooled upstream connections by state",
+            labels=["upstream", "state"],
+        )
+        for upstream, counts in PROXY_CLIENTS.stats().items():
+            for state, value in counts.items():
+                family.add_metric([upstream, state], value)
+        yield family
+
+
+REGISTRY.register(ProxyPoolCollector())
+
+
+class SlidingWindowCounter:
+    """Число событий за последние window секунд: посекундные корзины, память O(window)."""
+
+    __slots__ = ("window", "buckets", "total")
+
+    def __init__(self, window: int):
+        self.window = max(1, int(window))
+        self.buckets: "deque[List[int]]" = deque()
+        self.total = 0
+
+    def _trim(self, now: float) -> None:
+        cutoff = int(now) - self.window
+        while self.buckets and self.buckets[0][0] <= cutoff:
+            self.total -= self.buckets.popleft()[1]
+
+    def add(self, n: int = 1, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        second = int(now)
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += n
+        else:
+            self.buckets.append([second, n])
+        self.total += n
+        self._trim(now)
+
+    def value(self, now: Optional[float] = None) -> int:
+        self._trim(time.monotonic() if now is None else now)
+        return self.total
+
+    def clear(self) -> None:
+        self.buckets.clear()
+        self.total = 0
+
+
+class CircuitOpenError(Exception):
+    """Запрос к upstream не выполнен: circuit breaker папки разомкнут."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit breaker is open, retry after {retry_after:.1f}s")
+        self.retry_after = max(0.0, retry_after)
+
+
+class CircuitBreaker:
+    """Circuit breaker upstream папки по доле ошибок в скользящем окне.
+
+    closed — запросы проходят; если за window_seconds было не меньше min_requests
+    запросов и доля ошибок (исключения и ответы 5xx) достигла failure_rate, цепь
+    размыкается. open — запросы отклоняются open_seconds, затем half_open: проходит
+    один пробный запрос, успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, folder: str, failure_rate: float, window_seconds: int, min_requests: int, open_seconds: float):
+        self.folder = folder
+        self.params = (failure_rate, window_seconds, min_requests, open_seconds)
+        self.failure_rate = failure_rate
+        self.min_requests = max(1, min_requests)
+        self.open_seconds = open_seconds
+        self.requests = SlidingWindowCounter(window_seconds)
+        self.failures = SlidingWindowCounter(window_seconds)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def current_state(self, now: Optional[float] = None) -> str:
+        now = time.monotonic() if now is None else now
+        if self.state == self.OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = self.HALF_OPEN
+            self.probe_in_flight = False
+        return self.state
+
+    def failure_ratio(self) -> float:
+        total = self.requests.value()
+        return self.failures.value() / total if total else 0.0
+
+    def acquire(self) -> None:
+        """Разрешает запрос или бросает CircuitOpenError."""
+        now = time.monotonic()
+        state = self.current_state(now)
+        if state == self.OPEN:
+            PROXY_CIRCUIT_REJECTED.labels(folder=self.folder).inc()
+            raise CircuitOpenError(self.open_seconds - (now - self.opened_at))
+        if state == self.HALF_OPEN:
+            if self.probe_in_flight:
+                PROXY_CIRCUIT_REJECTED.labels(folder=self.folder).inc()
+                raise CircuitOpenError(self.open_seconds)
+            self.probe_in_flight = True
+
+    def release(self) -> None:
+        """Запрос отменён до получения результата (например, клиент закрыл соединение)."""
+        self.probe_in_flight = False
+
+    def record(self, success: bool) -> None:
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = False
+            if success:
+                self.state = self.CLOSED
+                logger.info(f"Proxy circuit breaker closed for folder '{self.folder}'")
+            else:
+                self._open(now)
+            return
+        if self.state == self.OPEN:
+            # Ответ на запрос, начатый до размыкания
+            return
+        self.requests.add(1, now)
+        if not success:
+            self.failures.add(1, now)
+        total = self.requests.value(now)
+        if total >= self.min_requests and self.failures.value(now) / total >= self.failure_rate:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self.opened_at = now
+        self.requests.clear()
+        self.failures.clear()
+        PROXY_CIRCUIT_TRIPS.labels(folder=self.folder).inc()
+        logger.warning(f"Proxy circuit breaker opened for folder '{self.folder}' for {self.open_seconds}s")
+
+
+class RetryBudget:
+    """Бюджет повторов папки: за окно повторов не больше ratio от числа запросов.
+
+    При малом потоке запросов разрешается MOCKL_PROXY_RETRY_BUDGET_MIN_RETRIES повторов за окно.
+    """
+
+    def __init__(self, ratio: float, window_seconds: int):
+        self.params = (ratio, window_seconds)
+        self.ratio = ratio
+        self.requests = SlidingWindowCounter(window_seconds)
+        self.retries = SlidingWindowCounter(window_seconds)
+
+    def record_request(self) -> None:
+        self.requests.add()
+
+    def try_spend(self) -> bool:
+        allowed = max(PROXY_RETRY_BUDGET_MIN_RETRIES, int(self.ratio * self.requests.value()))
+        if self.retries.value() >= allowed:
+            return False
+        self.retries.add()
+        return True
+
+
+# Состояние устойчивости прокси по папкам (name|parent); живёт в памяти процесса
+CIRCUIT_BREAKERS: Dict[str, CircuitBreaker] = {}
+RETRY_BUDGETS: Dict[str, RetryBudget] = {}
+
+
+class CircuitBreakerCollector:
+    """Состояние circuit breaker'ов прокси, снимаемое в момент запроса /metrics."""
+
+    def collect(self):
+        states = GaugeMetricFamily(
+            "mockl_proxy_circuit_state",
+            "Proxy circuit breaker state by folder (1 for the current state)",
+            labels=["folder", "state"],
+        )
+        ratios = GaugeMetricFamily(
+            "mockl_proxy_circuit_failure_ratio",
+            "Share of failed upstream requests in the circuit breaker window",
+            labels=["folder"],
+        )
+        for folder, breaker in list(CIRCUIT_BREAKERS.items()):
+            current = breaker.current_state()
+            for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN):
+                states.add_metric([folder, state], 1 if state == current else 0)
+            ratios.add_metric([folder], breaker.failure_ratio())
+        yield states
+        yield ratios
+
+
+REGISTRY.register(CircuitBreakerCollector())
+
+
+class UpstreamState:
+    """Состояние реплики upstream в балансировщике папки."""
+
+    __slots__ = ("outstanding", "consecutive_failures", "ejected_until", "healthy", "health_failures", "health_passes")
+
+    def __init__(self):
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.healthy = True
+        self.health_failures = 0
+        self.health_passes = 0
+
+
+class UpstreamBalancer:
+    """Балансировка запросов папки между репликами upstream.
+
+    Стратегии: round_robin, least_outstanding (меньше всего запросов в работе) и
+    consistent_hash по значению заголовка hash_header (кольцо с виртуальными узлами,
+    при выпадении реплики переезжают только её ключи). Реплика исключается из
+    ротации активной проверкой здоровья (health_path) или пассивно — после
+    MOCKL_PROXY_EJECT_CONSECUTIVE_FAILURES ошибок подряд на MOCKL_PROXY_EJECT_SECONDS.
+    Если недоступны все реплики, запросы распределяются между всеми (panic mode).
+    """
+
+    STRATEGIES = ("round_robin", "least_outstanding", "consistent_hash")
+    VIRTUAL_NODES = 100
+    # Подряд неудачных/успешных проверок здоровья для смены состояния реплики
+    UNHEALTHY_THRESHOLD = 2
+    HEALTHY_THRESHOLD = 1
+
+    def __init__(
+        self,
+        folder: str,
+        upstreams: List[str],
+        strategy: str,
+        hash_header: Optional[str],
+        health_path: Optional[str],
+        health_interval: float,
+        previous: Optional["UpstreamBalancer"] = None,
+    ):
+        self.folder = folder
+        self.params = (tuple(upstreams), strategy, hash_header, health_path, health_interval)
+        self.upstreams = list(upstreams)
+        self.strategy = strategy if strategy in self.STRATEGIES else "round_robin"
+        self.hash_header = (hash_header or "").lower() or None
+        self.health_path = health_path
+        self.health_interval = max(1.0, health_interval)
+        self.next_health_check = 0.0
+        # При смене настроек папки состояние оставшихся реплик (исключения, здоровье) сохраняется
+        old_states = previous.states if previous is not None else {}
+        self.states = {u: old_states.get(u) or UpstreamState() for u in self.upstreams}
+        self._rr = 0
+        self._ring = sorted(
+            (self._hash(f"{u}#{i}"), u) for u in self.upstreams for i in range(self.VIRTUAL_NODES)
+        )
+        self._ring_keys = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        # Стабильный между процессами хэш (встроенный hash() рандомизирован)
+        return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def available(self, now: Optional[float] = None) -> List[str]:
+        now = time.monotonic() if now is None else now
+        ready = [u for u in self.upstreams if self.states[u].healthy and self.states[u].ejected_until <= now]
+        return ready or list(self.upstreams)
+
+    def choose(self, headers: Optional[Mapping[str, str]] = None, exclude: Tuple[str, ...] = ()) -> str:
+        candidates = self.available()
+        if exclude and len(candidates) > 1:
+            candidates = [u for u in candidates if u not in exclude] or candidates
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == "consistent_hash" and self.hash_header and headers is not None:
+            value = headers.get(self.hash_header)
+            if value:
+                allowed = set(candidates)
+                start = bisect.bisect_left(self._ring_keys, self._hash(value))
+                for i in range(len(self._ring)):
+                    upstream = self._ring[(start + i) % len(self._ring)][1]
+                    if upstream in allowed:
+                        return upstream
+        self._rr += 1
+        if self.strategy == "least_outstanding":
+            # При равенстве — по кругу, чтобы не нагружать всегда первую реплику
+            offset = self._rr % len(candidates)
+            rotated = candidates[offset:] + candidates[:offset]
+            return min(rotated, key=lambda u: self.states[u].outstanding)
+        return candidates[self._rr % len(candidates)]
+
+    def begin(self, upstream: str) -> None:
+        self.states[upstream].outstanding += 1
+
+    def end(self, upstream: str, success: Optional[bool]) -> None:
+        """Запрос завершён: success=None — отменён, результат не учитывается."""
+        state = self.states[upstream]
+        state.outstanding = max(0, state.outstanding - 1)
+        if success is None:
+            return
+        if success:
+            state.consecutive_failures = 0
+            return
+        state.consecutive_failures += 1
+        if PROXY_EJECT_CONSECUTIVE_FAILURES > 0 and state.consecutive_failures >= PROXY_EJECT_CONSECUTIVE_FAILURES:
+            state.consecutive_failures = 0
+            state.ejected_until = time.monotonic() + PROXY_EJECT_SECONDS
+            PROXY_UPSTREAM_EJECTIONS.labels(folder=self.folder, upstream=upstream).inc()
+            logger.warning(f"Upstream {upstream} of folder '{self.folder}' ejected for {PROXY_EJECT_SECONDS}s")
+
+    async def check_health(self) -> None:
+        """Активная проверка: GET health_path на каждой реплике через её пул соединений."""
+        self.next_health_check = time.monotonic() + self.health_interval
+
+        async def probe(upstream: str) -> None:
+            state = self.states[upstream]
+            try:
+                resp = await PROXY_CLIENTS.request(
+                    upstream, "GET", f"{upstream}{self.health_path}",
+                    timeout=PROXY_HEALTH_CHECK_TIMEOUT_SECONDS,
+                )
+                ok = resp.status_code < 400
+            except Exception:
+                ok = False
+            PROXY_HEALTH_CHECKS.labels(folder=self.folder, upstream=upstream, result="ok" if ok else "fail").inc()
+            if ok:
+                state.health_failures = 0
+                state.health_passes += 1
+                if not state.healthy and state.health_passes >= self.HEALTHY_THRESHOLD:
+                    state.healthy = True
+                    logger.info(f"Upstream {upstream} of folder '{self.folder}' is healthy again")
+            else:
+                state.health_passes = 0
+                state.health_failures += 1
+                if state.healthy and state.health_failures >= self.UNHEALTHY_THRESHOLD:
+                    state.healthy = False
+                    logger.warning(f"Upstream {upstream} of folder '{self.folder}' failed health checks")
+
+        await asyncio.gather(*(probe(u) for u in self.upstreams))
+
+
+# Балансировщики upstream по папкам (name|parent); создаются при первом проксированном запросе
+UPSTREAM_BALANCERS: Dict[str, UpstreamBalancer] = {}
+
+
+async def _upstream_health_loop() -> None:
+    """Фоновая задача: активные проверки здоровья реплик upstream с заданным health_path."""
+    while True:
+        now = time.monotonic()
+        for balancer in list(UPSTREAM_BALANCERS.values()):
+            if balancer.health_path and balancer.next_health_check <= now:
+                try:
+                    await balancer.check_health()
+                except Exception as e:
+                    logger.warning(f"Upstream health check failed for folder '{balancer.folder}': {e}")
+        await asyncio.sleep(1)
+
+
+class UpstreamBalancerCollector:
+    """Состояние реплик upstream, снимаемое в момент запроса /metrics."""
+
+    def collect(self):
+        available = GaugeMetricFamily(
+            "mockl_proxy_upstream_available",
+            "Upstream replica is in rotation (healthy and not ejected)",
+            labels=["folder", "upstream"],
+        )
+        outstanding = GaugeMetricFamily(
+            "mockl_proxy_upstream_outstanding_requests",
+            "Requests currently in flight to an upstream replica",
+            labels=["folder", "upstream"],
+        )
+        now = time.monotonic()
+        for folder, balancer in list(UPSTREAM_BALANCERS.items()):
+            for upstream, state in balancer.states.items():
+                in_rotation = state.healthy and state.ejected_until <= now
+                available.add_metric([folder, upstream], 1 if in_rotation else 0)
+                outstanding.add_metric([folder, upstream], state.outstanding)
+        yield available
+        yield outstanding
+
+
+REGISTRY.register(UpstreamBalancerCollector())
+
+
+# Заголовки, значения которых у upstream и мока законно различаются — в сравнении не участвуют
+SHADOW_VOLATILE_HEADERS = {"date", "server", "content-length", "etag", "last-modified", "set-cookie", "x-request-id"}
+# Условные заголовки клиента: upstream ответил бы 304, а сравнивается полный ответ мока
+SHADOW_SKIP_REQUEST_HEADERS = {"if-none-match", "if-modified-since", "if-match", "if-unmodified-since", "if-range"}
+
+
+def _json_kind(value: Any) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    return "null"
+
+
+def _json_structure_diff(expected: Any, actual: Any, path: str = "$", out: Optional[List[str]] = None, limit: int = 20) -> List[str]:
+    """Структурные различия JSON: отсутствующие и лишние ключи, несовпадение типов.
+
+    Значения не сравниваются; null совместим с любым типом (необязательные поля).
+    Для массивов сравнивается первый элемент — как схема элементов.
+    """
+    if out is None:
+        out = []
+    if len(out) >= limit or expected is None or actual is None:
+        return out
+    expected_kind, actual_kind = _json_kind(expected), _json_kind(actual)
+    if expected_kind != actual_kind:
+        out.append(f"{path}: {expected_kind} != {actual_kind}")
+    elif expected_kind == "object":
+        for k in expected:
+            if k not in actual:
+                out.append(f"{path}.{k}: missing")
+            else:
+                _json_structure_diff(expected[k], actual[k], f"{path}.{k}", out, limit)
+        out.extend(f"{path}.{k}: unexpected" for k in actual if k not in expected)
+    elif expected_kind == "array" and expected and actual:
+        _json_structure_diff(expected[0], actual[0], f"{path}[0]", out, limit)
+    del out[limit:]
+    return out
+
+
+class ShadowMirror:
+    """Теневой режим: копия запроса, обслуженного моком, уходит upstream в фоне.
+
+    Запросы ставятся в ограниченную очередь (MOCKL_PROXY_SHADOW_QUEUE_SIZE) и
+    обрабатываются MOCKL_PROXY_SHADOW_WORKERS воркерами; при переполнении копия
+    отбрасывается, клиент upstream никогда не ждёт. Копируются только запросы
+    методов MOCKL_PROXY_SHADOW_METHODS к хостам, разрешённым для прокси, без
+    условных заголовков. Ответ upstream сравнивается с полным ответом мока (статус,
+    заголовки мока, структура JSON), расхождения считаются в метриках, последнее
+    расхождение каждого мока хранится в памяти.
+    """
+
+    MAX_REPORTS = 500
+
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.reports: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def start(self) -> List[asyncio.Task]:
+        self.queue = asyncio.Queue(maxsize=PROXY_SHADOW_QUEUE_SIZE)
+        return [asyncio.create_task(self._worker()) for _ in range(max(1, PROXY_SHADOW_WORKERS))]
+
+    def submit(self, job: Dict[str, Any]) -> None:
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            PROXY_SHADOW_REQUESTS.labels(folder=job["folder"], result="dropped").inc()
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._compare(job)
+            except Exception as e:
+                PROXY_SHADOW_REQUESTS.labels(folder=job["folder"], result="error").inc()
+                logger.debug(f"Shadow request for mock {job['mock_id']} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _compare(self, job: Dict[str, Any]) -> None:
+        base_url = job["base_url"]
+        if not _proxy_host_allowed(base_url):
+            PROXY_SHADOW_REQUESTS.labels(folder=job["folder"], result="blocked").inc()
+            return
+        proxied = await PROXY_CLIENTS.request(
+            base_url, job["method"], f"{base_url}{job['full_inner']}",
+            headers=job["headers"], content=job["body"],
+        )
+        drift: Dict[str, List[str]] = {}
+        if proxied.status_code != job["status_code"]:
+            drift["status"] = [f"{job['status_code']} != {proxied.status_code}"]
+        header_diff = []
+        for k, v in (job["response_headers"] or {}).items():
+            kl = k.lower()
+            if kl in SHADOW_VOLATILE_HEADERS:
+                continue
+            actual = proxied.headers.get(kl)
+            if actual is None:
+                header_diff.append(f"{k}: missing")
+            elif kl == "content-type" and str(v).split(";")[0].strip().lower() != actual.split(";")[0].strip().lower():
+                header_diff.append(f"{k}: {v} != {actual}")
+        if header_diff:
+            drift["headers"] = header_diff
+        expected_body = job["response_body"]
+        if isinstance(expected_body, (dict, list)):
+            try:
+                actual_body = json_loads(proxied.content)
+            except (UnicodeDecodeError, ValueError):
+                drift["body"] = ["$: upstream body is not JSON"]
+            else:
+                body_diff = _json_structure_diff(expected_body, actual_body)
+                if body_diff:
+                    drift["body"] = body_diff
+
+        folder, mock_id = job["folder"], job["mock_id"]
+        PROXY_SHADOW_REQUESTS.labels(folder=folder, result="drift" if drift else "match").inc()
+        if not drift:
+            self.reports.pop(mock_id, None)
+            return
+        for kind in drift:
+            SHADOW_DRIFT.labels(folder=folder, mock_id=mock_id, kind=kind).inc()
+        self.reports.pop(mock_id, None)
+        self.reports[mock_id] = {
+            "mock_id": mock_id,
+            "folder": folder,
+            "method": job["method"],
+            "path": job["full_inner"],
+            "expected_status": job["status_code"],
+            "upstream_status": proxied.status_code,
+            "drift": drift,
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+        }
+        while len(self.reports) > self.MAX_REPORTS:
+            self.reports.popitem(last=False)
+
+
+SHADOW_MIRROR = ShadowMirror()
 
 
 # Создаём движок с SSL
@@ -151,9 +2531,69 @@ engine = create_engine(
 
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-Base = declarative_base()
 
 
+def _folder_cache_tag(folder_name: str, folder_parent: Optional[str] = None) -> str:
+    """Тег папки для индекса кэша: name для корневых папок, name|parent для подпапок."""
+    return f"{folder_name}|{folder_parent}" if folder_parent else folder_name
+
+
+def _schedule_cache_invalidation(
+    db: Session,
+    mock_id: Optional[str] = None,
+    folder: Optional[str] = None,
+    path_prefix: Optional[str] = None,
+) -> None:
+    """Откладывает инвалидацию кэша до успешного коммита сессии."""
+    db.info.setdefault("cache_invalidations", []).append((mock_id, folder, path_prefix))
+
+
+def _invalidate_cache_entries(invalidations: List[Tuple[Optional[str], Optional[str], Optional[str]]]) -> None:
+    for mock_id, folder, path_prefix in invalidations:
+        try:
+            removed = RESPONSE_CACHE.invalidate(mock_id, folder, path_prefix)
+            logger.debug(f"Cache invalidated: mock_id={mock_id}, folder={folder}, path_prefix={path_prefix}, removed={removed}")
+        except Exception as e:
+            logger.warning(f"Cache invalidation failed (mock_id={mock_id}, folder={folder}): {e}")
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _run_cache_invalidations(session: Session) -> None:
+    invalidations = session.info.pop("cache_invalidations", [])
+    if not invalidations:
+        return
+    for mock_id, _, _ in invalidations:
+        if mock_id is not None:
+            _forget_compiled_mock(mock_id)
+            DELAY_SAMPLERS.pop(mock_id, None)
+    if RESPONSE_CACHE.blocking:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            # Коммит из async‑обработчика: сетевое хранилище не должно блокировать event loop,
+            # обработчик дожидается инвалидации через _await_cache_invalidations до ответа
+            future = loop.run_in_executor(None, _invalidate_cache_entries, invalidations)
+            session.info.setdefault("cache_invalidation_futures", []).append(future)
+            return
+    _invalidate_cache_entries(invalidations)
+
+
+async def _await_cache_invalidations(db: Session) -> None:
+    """Дожидается инвалидаций кэша, запущенных коммитом из async‑обработчика."""
+    futures = db.info.pop("cache_invalidation_futures", [])
+    if futures:
+        await asyncio.gather(*futures)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_cache_invalidations(session: Session) -> None:
+    session.info.pop("cache_invalidations", None)
+
+
+Base = declarative_base()
+
 
 class Folder(Base):
     __tablename__ = "folders"
@@ -166,6 +2606,45 @@ class Folder(Base):
     # Настройки прокси для папки
     proxy_enabled = Column(Boolean, default=False)
     proxy_base_url = Column(String, nullable=True)
+    # Потоковая передача тела запроса/ответа upstream без буферизации
+    proxy_streaming = Column(Boolean, default=False)
+    # Кэш ответов прокси (GET): TTL для ответов без Cache-Control и окно отдачи устаревших ответов
+    proxy_cache_enabled = Column(Boolean, default=False)
+    proxy_cache_ttl_seconds = Column(Integer, default=0)
+    proxy_cache_stale_seconds = Column(Integer, default=0)
+    # Устойчивость прокси: таймауты (NULL — глобальные), circuit breaker, повторы, резервный мок
+    proxy_connect_timeout_seconds = Column(Float, nullable=True)
+    proxy_read_timeout_seconds = Column(Float, nullable=True)
+    proxy_total_timeout_seconds = Column(Float, nullable=True)
+    proxy_breaker_enabled = Column(Boolean, default=False)
+    proxy_breaker_failure_rate = Column(Float, default=0.5)
+    proxy_breaker_window_seconds = Column(Integer, default=30)
+    proxy_breaker_min_requests = Column(Integer, default=10)
+    proxy_breaker_open_seconds = Column(Integer, default=30)
+    proxy_retry_attempts = Column(Integer, default=0)
+    proxy_retry_budget_ratio = Column(Float, default=0.2)
+    proxy_fallback_mock_id = Column(String, nullable=True)
+    # Несколько реплик upstream (NULL — только proxy_base_url) и балансировка между ними
+    proxy_upstreams = Column(SAJSON, nullable=True)
+    proxy_balancing = Column(String, default="round_robin")
+    proxy_hash_header = Column(String, nullable=True)
+    proxy_health_check_path = Column(String, nullable=True)
+    proxy_health_check_interval_seconds = Column(Integer, default=10)
+    # Режим записи: проксированные ответы сохраняются как моки папки
+    proxy_record_enabled = Column(Boolean, default=False)
+    proxy_record_strip_headers = Column(Boolean, default=True)
+    # Теневой режим: доля запросов, обслуженных моками, которая дублируется upstream для сравнения
+    proxy_shadow_enabled = Column(Boolean, default=False)
+    proxy_shadow_sample_rate = Column(Float, default=0.1)
+    # Виртуальное время: задержки моков папки не выполняются, а сообщаются в заголовке и истории
+    virtual_time = Column(Boolean, default=False)
+    # Воспроизводимая имитация: seed генератора задержек и ошибок (NULL — случайно) и поток по ключу запроса
+    random_seed = Column(BigInteger, nullable=True)
+    random_keyed = Column(Boolean, default=False)
+    # Лимит запросов папки (RateLimitPolicy)
+    rate_limit = Column(SAJSON, nullable=True)
+    # Бюджеты одновременных запросов, соединений с БД и upstream папки (FolderBulkheadPolicy)
+    bulkhead = Column(SAJSON, nullable=True)
     # Порядок отображения папки
     order = Column(Integer, default=0, index=True)
     # Вложенные папки - используем primaryjoin для правильной связи
@@ -219,6 +2698,16 @@ class Mock(Base):
     # Диапазон задержки (для случайной задержки)
     delay_range_min_ms = Column(Integer, nullable=True)
     delay_range_max_ms = Column(Integer, nullable=True)
+    # Профиль задержки (распределение); если задан, заменяет delay_ms и диапазон
+    delay_profile = Column(SAJSON, nullable=True)
+    # Медленная сеть: скорость отдачи тела (КБ/с), размер порции и chunked transfer без Content-Length
+    throttle_kbps = Column(Float, nullable=True)
+    throttle_chunk_bytes = Column(Integer, nullable=True)
+    throttle_chunked = Column(Boolean, default=False)
+    # Сетевые сбои ответа (список MockChaosFault), применяются ChaosMiddleware
+    chaos = Column(SAJSON, nullable=True)
+    # Лимит запросов мока (RateLimitPolicy)
+    rate_limit = Column(SAJSON, nullable=True)
     # Порядок отображения мока в папке
     order = Column(Integer, default=0, index=True)
     # Настройки кэширования
@@ -230,6 +2719,13 @@ class Mock(Base):
     error_simulation_status_code = Column(Integer, nullable=True)
     error_simulation_body = Column(SAJSON, nullable=True)
     error_simulation_delay_ms = Column(Integer, nullable=True)
+    # Версия конфигурации ответа: увеличивается при каждом сохранении мока,
+    # по ней определяется актуальность скомпилированного ответа
+    version = Column(Integer, default=0, nullable=False)
+    # Unix‑время последнего сохранения (для Last-Modified)
+    updated_at = Column(Integer, nullable=True)
+    # Условные запросы: ETag / Last-Modified и ответы 304 Not Modified
+    conditional_requests_enabled = Column(Boolean, default=True, nullable=False)
 
     folder_obj = relationship(
         "Folder",
@@ -267,6 +2763,8 @@ class RequestLog(Base):
     request_body = Column(String, nullable=True)  # Тело запроса (как строка)
     response_headers = Column(SAJSON, nullable=True)  # Заголовки ответа
     response_body = Column(String, nullable=True)  # Тело ответа (как строка)
+    # Пропущенная задержка в режиме виртуального времени (входит в response_time_ms)
+    simulated_delay_ms = Column(Integer, nullable=True)
 
 
 
@@ -301,6 +2799,489 @@ app.add_middleware(
 )
 
 
+# Ключ scope, через который mock_handler передаёт ASGI-слою выбранный сетевой сбой
+CHAOS_SCOPE_KEY = "mockl.chaos"
+
+
+class ChaosAbort(Exception):
+    """Прерывает отправку ответа после внесённого сетевого сбоя."""
+
+
+def _connection_transport(receive) -> Optional[asyncio.Transport]:
+    """Транспорт соединения uvicorn (receive — метод цикла запроса); None для других серверов."""
+    return getattr(getattr(receive, "__self__", None), "transport", None)
+
+
+async def _chaos_close(receive, reset: bool) -> None:
+    """Закрывает соединение: reset=True — TCP RST (SO_LINGER 0), иначе обычный FIN.
+
+    Без доступа к транспорту соединение закрывает сервер, увидев незавершённый ответ.
+    """
+    transport = _connection_transport(receive)
+    if transport is not None and not transport.is_closing():
+        if reset:
+            sock = transport.get_extra_info("socket")
+            if sock is not None:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                except OSError:
+                    pass
+            transport.abort()
+        else:
+            transport.close()
+        # Даём серверу обработать закрытие, чтобы он не пытался дописать ответ
+        await asyncio.sleep(0)
+    raise ChaosAbort()
+
+
+class ChaosMiddleware:
+    """ASGI-слой сетевых сбоев перед mock_handler.
+
+    Обработчик выбирает сбой мока (поле chaos) и кладёт его в scope; слой применяет
+    его к сообщениям ответа: сброс соединения до или после заголовков, закрытие без
+    ответа, обрыв тела после N байт, пауза посреди тела, испорченный chunked encoding,
+    медленные заголовки. Запросы без сбоя проходят без изменений.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = {"sent": 0, "limit": None, "done": False}
+
+        async def chaos_send(message) -> None:
+            fault = scope.get(CHAOS_SCOPE_KEY)
+            if fault is None or state["done"]:
+                await send(message)
+                return
+            kind = fault["type"]
+            if message["type"] == "http.response.start":
+                if kind == "slow_headers":
+                    await _sleep_ms(fault.get("stall_ms") or 0)
+                    state["done"] = True
+                elif kind in ("reset_before_headers", "close_without_response"):
+                    await _chaos_close(receive, reset=kind == "reset_before_headers")
+                elif kind == "malformed_chunked":
+                    # Без Content-Length сервер отдаёт тело в chunked encoding
+                    message = dict(message)
+                    message["headers"] = [(k, v) for k, v in message.get("headers", []) if k.lower() != b"content-length"]
+                elif fault.get("after_bytes") is not None:
+                    state["limit"] = fault["after_bytes"]
+                else:
+                    # По умолчанию сбой посередине тела
+                    length = next((v for k, v in message.get("headers", []) if k.lower() == b"content-length"), None)
+                    if length is not None and length.isdigit():
+                        state["limit"] = int(length) // 2
+                await send(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            if kind == "reset_after_headers":
+                await _chaos_close(receive, reset=True)
+            if kind == "malformed_chunked":
+                transport = _connection_transport(receive)
+                if transport is not None and not transport.is_closing():
+                    # Размер порции не шестнадцатеричный и без завершающего нулевого чанка
+                    transport.write(b"zz\r\n" + bytes(body[: max(1, len(body) // 2)]) + b"\r\n")
+                await _chaos_close(receive, reset=False)
+            if kind not in ("truncate_body", "stall"):
+                await send(message)
+                return
+            limit = state["limit"] if state["limit"] is not None else len(body) // 2
+            remaining = limit - state["sent"]
+            if len(body) <= remaining:
+                state["sent"] += len(body)
+                await send(message)
+                return
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": body[:remaining], "more_body": True})
+            if kind == "truncate_body":
+                await _chaos_close(receive, reset=False)
+            await _sleep_ms(fault.get("stall_ms") or 0)
+            state["done"] = True
+            await send({"type": "http.response.body", "body": body[max(0, remaining):], "more_body": message.get("more_body", False)})
+
+        try:
+            await self.app(scope, receive, chaos_send)
+        except ChaosAbort:
+            pass
+
+
+app.add_middleware(ChaosMiddleware)
+
+
+# Заголовки, которые mock_handler оставляет в scope для любого своего ответа (RateLimit-*)
+EXTRA_HEADERS_SCOPE_KEY = "mockl.headers"
+
+
+class ExtraHeadersMiddleware:
+    """Добавляет к ответу заголовки, оставленные обработчиком в scope.
+
+    Так заголовки попадают в ответ независимо от того, какая ветка обработчика
+    (мок, кэш, прокси, 404) его сформировала.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message) -> None:
+            if message["type"] == "http.response.start":
+                extra = scope.get(EXTRA_HEADERS_SCOPE_KEY)
+                if extra:
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+app.add_middleware(ExtraHeadersMiddleware)
+
+
+class AdmissionGate:
+    """Ограничение числа одновременно обслуживаемых запросов с короткой очередью.
+
+    Пока занято меньше limit мест, запрос проходит сразу. Иначе он ждёт в FIFO-очереди
+    не дольше timeout; при полной очереди или по таймауту запрос отклоняется.
+    Освободившееся место передаётся первому ожидающему напрямую.
+    """
+
+    def __init__(self, limit: int, queue_size: int):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.waiters: "deque[asyncio.Future]" = deque()
+
+    async def acquire(self, timeout: Optional[float], bounded: bool = True) -> Optional[str]:
+        """Занимает место; возвращает None или причину отказа (queue_full, timeout).
+
+        bounded=False ставит в очередь сверх queue_size (timeout=None — ждать без ограничения).
+        """
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return None
+        if bounded and len(self.waiters) >= self.queue_size:
+            return "queue_full"
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return None
+        except asyncio.TimeoutError:
+            if future.done():
+                # Место передали в момент таймаута — пользуемся им
+                return None
+            future.cancel()
+            self.waiters.remove(future)
+            return "timeout"
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+                if future in self.waiters:
+                    self.waiters.remove(future)
+            raise
+
+    def release(self) -> None:
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                # Место переходит ожидающему, число занятых не меняется
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+# Пути панели управления и проверок здоровья: не ограничиваются и не вытесняются нагрузкой на моки
+CONTROL_PLANE_PATHS = ("/api", "/healthz", "/readyz", "/metrics", "/info", "/docs", "/redoc", "/openapi.json")
+# Вложенные пути (/docs/oauth2-redirect); /information или /metricsx — уже пути моков
+CONTROL_PLANE_PREFIXES = tuple(p + "/" for p in CONTROL_PLANE_PATHS)
+
+ADMISSION_GLOBAL: Optional[AdmissionGate] = (
+    AdmissionGate(MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE) if MAX_IN_FLIGHT > 0 else None
+)
+ADMISSION_FOLDERS: Dict[str, AdmissionGate] = {}
+# Имена корневых папок для сопоставления пути с папкой без запроса к БД на каждый запрос
+ROOT_FOLDER_NAMES: Dict[str, Any] = {"names": frozenset(), "loaded_at": 0.0, "loading": False}
+
+
+def _is_control_plane(path: str) -> bool:
+    return path in CONTROL_PLANE_PATHS or path.startswith(CONTROL_PLANE_PREFIXES)
+
+
+def _load_root_folder_names() -> frozenset:
+    db = SessionLocal()
+    try:
+        return frozenset(name for (name,) in db.query(Folder.name).filter(Folder.parent_folder == '').all())
+    finally:
+        db.close()
+
+
+async def _admission_folder(path: str) -> str:
+    """Корневая папка запроса по первому сегменту пути (список папок обновляется раз в 5 секунд)."""
+    state = ROOT_FOLDER_NAMES
+    if time.monotonic() - state["loaded_at"] > 5 and not state["loading"]:
+        state["loading"] = True
+        try:
+            state["names"] = await run_in_threadpool(_load_root_folder_names)
+            state["loaded_at"] = time.monotonic()
+        except Exception as e:
+            logger.warning(f"Failed to load folder names for admission control: {e}")
+        finally:
+            state["loading"] = False
+    first = path.split("/", 2)[1]
+    return first if first in state["names"] else "default"
+
+
+class AdmissionCollector:
+    """Занятые места и очереди ограничения одновременных запросов, снимаемые в момент запроса /metrics."""
+
+    def collect(self):
+        in_flight = GaugeMetricFamily(
+            "mockl_admission_in_flight", "Mock requests currently admitted", labels=["scope", "folder"]
+        )
+        queued = GaugeMetricFamily(
+            "mockl_admission_queued", "Mock requests waiting for admission", labels=["scope", "folder"]
+        )
+        gates = [("global", "", ADMISSION_GLOBAL)] if ADMISSION_GLOBAL is not None else []
+        gates += [("folder", name, gate) for name, gate in list(ADMISSION_FOLDERS.items())]
+        for scope, folder, gate in gates:
+            in_flight.add_metric([scope, folder], gate.in_flight)
+            queued.add_metric([scope, folder], len(gate.waiters))
+        yield in_flight
+        yield queued
+
+
+REGISTRY.register(AdmissionCollector())
+
+
+class AdmissionControlMiddleware:
+    """Ограничение одновременных запросов к мокам (глобально и на корневую папку) со сбросом нагрузки.
+
+    Сначала занимается место папки, затем глобальное, поэтому запросы перегруженной
+    папки ждут в своей очереди и не занимают общие места. Отклонённые запросы сразу
+    получают 503 с Retry-After. Панель управления (/api/*) и проверки здоровья не ограничиваются.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def _shed(self, scope, receive, send, gate_scope: str, folder: str, reason: str) -> None:
+        ADMISSION_SHED.labels(scope=gate_scope, folder=folder, reason=reason).inc()
+        resp = JSONResponse(
+            content={"detail": "Server overloaded"},
+            status_code=503,
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+        )
+        await resp(scope, receive, send)
+
+    async def _enter(self, gate: AdmissionGate, gate_scope: str) -> Optional[str]:
+        started = time.perf_counter()
+        reason = await gate.acquire(ADMISSION_QUEUE_TIMEOUT_MS / 1000)
+        waited = time.perf_counter() - started
+        if waited > 0.0001:
+            ADMISSION_WAIT.labels(scope=gate_scope).observe(waited)
+        return reason
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or _is_control_plane(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        folder_gate = None
+        folder = ""
+        if MAX_IN_FLIGHT_PER_FOLDER > 0:
+            folder = await _admission_folder(scope["path"])
+            folder_gate = ADMISSION_FOLDERS.get(folder)
+            if folder_gate is None:
+                folder_gate = ADMISSION_FOLDERS[folder] = AdmissionGate(MAX_IN_FLIGHT_PER_FOLDER, ADMISSION_QUEUE_SIZE)
+            reason = await self._enter(folder_gate, "folder")
+            if reason:
+                await self._shed(scope, receive, send, "folder", folder, reason)
+                return
+        try:
+            if ADMISSION_GLOBAL is not None:
+                reason = await self._enter(ADMISSION_GLOBAL, "global")
+                if reason:
+                    await self._shed(scope, receive, send, "global", folder, reason)
+                    return
+                try:
+                    await self.app(scope, receive, send)
+                finally:
+                    ADMISSION_GLOBAL.release()
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            if folder_gate is not None:
+                folder_gate.release()
+
+
+if ADMISSION_GLOBAL is not None or MAX_IN_FLIGHT_PER_FOLDER > 0:
+    app.add_middleware(AdmissionControlMiddleware)
+
+
+# Место папки в её бюджете (BulkheadLease), которое mock_handler оставляет в scope до отправки ответа
+BULKHEAD_SCOPE_KEY = "mockl.bulkhead"
+
+
+class FolderBulkhead:
+    """Бюджеты одновременных запросов и соединений с БД одной папки (FolderBulkheadPolicy).
+
+    Запросы папки сверх бюджета ждут в её собственной очереди или сразу получают 503,
+    не занимая места других папок. Квота соединений upstream задаётся отдельным пулом
+    клиента прокси (ProxyPolicy.pool).
+    """
+
+    def __init__(self, tag: str, params: Tuple[Any, ...]):
+        self.tag = tag
+        self.params = params
+        max_requests, max_db, queue_size, queue_timeout_ms = params
+        self.timeout = queue_timeout_ms / 1000
+        self.gates: Dict[str, AdmissionGate] = {}
+        if max_requests:
+            self.gates["requests"] = AdmissionGate(max_requests, queue_size)
+        if max_db:
+            self.gates["db"] = AdmissionGate(max_db, queue_size)
+
+
+FOLDER_BULKHEADS: Dict[str, FolderBulkhead] = {}
+
+
+class BulkheadLease:
+    """Занятые запросом места в бюджетах папки; освобождаются BulkheadMiddleware после ответа."""
+
+    def __init__(self, bulkhead: FolderBulkhead):
+        self.bulkhead = bulkhead
+        self.held: Set[str] = set()
+
+    def release(self, resource: Optional[str] = None) -> None:
+        for name in [resource] if resource else list(self.held):
+            if name in self.held:
+                self.held.discard(name)
+                self.bulkhead.gates[name].release()
+
+
+def _folder_bulkhead(folder: Optional["Folder"]) -> Optional[FolderBulkhead]:
+    policy = folder.bulkhead if folder is not None else None
+    if not policy or not (policy.get("max_concurrent_requests") or policy.get("max_db_connections")):
+        return None
+    tag = _folder_cache_tag(folder.name, folder.parent_folder)
+    params = (
+        policy.get("max_concurrent_requests"),
+        policy.get("max_db_connections"),
+        policy.get("queue_size", 0),
+        policy.get("queue_timeout_ms", 1000),
+    )
+    bulkhead = FOLDER_BULKHEADS.get(tag)
+    if bulkhead is None or bulkhead.params != params:
+        # Запросы, занявшие места в прежних бюджетах, освобождают их там же
+        bulkhead = FOLDER_BULKHEADS[tag] = FolderBulkhead(tag, params)
+    return bulkhead
+
+
+async def _enter_bulkhead(request: Request, db: Session, folder: Optional["Folder"], folder_name: str) -> Optional[Response]:
+    """Занимает места запроса в бюджетах папки; возвращает ответ 503, если бюджет исчерпан."""
+    bulkhead = _folder_bulkhead(folder)
+    if bulkhead is None:
+        return None
+    lease = BulkheadLease(bulkhead)
+    request.scope[BULKHEAD_SCOPE_KEY] = lease
+    for resource, gate in bulkhead.gates.items():
+        if gate.in_flight >= gate.limit or gate.waiters:
+            # Ожидание в очереди не должно держать соединение с БД
+            _release_db_connection(db)
+        reason = await gate.acquire(bulkhead.timeout)
+        if reason:
+            BULKHEAD_REJECTED.labels(folder=folder_name, resource=resource, reason=reason).inc()
+            REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="bulkhead").inc()
+            return JSONResponse(
+                content={"detail": f"Folder '{folder_name}' is over its {resource} budget"},
+                status_code=503,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+        lease.held.add(resource)
+    return None
+
+
+def _release_db_connection(db: Session) -> None:
+    """Завершает транзакцию сессии, возвращая соединение в пул.
+
+    Загруженные объекты (папка, моки) не сбрасываются, поэтому обращение к ним не
+    возьмёт соединение снова; его возьмёт только следующий запрос сессии к БД.
+    """
+    expire_on_commit = db.expire_on_commit
+    db.expire_on_commit = False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = expire_on_commit
+
+
+def _bulkhead_pause(request: Request, db: Session) -> None:
+    """Перед долгим ожиданием (задержка, upstream) возвращает соединение с БД в пул и место в квоте БД папки."""
+    lease = request.scope.get(BULKHEAD_SCOPE_KEY)
+    if lease is not None and "db" in lease.held:
+        _release_db_connection(db)
+        lease.release("db")
+
+
+async def _bulkhead_resume(request: Request) -> None:
+    """Возвращает запросу место в квоте БД после ожидания; начатый запрос ждёт без отказа."""
+    lease = request.scope.get(BULKHEAD_SCOPE_KEY)
+    if lease is not None and "db" in lease.bulkhead.gates and "db" not in lease.held:
+        await lease.bulkhead.gates["db"].acquire(None, bounded=False)
+        lease.held.add("db")
+
+
+class BulkheadCollector:
+    """Занятые места и очереди бюджетов папок, снимаемые в момент запроса /metrics."""
+
+    def collect(self):
+        in_use = GaugeMetricFamily(
+            "mockl_bulkhead_in_use", "Folder budget slots in use", labels=["folder", "resource"]
+        )
+        queued = GaugeMetricFamily(
+            "mockl_bulkhead_queued", "Requests waiting for a folder budget slot", labels=["folder", "resource"]
+        )
+        for tag, bulkhead in list(FOLDER_BULKHEADS.items()):
+            for resource, gate in bulkhead.gates.items():
+                in_use.add_metric([tag, resource], gate.in_flight)
+                queued.add_metric([tag, resource], len(gate.waiters))
+        yield in_use
+        yield queued
+
+
+REGISTRY.register(BulkheadCollector())
+
+
+class BulkheadMiddleware:
+    """Освобождает места запроса в бюджетах папки после отправки ответа (в том числе потокового)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lease = scope.get(BULKHEAD_SCOPE_KEY) if scope["type"] == "http" else None
+            if lease is not None:
+                lease.release()
+
+
+app.add_middleware(BulkheadMiddleware)
+
+
 @app.get("/healthz", include_in_schema=False)
 async def health_check():
     """Health check endpoint - не показывается в документации."""
@@ -342,6 +3323,7 @@ async def server_info(request: Request):
           "base_url": base_url,
           "title": app.title,
           "version": app.version,
+          "json_backend": JSON_BACKEND,
       },
       "database": {
           "host": DB_HOST,
@@ -398,6 +3380,76 @@ class MockResponseConfig(BaseModel):
     body: Any = Field(..., description="Тело ответа. Обычно JSON, но может быть спец‑структура файла.")
 
 
+class MockDelayProfile(BaseModel):
+    """Профиль задержки ответа: распределение, из которого берётся задержка каждого ответа."""
+
+    type: str = Field(
+        ...,
+        pattern="^(normal|lognormal|pareto|empirical)$",
+        description="normal, lognormal, pareto или empirical (по записанному времени ответа upstream для пути мока)",
+    )
+    mean_ms: Optional[float] = Field(default=None, ge=0, description="normal: среднее (по умолчанию delay_ms)")
+    stddev_ms: Optional[float] = Field(default=None, ge=0, description="normal: стандартное отклонение (по умолчанию mean_ms / 4)")
+    median_ms: Optional[float] = Field(default=None, gt=0, description="lognormal: медиана (по умолчанию delay_ms)")
+    sigma: Optional[float] = Field(default=None, ge=0, description="lognormal: разброс логарифма (по умолчанию 0.5)")
+    scale_ms: Optional[float] = Field(default=None, gt=0, description="pareto: минимальная задержка (по умолчанию delay_ms)")
+    alpha: Optional[float] = Field(default=None, gt=0, description="pareto: показатель хвоста, чем меньше — тем тяжелее (по умолчанию 2.5)")
+    samples: Optional[int] = Field(default=None, ge=1, description="empirical: сколько последних записей request_logs использовать (по умолчанию 1000)")
+    min_ms: Optional[int] = Field(default=None, ge=0, description="Нижняя граница задержки")
+    max_ms: Optional[int] = Field(default=None, ge=0, description="Верхняя граница задержки")
+
+
+class MockChaosFault(BaseModel):
+    """Сетевой сбой ответа мока, вносимый с заданной вероятностью."""
+
+    type: str = Field(
+        ...,
+        pattern="^(reset_before_headers|reset_after_headers|close_without_response|truncate_body|stall|malformed_chunked|slow_headers)$",
+        description=(
+            "reset_before_headers, reset_after_headers (TCP RST), close_without_response, truncate_body, "
+            "stall (пауза посреди тела), malformed_chunked или slow_headers (пауза перед заголовками)"
+        ),
+    )
+    probability: float = Field(..., gt=0, le=1, description="Вероятность сбоя")
+    after_bytes: Optional[int] = Field(
+        default=None, ge=0, description="truncate_body/stall: сколько байт тела отдать до сбоя (по умолчанию половину)"
+    )
+    stall_ms: Optional[int] = Field(default=None, ge=0, description="stall/slow_headers: длительность паузы, мс")
+
+
+class RateLimitPolicy(BaseModel):
+    """Лимит запросов папки или мока."""
+
+    requests: int = Field(..., ge=1, description="Сколько запросов разрешено за окно")
+    window_seconds: float = Field(default=60, gt=0, description="Окно лимита, секунды")
+    algorithm: str = Field(
+        default="token_bucket",
+        pattern="^(token_bucket|sliding_log)$",
+        description="token_bucket (равномерное пополнение, допускает всплески до burst) или sliding_log (точное скользящее окно)",
+    )
+    burst: Optional[int] = Field(default=None, ge=1, description="token_bucket: ёмкость корзины (по умолчанию requests)")
+    per_client: bool = Field(default=False, description="Отдельный лимит для каждого клиента")
+    key_header: Optional[str] = Field(
+        default=None, description="Заголовок с ключом клиента (например X-Api-Key); по умолчанию IP"
+    )
+
+
+class FolderBulkheadPolicy(BaseModel):
+    """Бюджеты папки, изолирующие её медленные моки и upstream от остальных папок."""
+
+    max_concurrent_requests: Optional[int] = Field(
+        default=None, ge=1, description="Сколько запросов к папке обслуживается одновременно (включая задержки и прокси)"
+    )
+    max_db_connections: Optional[int] = Field(
+        default=None, ge=1,
+        description="Сколько запросов папки одновременно держат соединение с БД (на время задержек и прокси оно возвращается в пул)",
+    )
+    max_proxy_connections: Optional[int] = Field(
+        default=None, ge=1, description="Отдельный пул соединений upstream папки такого размера"
+    )
+    queue_size: int = Field(default=0, ge=0, description="Сколько запросов ждут свободного места (0 — сразу 503)")
+    queue_timeout_ms: float = Field(default=1000, ge=0, description="Максимальное ожидание места в очереди, мс")
+
 
 class MockEntry(BaseModel):
     """Полное описание мока."""
@@ -440,6 +3492,32 @@ class MockEntry(BaseModel):
         default=None,
         description="Максимальная задержка в миллисекундах для случайной задержки из диапазона.",
     )
+    delay_profile: Optional[MockDelayProfile] = Field(
+        default=None,
+        description="Профиль задержки (распределение). Если задан, заменяет delay_ms и диапазон задержки.",
+    )
+    throttle_kbps: Optional[float] = Field(
+        default=None,
+        gt=0,
+        description="Скорость отдачи тела ответа в КБ/с (медленная сеть). Задержка delay_ms — время до первого байта.",
+    )
+    throttle_chunk_bytes: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Размер порции тела в байтах (по умолчанию MOCKL_THROTTLE_CHUNK_BYTES).",
+    )
+    throttle_chunked: Optional[bool] = Field(
+        default=False,
+        description="Отдавать тело порциями в chunked transfer encoding, без Content-Length.",
+    )
+    chaos: Optional[List[MockChaosFault]] = Field(
+        default=None,
+        description="Сетевые сбои (сброс соединения, обрыв тела и т.п.); срабатывает первый, выпавший по вероятности.",
+    )
+    rate_limit: Optional[RateLimitPolicy] = Field(
+        default=None,
+        description="Лимит запросов к моку; при превышении — 429 с Retry-After и RateLimit-* (имитация троттлинга upstream).",
+    )
     cache_enabled: Optional[bool] = Field(
         default=False,
         description="Включено ли кэширование ответа для этого мока.",
@@ -468,6 +3546,10 @@ class MockEntry(BaseModel):
         default=None,
         description="Задержка в миллисекундах перед возвратом ошибки.",
     )
+    conditional_requests_enabled: Optional[bool] = Field(
+        default=True,
+        description="Добавлять ETag / Last-Modified и отвечать 304 Not Modified на If-None-Match и If-Modified-Since.",
+    )
     order: Optional[int] = Field(
         default=None,
         description="Порядок отображения мока в папке. Если не указан, мок будет добавлен в конец.",
@@ -521,6 +3603,114 @@ class FolderSettings(BaseModel):
         default=None,
         description="Базовый URL реального backend, куда проксировать запросы без мока",
     )
+    proxy_streaming: bool = Field(
+        default=False,
+        description=(
+            "Потоковый прокси: тело запроса и ответа передаётся по мере поступления, "
+            "без разбора и перекодирования; в журнал пишется только префикс тел"
+        ),
+    )
+    proxy_cache_enabled: bool = Field(
+        default=False,
+        description="Кэшировать ответы upstream на GET‑запросы (с учётом Cache-Control)",
+    )
+    proxy_cache_ttl_seconds: int = Field(
+        default=0,
+        ge=0,
+        description="Время жизни ответа в кэше прокси, если upstream не прислал max-age/s-maxage (0 — не кэшировать)",
+    )
+    proxy_cache_stale_seconds: int = Field(
+        default=0,
+        ge=0,
+        description=(
+            "Сколько секунд после истечения отдавать устаревший ответ, обновляя его в фоне "
+            "(stale-while-revalidate) или при ошибке upstream (stale-if-error), если upstream не задал их сам"
+        ),
+    )
+    proxy_connect_timeout_seconds: Optional[float] = Field(
+        default=None, gt=0, description="Таймаут подключения к upstream (по умолчанию MOCKL_PROXY_CONNECT_TIMEOUT_SECONDS)"
+    )
+    proxy_read_timeout_seconds: Optional[float] = Field(
+        default=None, gt=0, description="Таймаут чтения ответа upstream (по умолчанию MOCKL_PROXY_READ_TIMEOUT_SECONDS)"
+    )
+    proxy_total_timeout_seconds: Optional[float] = Field(
+        default=None, gt=0, description="Общий лимит времени на запрос к upstream, включая повторы соединения"
+    )
+    proxy_breaker_enabled: bool = Field(default=False, description="Включить circuit breaker для upstream папки")
+    proxy_breaker_failure_rate: float = Field(
+        default=0.5, gt=0, le=1, description="Доля ошибок (исключения и 5xx) в окне, при которой цепь размыкается"
+    )
+    proxy_breaker_window_seconds: int = Field(default=30, ge=1, description="Окно подсчёта ошибок, секунды")
+    proxy_breaker_min_requests: int = Field(
+        default=10, ge=1, description="Минимум запросов в окне, прежде чем цепь может разомкнуться"
+    )
+    proxy_breaker_open_seconds: int = Field(
+        default=30, ge=1, description="Сколько секунд цепь разомкнута до пробного запроса (half-open)"
+    )
+    proxy_retry_attempts: int = Field(
+        default=0, ge=0, le=5, description="Повторы идемпотентных запросов после сетевой ошибки или 502/503/504"
+    )
+    proxy_retry_budget_ratio: float = Field(
+        default=0.2, gt=0, le=1, description="Бюджет повторов: не больше этой доли от числа запросов за окно"
+    )
+    proxy_fallback_mock_id: Optional[str] = Field(
+        default=None, description="Мок, которым отвечать, пока цепь разомкнута (иначе 503)"
+    )
+    proxy_upstreams: Optional[List[str]] = Field(
+        default=None,
+        description="Базовые URL реплик upstream для балансировки (если не задано — только proxy_base_url)",
+    )
+    proxy_balancing: str = Field(
+        default="round_robin",
+        pattern="^(round_robin|least_outstanding|consistent_hash)$",
+        description="Стратегия балансировки: round_robin, least_outstanding или consistent_hash",
+    )
+    proxy_hash_header: Optional[str] = Field(
+        default=None, description="Заголовок запроса, по значению которого выбирается реплика в consistent_hash"
+    )
+    proxy_health_check_path: Optional[str] = Field(
+        default=None, description="Путь активной проверки здоровья реплик (GET, ответ < 400); не задан — проверки выключены"
+    )
+    proxy_health_check_interval_seconds: int = Field(default=10, ge=1, description="Интервал проверок здоровья, секунды")
+    proxy_record_enabled: bool = Field(
+        default=False,
+        description="Режим записи: уникальные проксированные запросы (метод, путь, query, тело) сохраняются как моки папки",
+    )
+    proxy_record_strip_headers: bool = Field(
+        default=True, description="Убирать из записанных моков системные заголовки запроса и ответа"
+    )
+    proxy_shadow_enabled: bool = Field(
+        default=False,
+        description="Теневой режим: ответы моков сравниваются с ответами upstream (копия запроса уходит в фоне)",
+    )
+    proxy_shadow_sample_rate: float = Field(
+        default=0.1, ge=0, le=1, description="Доля запросов, обслуженных моками, которая дублируется upstream"
+    )
+    virtual_time: bool = Field(
+        default=False,
+        description=(
+            "Виртуальное время: задержки и ограничение скорости моков папки не выполняются, "
+            "а прибавляются к response_time_ms и сообщаются в заголовке X-Mockl-Simulated-Delay-Ms"
+        ),
+    )
+    random_seed: Optional[int] = Field(
+        default=None,
+        description="Seed генератора задержек и ошибок моков папки: одинаковый трафик даёт одинаковые сбои (None — случайно)",
+    )
+    random_keyed: bool = Field(
+        default=False,
+        description=(
+            "Отдельный поток случайных чисел для каждой пары метод+путь (seed, путь, номер запроса): "
+            "результат не зависит от чередования запросов к разным путям"
+        ),
+    )
+    rate_limit: Optional[RateLimitPolicy] = Field(
+        default=None, description="Лимит запросов к папке; при превышении — 429 с Retry-After и RateLimit-*"
+    )
+    bulkhead: Optional[FolderBulkheadPolicy] = Field(
+        default=None,
+        description="Бюджеты одновременных запросов, соединений с БД и upstream папки; при исчерпании — очередь или 503",
+    )
 
 
 
@@ -528,6 +3718,50 @@ class FolderSettingsOut(FolderSettings):
     name: str
 
 
+# Дополнительные настройки папки (помимо proxy_enabled/proxy_base_url).
+# Обновляются только переданные в PATCH поля: старые клиенты их не присылают.
+FOLDER_PROXY_OPTIONS = (
+    "proxy_streaming",
+    "proxy_cache_enabled",
+    "proxy_cache_ttl_seconds",
+    "proxy_cache_stale_seconds",
+    "proxy_connect_timeout_seconds",
+    "proxy_read_timeout_seconds",
+    "proxy_total_timeout_seconds",
+    "proxy_breaker_enabled",
+    "proxy_breaker_failure_rate",
+    "proxy_breaker_window_seconds",
+    "proxy_breaker_min_requests",
+    "proxy_breaker_open_seconds",
+    "proxy_retry_attempts",
+    "proxy_retry_budget_ratio",
+    "proxy_fallback_mock_id",
+    "proxy_upstreams",
+    "proxy_balancing",
+    "proxy_hash_header",
+    "proxy_health_check_path",
+    "proxy_health_check_interval_seconds",
+    "proxy_record_enabled",
+    "proxy_record_strip_headers",
+    "proxy_shadow_enabled",
+    "proxy_shadow_sample_rate",
+    "virtual_time",
+    "random_seed",
+    "random_keyed",
+    "rate_limit",
+    "bulkhead",
+)
+
+
+def _folder_proxy_options(folder: "Folder") -> Dict[str, Any]:
+    """Дополнительные настройки прокси папки; NULL в старых строках заменяется значением по умолчанию."""
+    options = {}
+    for field in FOLDER_PROXY_OPTIONS:
+        value = getattr(folder, field)
+        options[field] = FolderSettings.model_fields[field].default if value is None else value
+    return options
+
+
 
 
 
@@ -660,7 +3894,8 @@ def ensure_migrations():
                     SELECT column_name
                     FROM information_schema.columns
                     WHERE table_name = 'request_logs' 
-                    AND column_name IN ('request_headers', 'request_body', 'response_headers', 'response_body')
+                    AND column_name IN ('request_headers', 'request_body', 'response_headers', 'response_body',
+                                        'simulated_delay_ms')
                 """)
             ).fetchall()
             existing_detail_columns = {row[0] for row in request_logs_detail_columns}
@@ -691,7 +3926,14 @@ def ensure_migrations():
                     conn.execute(text("ALTER TABLE request_logs ADD COLUMN response_body TEXT NULL"))
                     logger.info("Added column request_logs.response_body")
                 except Exception as e:
-                    logger.warning(f"Error adding request_logs.response_body: {e}")
+                    logger.warning(f"Error adding request_logs.response_body: {e}")
+            
+            if 'simulated_delay_ms' not in existing_detail_columns:
+                try:
+                    conn.execute(text("ALTER TABLE request_logs ADD COLUMN simulated_delay_ms INTEGER NULL"))
+                    logger.info("Added column request_logs.simulated_delay_ms")
+                except Exception as e:
+                    logger.warning(f"Error adding request_logs.simulated_delay_ms: {e}")
             
             # После добавления folder_parent, нужно пересоздать внешние ключи
             # Сначала удаляем старые внешние ключи, если они существуют
@@ -754,7 +3996,21 @@ def ensure_migrations():
                                         'delay_range_min_ms', 'delay_range_max_ms', 'cache_enabled', 
                                         'cache_ttl_seconds', 'error_simulation_enabled', 'error_simulation_probability',
                                         'error_simulation_status_code', 'error_simulation_body', 'error_simulation_delay_ms',
-                                        'parent_folder')
+                                        'parent_folder', 'body_contains_required', 'version', 'updated_at',
+                                        'conditional_requests_enabled', 'proxy_streaming',
+                                        'proxy_cache_enabled', 'proxy_cache_ttl_seconds', 'proxy_cache_stale_seconds',
+                                        'proxy_connect_timeout_seconds', 'proxy_read_timeout_seconds',
+                                        'proxy_total_timeout_seconds', 'proxy_breaker_enabled', 'proxy_breaker_failure_rate',
+                                        'proxy_breaker_window_seconds', 'proxy_breaker_min_requests',
+                                        'proxy_breaker_open_seconds', 'proxy_retry_attempts', 'proxy_retry_budget_ratio',
+                                        'proxy_fallback_mock_id', 'proxy_upstreams', 'proxy_balancing',
+                                        'proxy_hash_header', 'proxy_health_check_path',
+                                        'proxy_health_check_interval_seconds', 'proxy_record_enabled',
+                                        'proxy_record_strip_headers', 'proxy_shadow_enabled',
+                                        'proxy_shadow_sample_rate', 'delay_profile', 'throttle_kbps',
+                                        'throttle_chunk_bytes', 'throttle_chunked', 'virtual_time',
+                                        'random_seed', 'random_keyed', 'chaos', 'rate_limit',
+                                        'bulkhead')
                 """)
             ).fetchall()
             
@@ -775,6 +4031,50 @@ def ensure_migrations():
                 except Exception as e:
                     logger.warning(f"Error adding folders.proxy_base_url: {e}")
             
+            if ('folders', 'proxy_streaming') not in existing_set:
+                try:
+                    conn.execute(text("ALTER TABLE folders ADD COLUMN proxy_streaming BOOLEAN DEFAULT FALSE"))
+                    logger.info("Added column folders.proxy_streaming")
+                except Exception as e:
+                    logger.warning(f"Error adding folders.proxy_streaming: {e}")
+            
+            for col_name, col_type in (
+                ("proxy_cache_enabled", "BOOLEAN DEFAULT FALSE"),
+                ("proxy_cache_ttl_seconds", "INTEGER DEFAULT 0"),
+                ("proxy_cache_stale_seconds", "INTEGER DEFAULT 0"),
+                ("proxy_connect_timeout_seconds", "DOUBLE PRECISION NULL"),
+                ("proxy_read_timeout_seconds", "DOUBLE PRECISION NULL"),
+                ("proxy_total_timeout_seconds", "DOUBLE PRECISION NULL"),
+                ("proxy_breaker_enabled", "BOOLEAN DEFAULT FALSE"),
+                ("proxy_breaker_failure_rate", "DOUBLE PRECISION DEFAULT 0.5"),
+                ("proxy_breaker_window_seconds", "INTEGER DEFAULT 30"),
+                ("proxy_breaker_min_requests", "INTEGER DEFAULT 10"),
+                ("proxy_breaker_open_seconds", "INTEGER DEFAULT 30"),
+                ("proxy_retry_attempts", "INTEGER DEFAULT 0"),
+                ("proxy_retry_budget_ratio", "DOUBLE PRECISION DEFAULT 0.2"),
+                ("proxy_fallback_mock_id", "VARCHAR NULL"),
+                ("proxy_upstreams", "JSON NULL"),
+                ("proxy_balancing", "VARCHAR DEFAULT 'round_robin'"),
+                ("proxy_hash_header", "VARCHAR NULL"),
+                ("proxy_health_check_path", "VARCHAR NULL"),
+                ("proxy_health_check_interval_seconds", "INTEGER DEFAULT 10"),
+                ("proxy_record_enabled", "BOOLEAN DEFAULT FALSE"),
+                ("proxy_record_strip_headers", "BOOLEAN DEFAULT TRUE"),
+                ("proxy_shadow_enabled", "BOOLEAN DEFAULT FALSE"),
+                ("proxy_shadow_sample_rate", "DOUBLE PRECISION DEFAULT 0.1"),
+                ("virtual_time", "BOOLEAN DEFAULT FALSE"),
+                ("random_seed", "BIGINT NULL"),
+                ("random_keyed", "BOOLEAN DEFAULT FALSE"),
+                ("rate_limit", "JSON NULL"),
+                ("bulkhead", "JSON NULL"),
+            ):
+                if ('folders', col_name) not in existing_set:
+                    try:
+                        conn.execute(text(f"ALTER TABLE folders ADD COLUMN {col_name} {col_type}"))
+                        logger.info(f"Added column folders.{col_name}")
+                    except Exception as e:
+                        logger.warning(f"Error adding folders.{col_name}: {e}")
+            
             # Добавляем колонку order в folders (order - зарезервированное слово в PostgreSQL)
             if ('folders', 'order') not in existing_set:
                 try:
@@ -936,6 +4236,15 @@ def ensure_migrations():
                 ('error_simulation_body', 'JSON NULL'),
                 ('error_simulation_delay_ms', 'INTEGER NULL'),
                 ('body_contains_required', 'BOOLEAN DEFAULT TRUE NOT NULL'),
+                ('version', 'INTEGER DEFAULT 0 NOT NULL'),
+                ('updated_at', 'INTEGER NULL'),
+                ('conditional_requests_enabled', 'BOOLEAN DEFAULT TRUE NOT NULL'),
+                ('delay_profile', 'JSON NULL'),
+                ('throttle_kbps', 'DOUBLE PRECISION NULL'),
+                ('throttle_chunk_bytes', 'INTEGER NULL'),
+                ('throttle_chunked', 'BOOLEAN DEFAULT FALSE'),
+                ('chaos', 'JSON NULL'),
+                ('rate_limit', 'JSON NULL'),
             ]
             
             for col_name, col_def in new_mock_columns:
@@ -989,10 +4298,31 @@ def ensure_default_folder():
         logger.error(f"Failed to load OpenAPI specs: {e}")
 
 
+@app.on_event("startup")
+async def start_background_tasks():
+    """Запускает фоновые задачи сервиса (очистка истёкших записей кэша и т.п.)."""
+    if CACHE_SWEEP_INTERVAL_SECONDS > 0:
+        BACKGROUND_TASKS.append(asyncio.create_task(_cache_expiry_loop()))
+    BACKGROUND_TASKS.append(asyncio.create_task(_upstream_health_loop()))
+    BACKGROUND_TASKS.append(asyncio.create_task(_proxy_record_loop()))
+    BACKGROUND_TASKS.extend(SHADOW_MIRROR.start())
+    if not RATE_LIMIT_STORE.blocking:
+        BACKGROUND_TASKS.append(asyncio.create_task(_rate_limit_sweep_loop()))
+
+
 @app.on_event("shutdown")
 def on_shutdown():
     """Хук корректного завершения (graceful shutdown)."""
     logger.info("Shutting down mockl service")
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    BACKGROUND_TASKS.clear()
+
+
+@app.on_event("shutdown")
+async def close_proxy_clients():
+    """Закрывает пулы соединений прокси."""
+    await PROXY_CLIENTS.aclose()
 
 
 
@@ -1311,6 +4641,8 @@ def delete_folder(
                           {"folder_name": subfolder.name, "parent_folder": subfolder.parent_folder})
                 db.flush()
                 
+                _schedule_cache_invalidation(db, folder=_folder_cache_tag(subfolder.name, subfolder.parent_folder))
+                
                 # Рекурсивно удаляем подпапки подпапки
                 delete_subfolders_recursive(subfolder.name, subfolder.parent_folder)
                 
@@ -1347,6 +4679,7 @@ def delete_folder(
         # Удаляем саму папку через прямой SQL
         db.execute(text("DELETE FROM folders WHERE name = :name AND parent_folder = :parent_folder"), 
                   {"name": folder_name, "parent_folder": parent_folder if parent_folder else ''})
+        _schedule_cache_invalidation(db, folder=_folder_cache_tag(folder_name, parent_folder))
         db.commit()
     
         folder_type = "подпапка" if parent_folder else "папка"
@@ -1461,6 +4794,7 @@ def duplicate_folder(
                 parent_folder=dst_parent,
                 proxy_enabled=src_f.proxy_enabled or False,
                 proxy_base_url=src_f.proxy_base_url,
+                **_folder_proxy_options(src_f),
                 order=src_f.order or 0,
             )
             db.add(new_folder)
@@ -1497,6 +4831,16 @@ def duplicate_folder(
                     copied.delay_range_min_ms = m.delay_range_min_ms
                 if hasattr(m, 'delay_range_max_ms'):
                     copied.delay_range_max_ms = m.delay_range_max_ms
+                if hasattr(m, 'delay_profile'):
+                    copied.delay_profile = m.delay_profile
+                if hasattr(m, 'throttle_kbps'):
+                    copied.throttle_kbps = m.throttle_kbps
+                    copied.throttle_chunk_bytes = m.throttle_chunk_bytes
+                    copied.throttle_chunked = m.throttle_chunked
+                if hasattr(m, 'chaos'):
+                    copied.chaos = m.chaos
+                if hasattr(m, 'rate_limit'):
+                    copied.rate_limit = m.rate_limit
                 if hasattr(m, 'cache_enabled'):
                     copied.cache_enabled = m.cache_enabled
                 if hasattr(m, 'cache_ttl_seconds'):
@@ -1511,6 +4855,8 @@ def duplicate_folder(
                     copied.error_simulation_body = m.error_simulation_body
                 if hasattr(m, 'error_simulation_delay_ms'):
                     copied.error_simulation_delay_ms = m.error_simulation_delay_ms
+                if hasattr(m, 'conditional_requests_enabled'):
+                    copied.conditional_requests_enabled = m.conditional_requests_enabled
                 
                 db.add(copied)
                 copied_ids.append(new_id)
@@ -1689,8 +5035,14 @@ def rename_folder(
                       {"new_name": new_name, "old_name": old_folder_name})
         db.flush()
         
+        # Записи кэша индексированы по старому имени папки
+        _schedule_cache_invalidation(db, folder=_folder_cache_tag(old_folder_name, parent_folder))
+        
         # Если это корневая папка, обновляем parent_folder во всех подпапках
         if not parent_folder:
+            for (subfolder_name,) in db.execute(text("SELECT name FROM folders WHERE parent_folder = :old_name"),
+                                                {"old_name": old_folder_name}):
+                _schedule_cache_invalidation(db, folder=_folder_cache_tag(subfolder_name, old_folder_name))
             db.execute(text("UPDATE folders SET parent_folder = :new_name WHERE parent_folder = :old_name"), 
                       {"new_name": new_name, "old_name": old_folder_name})
             db.flush()
@@ -1889,9 +5241,9 @@ def _normalize_json_string(json_str: str) -> str:
     
     try:
         # Пытаемся распарсить как JSON
-        parsed = json.loads(json_str)
+        parsed = json_loads(json_str)
         # Возвращаем компактную версию без пробелов
-        return json.dumps(parsed, ensure_ascii=False, separators=(',', ':'))
+        return json_dumps(parsed)
     except (json.JSONDecodeError, TypeError):
         # Если не JSON, возвращаем как есть
         return json_str
@@ -1925,8 +5277,8 @@ def _format_body_for_logging(body_bytes: bytes) -> str:
         body_str = body_bytes.decode('utf-8')
         # Пытаемся распарсить как JSON для красивого форматирования
         try:
-            body_json = json.loads(body_str)
-            return json.dumps(body_json, ensure_ascii=False, indent=2)
+            body_json = json_loads(body_str)
+            return json_dumps(body_json, indent=True)
         except (json.JSONDecodeError, ValueError):
             # Если не JSON, возвращаем как строку (ограничиваем длину)
             if len(body_str) > 1000:
@@ -2000,7 +5352,9 @@ def _remove_system_headers(resp: Response) -> None:
             headers_to_remove.append(header_name)
     
     for header_name in headers_to_remove:
-        resp.headers.pop(header_name, None)
+        # MutableHeaders не поддерживает pop
+        if header_name in resp.headers:
+            del resp.headers[header_name]
 
 
 def _remove_nul_chars(text: str) -> str:
@@ -2012,6 +5366,635 @@ def _remove_nul_chars(text: str) -> str:
     return text
 
 
+# Hop-by-hop и служебные заголовки хостинга, которые прокси не пересылает клиенту
+PROXY_SKIP_RESPONSE_HEADERS = {
+    "connection", "keep-alive", "transfer-encoding", "trailer", "upgrade", "proxy-authenticate",
+    "alt-svc", "x-render-origin-server", "cf-cache-status", "cache-status", "cf-ray",
+}
+# Hop-by-hop заголовки запроса: длину и кодирование тела upstream httpx выставляет сам
+PROXY_SKIP_REQUEST_HEADERS = {
+    "host", "connection", "keep-alive", "proxy-connection", "transfer-encoding", "te", "trailer", "upgrade",
+}
+# Заголовки, описывающие закодированное тело: убираются, когда httpx уже распаковал ответ
+PROXY_DECODED_BODY_HEADERS = {"content-length", "content-encoding", "vary"}
+
+
+def _proxy_request_headers(request: Request) -> Dict[str, str]:
+    """Заголовки запроса клиента для пересылки upstream (без Host и hop-by-hop)."""
+    return {k: v for k, v in request.headers.items() if k.lower() not in PROXY_SKIP_REQUEST_HEADERS}
+
+
+def _proxy_host_allowed(url: str) -> bool:
+    """Разрешён ли хост upstream списком MOCKL_ALLOWED_PROXY_HOSTS (пустой список — любой)."""
+    if not ALLOWED_PROXY_HOSTS:
+        return True
+    try:
+        host = (urlparse(url).hostname or "").lower()
+    except Exception:
+        host = ""
+    return host in ALLOWED_PROXY_HOSTS
+
+
+def _proxy_response_headers(proxied: httpx.Response, request: Request, passthrough: bool = False) -> List[Tuple[str, str]]:
+    """Заголовки ответа upstream для клиента.
+
+    Убирает hop-by-hop и служебные заголовки (cf-*, rndr-*), при редиректах переписывает
+    Location на текущий хост. Если passthrough=True, тело передаётся как есть (без
+    распаковки), поэтому Content-Type, Content-Length, Content-Encoding и Vary сохраняются.
+    """
+    result = []
+    for k, v in proxied.headers.multi_items():
+        kl = k.lower()
+        if kl in PROXY_SKIP_RESPONSE_HEADERS or kl.startswith(("cf-", "rndr-")):
+            continue
+        if not passthrough and (kl in PROXY_DECODED_BODY_HEADERS or kl == "content-type"):
+            # Content-Type уже установлен через media_type
+            continue
+        if kl == "location":
+            try:
+                loc = urlparse(v)
+                if loc.scheme and loc.netloc:
+                    # Переписываем только хост/схему, путь и query оставляем
+                    current = request.base_url
+                    new_loc = f"{current.scheme}://{current.netloc}{loc.path or ''}"
+                    if loc.query:
+                        new_loc += f"?{loc.query}"
+                    v = new_loc
+            except Exception:
+                pass
+        result.append((_restore_header_case(kl), v))
+    return result
+
+
+# Повторы допустимы только для идемпотентных методов (RFC 9110, 9.2.2) и ответов шлюза
+PROXY_RETRYABLE_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"}
+PROXY_RETRYABLE_STATUSES = {502, 503, 504}
+
+
+class ProxyPolicy:
+    """Снимок настроек прокси папки: не зависит от сессии БД, поэтому годится для фоновых задач."""
+
+    def __init__(self, folder: "Folder", folder_name: str, folder_parent: str):
+        self.tag = _folder_cache_tag(folder_name, folder_parent)
+        self.upstreams = [u.rstrip("/") for u in (folder.proxy_upstreams or [folder.proxy_base_url])]
+        read_timeout = folder.proxy_read_timeout_seconds or PROXY_READ_TIMEOUT_SECONDS
+        # Квота соединений upstream папки: отдельный пул, ожидание в нём — как в очереди бюджетов папки
+        bulkhead = getattr(folder, "bulkhead", None) or {}
+        self.pool = (self.tag, bulkhead["max_proxy_connections"]) if bulkhead.get("max_proxy_connections") else None
+        self.timeout = httpx.Timeout(
+            connect=folder.proxy_connect_timeout_seconds or PROXY_CONNECT_TIMEOUT_SECONDS,
+            read=read_timeout,
+            write=read_timeout,
+            pool=bulkhead.get("queue_timeout_ms", 1000) / 1000 if self.pool else PROXY_POOL_TIMEOUT_SECONDS,
+        )
+        self.total_timeout = folder.proxy_total_timeout_seconds or None
+        self.retry_attempts = max(0, folder.proxy_retry_attempts or 0)
+        self.fallback_mock_id = folder.proxy_fallback_mock_id
+        window = folder.proxy_breaker_window_seconds or 30
+
+        self.breaker = None
+        if folder.proxy_breaker_enabled:
+            params = (
+                folder.proxy_breaker_failure_rate or 0.5,
+                window,
+                folder.proxy_breaker_min_requests or 10,
+                folder.proxy_breaker_open_seconds or 30,
+            )
+            self.breaker = CIRCUIT_BREAKERS.get(self.tag)
+            if self.breaker is None or self.breaker.params != params:
+                self.breaker = CIRCUIT_BREAKERS[self.tag] = CircuitBreaker(self.tag, *params)
+
+        self.retry_budget = None
+        if self.retry_attempts:
+            params = (folder.proxy_retry_budget_ratio or 0.2, window)
+            self.retry_budget = RETRY_BUDGETS.get(self.tag)
+            if self.retry_budget is None or self.retry_budget.params != params:
+                self.retry_budget = RETRY_BUDGETS[self.tag] = RetryBudget(*params)
+
+        params = (
+            tuple(self.upstreams),
+            folder.proxy_balancing or "round_robin",
+            folder.proxy_hash_header,
+            folder.proxy_health_check_path,
+            folder.proxy_health_check_interval_seconds or 10,
+        )
+        self.balancer = UPSTREAM_BALANCERS.get(self.tag)
+        if self.balancer is None or self.balancer.params != params:
+            self.balancer = UPSTREAM_BALANCERS[self.tag] = UpstreamBalancer(self.tag, *params, previous=self.balancer)
+
+
+async def _proxy_send(policy: ProxyPolicy, method: str, path: str, stream: bool = False, **kwargs) -> httpx.Response:
+    """Запрос к upstream через пул с таймаутами папки, circuit breaker и повторами.
+
+    Реплика upstream для каждой попытки выбирает балансировщик папки; повтор уходит
+    на другую реплику, если она есть. Повторяются только идемпотентные запросы с телом
+    в памяти (не потоковым) после сетевой ошибки, таймаута или ответа 502/503/504 —
+    пока позволяет бюджет повторов. total_timeout ограничивает время до получения
+    ответа (для потокового режима — до заголовков). Ошибки 5xx и исключения
+    учитываются circuit breaker'ом и пассивным исключением реплик.
+    """
+    content = kwargs.get("content")
+    can_retry = (
+        policy.retry_attempts > 0
+        and method.upper() in PROXY_RETRYABLE_METHODS
+        and (content is None or isinstance(content, bytes))
+    )
+    if policy.retry_budget:
+        policy.retry_budget.record_request()
+    attempt = 0
+    tried: Tuple[str, ...] = ()
+    while True:
+        if policy.breaker:
+            policy.breaker.acquire()
+        upstream = policy.balancer.choose(kwargs.get("headers"), exclude=tried)
+        tried += (upstream,)
+        error: Optional[Exception] = None
+        proxied: Optional[httpx.Response] = None
+        policy.balancer.begin(upstream)
+        try:
+            send = PROXY_CLIENTS.request(
+                upstream, method, f"{upstream}{path}", stream=stream, pool=policy.pool, timeout=policy.timeout, **kwargs
+            )
+            proxied = await (asyncio.wait_for(send, policy.total_timeout) if policy.total_timeout else send)
+        except (asyncio.CancelledError, httpx.PoolTimeout) as e:
+            # Исчерпана квота соединений папки — это не сбой upstream
+            policy.balancer.end(upstream, None)
+            if policy.breaker:
+                policy.breaker.release()
+            if isinstance(e, httpx.PoolTimeout) and policy.pool:
+                BULKHEAD_REJECTED.labels(folder=policy.tag, resource="proxy", reason="timeout").inc()
+            raise
+        except (httpx.HTTPError, OSError, asyncio.TimeoutError) as e:
+            error = e
+        failed = proxied is None or proxied.status_code >= 500
+        policy.balancer.end(upstream, not failed)
+        PROXY_UPSTREAM_REQUESTS.labels(
+            folder=policy.tag, upstream=upstream,
+            result="error" if proxied is None else f"{proxied.status_code // 100}xx",
+        ).inc()
+        if policy.breaker:
+            policy.breaker.record(not failed)
+
+        retryable = proxied is None or proxied.status_code in PROXY_RETRYABLE_STATUSES
+        if (
+            can_retry
+            and retryable
+            and attempt < policy.retry_attempts
+            and (policy.breaker is None or policy.breaker.current_state() == CircuitBreaker.CLOSED)
+        ):
+            if policy.retry_budget.try_spend():
+                if proxied is not None:
+                    await proxied.aclose()
+                attempt += 1
+                PROXY_RETRIES.labels(folder=policy.tag).inc()
+                await asyncio.sleep(min(1.0, PROXY_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+                continue
+            PROXY_RETRY_BUDGET_EXHAUSTED.labels(folder=policy.tag).inc()
+        if error is not None:
+            raise error
+        return proxied
+
+
+def _proxy_error(e: Exception) -> HTTPException:
+    """HTTP‑ошибка для клиента по исключению прокси."""
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(
+            status_code=503,
+            detail="Proxy upstream is unavailable (circuit breaker open)",
+            headers={"Retry-After": str(max(1, int(e.retry_after + 0.999)))},
+        )
+    if isinstance(e, httpx.PoolTimeout):
+        return HTTPException(
+            status_code=503,
+            detail="Proxy connection budget of the folder is exhausted",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+        )
+    if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return HTTPException(504, f"Proxy timeout: {str(e) or type(e).__name__}")
+    return HTTPException(502, f"Proxy error: {str(e)}")
+
+
+def _proxy_fallback_response(
+    db: Session, policy: ProxyPolicy, request: Request, full_inner: str, folder_name: str
+) -> Optional[Response]:
+    """Ответ резервного мока папки, пока circuit breaker разомкнут (None — мок не задан)."""
+    if not policy.fallback_mock_id:
+        return None
+    m = db.query(Mock).filter(Mock.id == policy.fallback_mock_id).first()
+    if m is None:
+        logger.warning(f"Proxy fallback mock {policy.fallback_mock_id} for folder '{folder_name}' not found")
+        return None
+    compiled = _get_compiled_mock(m)
+    if compiled.static:
+        resp = compiled.to_response()
+    else:
+        _, resp, _ = compiled.render(request, full_inner)
+        _remove_system_headers(resp)
+    PROXY_CIRCUIT_FALLBACKS.labels(folder=folder_name).inc()
+    REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="proxy_fallback").inc()
+    return resp
+
+
+class ProxyBodyTooLarge(Exception):
+    """Тело запроса потокового прокси превысило MOCKL_MAX_REQUEST_BODY_BYTES."""
+
+
+class BodyPrefix:
+    """Счётчик байтов потока, сохраняющий для журнала не больше limit первых байт."""
+
+    __slots__ = ("limit", "data", "total")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.data = bytearray()
+        self.total = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self.total += len(chunk)
+        room = self.limit - len(self.data)
+        if room > 0:
+            self.data += chunk[:room]
+
+    def to_log(self, content_encoding: Optional[str] = None) -> Optional[str]:
+        """Префикс в виде строки для request_logs: текст как есть, бинарные данные в base64."""
+        if not self.total:
+            return None
+        data = bytes(self.data)
+        truncated = self.total > len(data)
+        if content_encoding in ("gzip", "deflate"):
+            # Префикс сжатого потока распаковывается частично
+            try:
+                data = zlib.decompressobj(zlib.MAX_WBITS | 32).decompress(data, self.limit)
+            except zlib.error:
+                return base64.b64encode(data).decode("ascii")
+        elif content_encoding and content_encoding != "identity":
+            return base64.b64encode(data).decode("ascii")
+        text = None
+        # Префикс может оборваться посреди многобайтового символа UTF-8
+        for cut in range(4 if truncated else 1):
+            try:
+                text = data[:len(data) - cut].decode("utf-8")
+                break
+            except UnicodeDecodeError:
+                continue
+        if text is None or '\x00' in text or not all(ord(c) >= 32 or c in '\n\r\t' for c in text[:1000]):
+            return base64.b64encode(data).decode("ascii")
+        if truncated:
+            text += f"... (truncated, {self.total} bytes total)"
+        return text
+
+
+async def _stream_request_body(request: Request, prefix: BodyPrefix) -> AsyncIterator[bytes]:
+    """Передаёт тело запроса upstream по мере получения, запоминая префикс для журнала."""
+    async for chunk in request.stream():
+        if not chunk:
+            continue
+        prefix.feed(chunk)
+        if MAX_REQUEST_BODY_BYTES > 0 and prefix.total > MAX_REQUEST_BODY_BYTES:
+            raise ProxyBodyTooLarge()
+        yield chunk
+
+
+class ProxyStreamingResponse(StreamingResponse):
+    """Ответ потокового прокси: сырые байты upstream отдаются клиенту по мере поступления.
+
+    Ответ upstream закрывается в любом случае, в том числе при обрыве соединения клиентом,
+    чтобы соединение вернулось в пул.
+    """
+
+    def __init__(self, upstream: httpx.Response, prefix: BodyPrefix, **kwargs):
+        self.upstream = upstream
+        self.prefix = prefix
+        super().__init__(self._iter_upstream(), status_code=upstream.status_code, **kwargs)
+
+    async def _iter_upstream(self) -> AsyncIterator[bytes]:
+        # aiter_raw не распаковывает gzip/br: клиент получает те же байты, что прислал upstream
+        async for chunk in self.upstream.aiter_raw():
+            self.prefix.feed(chunk)
+            yield chunk
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.upstream.aclose()
+
+
+def _log_streamed_proxy(
+    method: str,
+    path: str,
+    folder_name: str,
+    folder_parent: str,
+    start_time: float,
+    status_code: int,
+    request_headers: Dict[str, str],
+    request_prefix: BodyPrefix,
+    response_headers: List[Tuple[str, str]],
+    response_prefix: BodyPrefix,
+    content_encoding: Optional[str],
+) -> None:
+    """Метрики и запись в request_logs после того, как потоковый ответ передан клиенту."""
+    response_time = time.time() - start_time
+    PROXY_REQUESTS.labels(folder=folder_name).inc()
+    RESPONSE_TIME.labels(folder=folder_name).observe(response_time)
+    REQUESTS_TOTAL.labels(method=method, path=path, folder=folder_name, outcome="proxied").inc()
+    REQUEST_DETAILED.labels(
+        method=method, path=path, folder=folder_name, outcome="proxied", status_code=str(status_code)
+    ).inc()
+    RESPONSE_TIME_DETAILED.labels(method=method, path=path, folder=folder_name, outcome="proxied").observe(response_time)
+    PROXY_RESPONSE_TIME.labels(method=method, path=path, folder=folder_name).observe(response_time)
+    PROXY_STREAMED_BYTES.labels(folder=folder_name, direction="request").inc(request_prefix.total)
+    PROXY_STREAMED_BYTES.labels(folder=folder_name, direction="response").inc(response_prefix.total)
+
+    db = SessionLocal()
+    try:
+        request_body_str = _remove_nul_chars(request_prefix.to_log())
+        response_body_str = _remove_nul_chars(response_prefix.to_log(content_encoding))
+        db.add(RequestLog(
+            timestamp=datetime.utcnow().isoformat() + "Z",
+            folder_name=folder_name,
+            folder_parent=folder_parent,
+            method=method,
+            path=path,
+            is_proxied=True,
+            response_time_ms=int(response_time * 1000),
+            status_code=status_code,
+            cache_ttl_seconds=None,
+            cache_key=None,
+            request_headers=request_headers,
+            request_body=request_body_str,
+            response_headers={_remove_nul_chars(k): _remove_nul_chars(v) for k, v in response_headers},
+            response_body=response_body_str,
+        ))
+        db.commit()
+    except Exception as e:
+        logger.error(f"Error logging streamed proxy request: {e}", exc_info=True)
+        db.rollback()
+    finally:
+        db.close()
+
+
+async def _proxy_streaming(
+    request: Request,
+    policy: ProxyPolicy,
+    folder_name: str,
+    folder_parent: str,
+    full_inner: str,
+    start_time: float,
+    request_headers: Dict[str, str],
+    body_bytes: Optional[bytes],
+) -> Response:
+    """Потоковый прокси: тела запроса и ответа не буферизуются и не разбираются.
+
+    body_bytes передаётся, если тело уже прочитано (например, для body_contains у моков
+    папки); иначе тело запроса читается из ASGI‑потока по мере отправки upstream.
+    """
+    request_prefix = BodyPrefix(PROXY_LOG_BODY_MAX_BYTES)
+    try:
+        content = None
+        if body_bytes is not None:
+            request_prefix.feed(body_bytes)
+            if MAX_REQUEST_BODY_BYTES > 0 and request_prefix.total > MAX_REQUEST_BODY_BYTES:
+                raise ProxyBodyTooLarge()
+            content = body_bytes
+        elif "content-length" in request.headers or "transfer-encoding" in request.headers:
+            content = _stream_request_body(request, request_prefix)
+
+        proxied = await _proxy_send(
+            policy,
+            request.method,
+            full_inner,
+            headers=_proxy_request_headers(request),
+            content=content,
+            stream=True,
+        )
+    except ProxyBodyTooLarge:
+        REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="too_large").inc()
+        raise HTTPException(status_code=413, detail="Request entity too large")
+
+    PROXY_TIME_TO_FIRST_BYTE.labels(folder=folder_name).observe(time.time() - start_time)
+    response_headers = _proxy_response_headers(proxied, request, passthrough=True)
+    response_prefix = BodyPrefix(PROXY_LOG_BODY_MAX_BYTES)
+    resp = ProxyStreamingResponse(
+        proxied,
+        response_prefix,
+        background=BackgroundTask(
+            _log_streamed_proxy,
+            request.method,
+            full_inner.split('?')[0],
+            folder_name,
+            folder_parent,
+            start_time,
+            proxied.status_code,
+            request_headers,
+            request_prefix,
+            response_headers,
+            response_prefix,
+            (proxied.headers.get("content-encoding") or "").strip().lower() or None,
+        ),
+    )
+    header_encoding = proxied.headers.encoding
+    resp.raw_headers = [
+        (k.lower().encode("latin-1"), v.encode(header_encoding)) for k, v in response_headers
+    ]
+    return resp
+
+
+# Кэш прокси: статусы, кэшируемые по умолчанию (RFC 9111, 4.2.2)
+PROXY_CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+# Условные заголовки клиента не пересылаются: кэш хранит полное представление,
+# а 304 клиенту формируется по валидаторам из кэша
+PROXY_CACHE_SKIP_REQUEST_HEADERS = {"if-none-match", "if-modified-since", "if-match", "if-unmodified-since", "if-range"}
+# Заголовки уже распакованного httpx тела, которые не сохраняются в кэше
+PROXY_CACHE_SKIP_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+# Первый тег записей кэша прокси (вместо id мока)
+PROXY_CACHE_TAG = "proxy"
+# Текущие запросы к upstream по ключу кэша (single-flight)
+PROXY_INFLIGHT: Dict[str, "asyncio.Task[httpx.Response]"] = {}
+
+
+def _parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Разбирает Cache-Control в словарь директив (имена в нижнем регистре)."""
+    directives: Dict[str, Optional[str]] = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.strip().lower()] = arg.strip().strip('"') or None
+    return directives
+
+
+def _cache_control_seconds(directives: Dict[str, Optional[str]], name: str) -> Optional[int]:
+    try:
+        return max(0, int(directives[name]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _proxy_cache_key(folder_name: str, folder_parent: str, method: str, full_inner: str, request: Request) -> str:
+    """Ключ кэша прокси в формате _cache_key_for_mock (вместо id мока — proxy|папка).
+
+    Запросы с разными Authorization/Cookie кэшируются раздельно.
+    """
+    key = f"{PROXY_CACHE_TAG}|{_folder_cache_tag(folder_name, folder_parent)}:{method.upper()}:{full_inner}"
+    credentials = f'{request.headers.get("authorization") or ""}\n{request.headers.get("cookie") or ""}'
+    if credentials.strip():
+        key += ":" + hashlib.blake2b(credentials.encode("utf-8"), digest_size=8).hexdigest()
+    return key
+
+
+def _proxy_cache_policy(
+    proxied: httpx.Response, default_ttl: int, default_stale: int
+) -> Optional[Tuple[int, int, int]]:
+    """Сроки для ответа upstream: (свежесть, stale-while-revalidate, stale-if-error) в секундах.
+
+    Свежесть берётся из s-maxage/max-age (за вычетом Age), иначе — TTL папки.
+    None — ответ не кэшируется (no-store/no-cache/private, Set-Cookie, Vary кроме Accept-Encoding).
+    """
+    if proxied.status_code not in PROXY_CACHEABLE_STATUSES or "set-cookie" in proxied.headers:
+        return None
+    vary = {v.strip().lower() for v in proxied.headers.get("vary", "").split(",") if v.strip()}
+    if vary - {"accept-encoding"}:
+        return None
+    cc = _parse_cache_control(proxied.headers.get("cache-control"))
+    if "no-store" in cc or "no-cache" in cc or "private" in cc:
+        return None
+    ttl = _cache_control_seconds(cc, "s-maxage")
+    if ttl is None:
+        ttl = _cache_control_seconds(cc, "max-age")
+    if ttl is None:
+        ttl = max(0, default_ttl)
+    else:
+        try:
+            ttl = max(0, ttl - int(proxied.headers.get("age") or 0))
+        except ValueError:
+            pass
+    if "must-revalidate" in cc or "proxy-revalidate" in cc:
+        swr = sie = 0
+    else:
+        swr = _cache_control_seconds(cc, "stale-while-revalidate")
+        sie = _cache_control_seconds(cc, "stale-if-error")
+        swr = max(0, default_stale) if swr is None else swr
+        sie = max(0, default_stale) if sie is None else sie
+    if ttl <= 0 and not swr and not sie:
+        return None
+    return ttl, swr, sie
+
+
+async def _proxy_cache_store(key: str, tags: CacheTags, proxied: httpx.Response, policy: Tuple[int, int, int]) -> None:
+    ttl, swr, sie = policy
+    now = time.time()
+    payload = {
+        "status_code": proxied.status_code,
+        "content": proxied.content,
+        "media_type": proxied.headers.get("content-type"),
+        "headers": {k: v for k, v in proxied.headers.items() if k.lower() not in PROXY_CACHE_SKIP_RESPONSE_HEADERS},
+        "stored_at": now,
+        "fresh_until": now + ttl,
+        "stale_while_revalidate": swr,
+        "stale_if_error": sie,
+    }
+    await _cache_call("set", key, payload, ttl + max(swr, sie), tags)
+
+
+def _proxy_response_from_cache(payload: Dict[str, Any]) -> httpx.Response:
+    """Восстанавливает ответ upstream из кэша (тело уже распаковано)."""
+    headers = list(payload.get("headers", {}).items())
+    headers.append(("age", str(max(0, int(time.time() - payload.get("stored_at", time.time()))))))
+    return httpx.Response(payload["status_code"], headers=headers, content=payload.get("content") or b"")
+
+
+def _proxy_single_flight(key: str, fetch) -> Tuple["asyncio.Task[httpx.Response]", bool]:
+    """Запускает fetch() или присоединяется к уже идущему запросу с тем же ключом.
+
+    Запрос выполняется отдельной задачей, поэтому отмена одного из ожидающих клиентов
+    не прерывает его для остальных. Возвращает (задача, присоединились ли к существующей).
+    """
+    task = PROXY_INFLIGHT.get(key)
+    if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+        return task, True
+    task = asyncio.ensure_future(fetch())
+    PROXY_INFLIGHT[key] = task
+
+    def _done(t: "asyncio.Task[httpx.Response]") -> None:
+        if PROXY_INFLIGHT.get(key) is t:
+            del PROXY_INFLIGHT[key]
+        if not t.cancelled() and t.exception() is not None:
+            logger.warning(f"Proxy upstream fetch failed for {key}: {t.exception()}")
+
+    task.add_done_callback(_done)
+    return task, False
+
+
+def _proxy_cache_bypassed(request: Request) -> bool:
+    """Кэш прокси используется только для GET без Range и без Cache-Control: no-cache/no-store."""
+    if request.method != "GET" or "range" in request.headers:
+        return True
+    cc = _parse_cache_control(request.headers.get("cache-control"))
+    return "no-cache" in cc or "no-store" in cc
+
+
+async def _proxy_fetch_cached(
+    request: Request,
+    policy: ProxyPolicy,
+    folder: "Folder",
+    folder_name: str,
+    folder_parent: str,
+    full_inner: str,
+) -> Tuple[httpx.Response, str, str]:
+    """GET через кэш прокси: (ответ upstream или из кэша, результат, ключ кэша).
+
+    Свежая запись отдаётся из кэша; устаревшая в пределах stale-while-revalidate —
+    тоже, а обновление запускается в фоне. Одинаковые одновременные запросы
+    объединяются в один запрос к upstream. При ошибке upstream (исключение или 5xx)
+    в пределах stale-if-error отдаётся устаревшая запись.
+    """
+    key = _proxy_cache_key(folder_name, folder_parent, request.method, full_inner, request)
+    tags = (PROXY_CACHE_TAG, _folder_cache_tag(folder_name, folder_parent), full_inner)
+    headers = {
+        k: v for k, v in _proxy_request_headers(request).items()
+        if k.lower() not in PROXY_CACHE_SKIP_REQUEST_HEADERS
+    }
+    # Настройки копируются: фоновое обновление переживает сессию БД запроса
+    default_ttl = folder.proxy_cache_ttl_seconds or 0
+    default_stale = folder.proxy_cache_stale_seconds or 0
+
+    async def fetch() -> httpx.Response:
+        proxied = await _proxy_send(policy, "GET", full_inner, headers=headers)
+        cache_policy = _proxy_cache_policy(proxied, default_ttl, default_stale)
+        if cache_policy:
+            await _proxy_cache_store(key, tags, proxied, cache_policy)
+        return proxied
+
+    cached = await _cache_call("get", key)
+    payload = cached[1] if cached else None
+    staleness = time.time() - payload["fresh_until"] if payload else 0.0
+    if payload and staleness <= 0:
+        PROXY_CACHE_RESULTS.labels(folder=folder_name, result="hit").inc()
+        return _proxy_response_from_cache(payload), "hit", key
+    if payload and staleness <= payload.get("stale_while_revalidate", 0):
+        _, joined = _proxy_single_flight(key, fetch)
+        PROXY_CACHE_RESULTS.labels(folder=folder_name, result="stale").inc()
+        if not joined:
+            PROXY_CACHE_RESULTS.labels(folder=folder_name, result="revalidate").inc()
+        return _proxy_response_from_cache(payload), "stale", key
+
+    can_serve_stale = bool(payload) and staleness <= payload.get("stale_if_error", 0)
+    task, joined = _proxy_single_flight(key, fetch)
+    try:
+        proxied = await asyncio.shield(task)
+    except (httpx.HTTPError, OSError, asyncio.TimeoutError, CircuitOpenError) as e:
+        if not can_serve_stale:
+            raise
+        logger.warning(f"Proxy upstream error for {key}, serving stale response: {e}")
+        proxied = None
+    if proxied is None or (proxied.status_code >= 500 and can_serve_stale):
+        PROXY_CACHE_RESULTS.labels(folder=folder_name, result="stale_if_error").inc()
+        return _proxy_response_from_cache(payload), "stale_if_error", key
+    result = "coalesced" if joined else "miss"
+    PROXY_CACHE_RESULTS.labels(folder=folder_name, result=result).inc()
+    return proxied, result, key
+
+
 def _normalize_path_for_storage(path: str) -> str:
     """Нормализует путь для хранения в БД: убирает лишние слэши, но сохраняет query параметры."""
     if not path:
@@ -2072,12 +6055,16 @@ def _save_mock_entry(entry: MockEntry, db: Session) -> None:
         # Для нового мока устанавливаем порядок в конец списка
         max_order_result = db.query(Mock).filter_by(folder_name=folder_name, folder_parent=normalized_parent).with_entities(Mock.order).order_by(Mock.order.desc()).first()
         mock.order = (max_order_result[0] if max_order_result and max_order_result[0] is not None else -1) + 1
-    # При обновлении существующего мока не меняем порядок, если он не указан явно
-    elif hasattr(entry, 'order') and entry.order is not None:
-        mock.order = entry.order
+    else:
+        # Закэшированные ответы старой версии мока больше не актуальны
+        _schedule_cache_invalidation(db, mock_id=mock.id)
+        # При обновлении существующего мока не меняем порядок, если он не указан явно
+        if hasattr(entry, 'order') and entry.order is not None:
+            mock.order = entry.order
 
     mock.folder_name = folder_name
     mock.folder_parent = normalized_parent
+    mock.version = (mock.version or 0) + 1
     mock.name = entry.name
     mock.method = entry.request_condition.method.upper()
     normalized_path = _normalize_path_for_storage(entry.request_condition.path)
@@ -2113,6 +6100,12 @@ def _save_mock_entry(entry: MockEntry, db: Session) -> None:
     mock.delay_ms = entry.delay_ms or 0
     mock.delay_range_min_ms = entry.delay_range_min_ms
     mock.delay_range_max_ms = entry.delay_range_max_ms
+    mock.delay_profile = entry.delay_profile.model_dump(exclude_none=True) if entry.delay_profile else None
+    mock.throttle_kbps = entry.throttle_kbps
+    mock.throttle_chunk_bytes = entry.throttle_chunk_bytes
+    mock.throttle_chunked = bool(entry.throttle_chunked)
+    mock.chaos = [f.model_dump(exclude_none=True) for f in entry.chaos] if entry.chaos else None
+    mock.rate_limit = entry.rate_limit.model_dump(exclude_none=True) if entry.rate_limit else None
     mock.cache_enabled = entry.cache_enabled if entry.cache_enabled is not None else False
     mock.cache_ttl_seconds = entry.cache_ttl_seconds
     mock.error_simulation_enabled = entry.error_simulation_enabled if entry.error_simulation_enabled is not None else False
@@ -2121,6 +6114,10 @@ def _save_mock_entry(entry: MockEntry, db: Session) -> None:
     mock.error_simulation_status_code = entry.error_simulation_status_code
     mock.error_simulation_body = entry.error_simulation_body
     mock.error_simulation_delay_ms = entry.error_simulation_delay_ms
+    # Поле необязательно в запросе: при обновлении без него сохраняем прежнее значение
+    if is_new or "conditional_requests_enabled" in entry.model_fields_set:
+        mock.conditional_requests_enabled = entry.conditional_requests_enabled if entry.conditional_requests_enabled is not None else True
+    mock.updated_at = int(time.time())
 
 
 
@@ -2759,6 +6756,7 @@ def get_folder_settings(
         name=folder.name,
         proxy_enabled=folder.proxy_enabled or False,
         proxy_base_url=folder.proxy_base_url,
+        **_folder_proxy_options(folder),
     )
 
 
@@ -2832,11 +6830,86 @@ def update_folder_settings(
 
     folder.proxy_enabled = payload.proxy_enabled
     folder.proxy_base_url = (payload.proxy_base_url or "").strip() or None
+    if payload.proxy_fallback_mock_id and "proxy_fallback_mock_id" in payload.model_fields_set:
+        if not db.query(Mock).filter(Mock.id == payload.proxy_fallback_mock_id).first():
+            raise HTTPException(400, "Резервный мок не найден")
+    for field in FOLDER_PROXY_OPTIONS:
+        if field in payload.model_fields_set:
+            value = getattr(payload, field)
+            if isinstance(value, BaseModel):
+                value = value.model_dump(exclude_none=True)
+            setattr(folder, field, value)
+    if "proxy_upstreams" in payload.model_fields_set:
+        upstreams = [u.strip().rstrip("/") for u in (payload.proxy_upstreams or []) if u and u.strip()]
+        for u in upstreams:
+            if urlparse(u).scheme not in ("http", "https") or not urlparse(u).netloc:
+                raise HTTPException(400, f"Некорректный URL upstream: {u}")
+        folder.proxy_upstreams = upstreams or None
+        if upstreams and not folder.proxy_base_url:
+            folder.proxy_base_url = upstreams[0]
+    tag = _folder_cache_tag(folder.name, folder.parent_folder)
+    # Ответы прежнего upstream больше не актуальны, состояние circuit breaker начинается заново
+    _schedule_cache_invalidation(db, mock_id=PROXY_CACHE_TAG, folder=tag)
+    CIRCUIT_BREAKERS.pop(tag, None)
+    RETRY_BUDGETS.pop(tag, None)
+    if not (folder.proxy_enabled and folder.proxy_base_url):
+        # Проксирование выключено — прекращаем проверки здоровья реплик папки
+        UPSTREAM_BALANCERS.pop(tag, None)
+    # Ключи записи сбрасываются: удалённые с тех пор моки можно записать заново
+    PROXY_RECORDER.forget(tag)
+    if {"random_seed", "random_keyed"} & payload.model_fields_set:
+        # Новый seed — последовательность задержек и ошибок начинается сначала
+        FOLDER_RANDOMS.pop(tag, None)
 
     db.commit()
     return {"message": "Настройки папки обновлены"}
 
 
+class FolderRandomResetPayload(BaseModel):
+    """Payload для сброса генератора задержек и ошибок папки."""
+    seed: Optional[int] = Field(
+        None, description="Новый seed; если не задан, последовательность начинается заново с текущим seed"
+    )
+
+
+@app.post(
+    "/api/folders/{name}/random/reset",
+    summary="Сбросить генератор задержек и ошибок папки",
+    description=(
+        "Начинает последовательность задержек и ошибок моков папки заново — повтор того же трафика "
+        "даст те же сбои в том же порядке. Можно сразу задать новый seed.\n\n"
+        "Параметр `name` может быть в формате `folder_name` или `folder_name|parent_folder`."
+    ),
+)
+def reset_folder_random(
+    name: str = Path(
+        ...,
+        description="Имя папки (может быть в формате name|parent_folder для подпапок)",
+        examples=["api", "users|api"]
+    ),
+    payload: FolderRandomResetPayload = Body(default=FolderRandomResetPayload()),
+    db: Session = Depends(get_db),
+):
+    # Поддерживаем формат "name|parent_folder" для подпапок
+    folder_name = name.strip()
+    parent_folder = ''
+    if '|' in folder_name:
+        folder_name, parent_folder = folder_name.split('|', 1)
+    folder = db.query(Folder).filter(
+        Folder.name == folder_name,
+        Folder.parent_folder == parent_folder
+    ).first()
+    if not folder:
+        raise HTTPException(404, "Папка не найдена")
+    if payload.seed is not None:
+        folder.random_seed = payload.seed
+        db.commit()
+    if folder.random_seed is None:
+        raise HTTPException(400, "Для папки не задан seed")
+    FOLDER_RANDOMS.pop(_folder_cache_tag(folder.name, folder.parent_folder), None)
+    return {"message": "Генератор задержек и ошибок сброшен", "seed": folder.random_seed}
+
+
 class FolderReorderPayload(BaseModel):
     """Payload для изменения порядка папок."""
     folder_names: List[str] = Field(..., description="Список имен папок в новом порядке")
@@ -3173,6 +7246,7 @@ async def create_or_update_mock(
     try:
         _save_mock_entry(entry, db)
         db.commit()
+        await _await_cache_invalidations(db)
         return {"message": "mock saved", "mock": entry}
     except Exception as e:
         db.rollback()
@@ -3254,6 +7328,12 @@ def list_mocks(
                         delay_ms=m.delay_ms or 0,
                         delay_range_min_ms=m.delay_range_min_ms,
                         delay_range_max_ms=m.delay_range_max_ms,
+                        delay_profile=m.delay_profile,
+                        throttle_kbps=m.throttle_kbps,
+                        throttle_chunk_bytes=m.throttle_chunk_bytes,
+                        throttle_chunked=m.throttle_chunked if m.throttle_chunked is not None else False,
+                        chaos=m.chaos,
+                        rate_limit=m.rate_limit,
                         cache_enabled=m.cache_enabled if m.cache_enabled is not None else False,
                         cache_ttl_seconds=m.cache_ttl_seconds,
                         error_simulation_enabled=m.error_simulation_enabled if m.error_simulation_enabled is not None else False,
@@ -3261,6 +7341,7 @@ def list_mocks(
                         error_simulation_status_code=m.error_simulation_status_code,
                         error_simulation_body=m.error_simulation_body,
                         error_simulation_delay_ms=m.error_simulation_delay_ms,
+                        conditional_requests_enabled=m.conditional_requests_enabled if m.conditional_requests_enabled is not None else True,
                         order=m.order if m.order is not None else 0,
                     )
                 )
@@ -3292,6 +7373,7 @@ def delete_mock(
     if not mock:
         raise HTTPException(404, f"Mock with id {id_} not found")
     db.delete(mock)
+    _schedule_cache_invalidation(db, mock_id=mock.id)
     db.commit()
     return {"message": "mock deleted"}
 
@@ -3321,6 +7403,7 @@ def toggle_mock(
     if not mock:
         raise HTTPException(404, "Mock not found")
     mock.active = active
+    _schedule_cache_invalidation(db, mock_id=mock.id)
     db.commit()
     return {"id": mock_id, "active": active}
 
@@ -3374,6 +7457,7 @@ def deactivate_all(
         count = len(mocks_in_folders)
         for mock in mocks_in_folders:
             mock.active = False
+            _schedule_cache_invalidation(db, mock_id=mock.id)
     else:
         # Отключаем все моки во всех папках
         mocks_in_folders = db.query(Mock).filter_by(active=True).all()
@@ -3383,6 +7467,7 @@ def deactivate_all(
         count = len(mocks_in_folders)
         for mock in mocks_in_folders:
             mock.active = False
+            _schedule_cache_invalidation(db, mock_id=mock.id)
     
     db.commit()
     return {"message": f"All mocks{' in folder '+folder if folder else ''} deactivated", "count": count}
@@ -3717,6 +7802,7 @@ async def import_postman_collection(
             process_item(it)
 
         db.commit()
+        await _await_cache_invalidations(db)
         logger.info(f"Imported {len(imported)} mocks from Postman collection into folder '{folder_name}'")
 
         return JSONResponse({
@@ -3869,70 +7955,44 @@ async def upload_openapi_specs(files: List[UploadFile] = File(...)):
     description="Возвращает информацию о текущем состоянии кэша: количество записей, примеры ключей.",
 )
 async def get_cache_status():
-    """Возвращает статус кэша."""
-    cache_items = []
+    """Возвращает статус кэша по инкрементальным счётчикам (без обхода всех записей)."""
     current_time = time.time()
-    expired_count = 0
-    active_count = 0
-    
-    for key, (expires_at, payload) in RESPONSE_CACHE.items():
-        is_expired = expires_at <= current_time
-        if is_expired:
-            expired_count += 1
-        else:
-            active_count += 1
-        
-        cache_items.append({
+    stats = await _cache_call("stats")
+    cache_items = [
+        {
             "key": key,
             "expires_at": expires_at,
             "ttl_remaining": max(0, expires_at - current_time),
-            "expired": is_expired,
+            "expired": expires_at <= current_time,
             "status_code": payload.get("status_code"),
-        })
-    
-    # Сортируем по времени истечения
-    cache_items.sort(key=lambda x: x["expires_at"])
-    
+        }
+        for key, expires_at, payload in await _cache_call("items_preview", 20)
+    ]
     return {
-        "total": len(RESPONSE_CACHE),
-        "active": active_count,
-        "expired": expired_count,
-        "items": cache_items[:20]  # Возвращаем первые 20 для примера
+        "total": stats["entries"],
+        # Истёкшие записи удаляются фоновой задачей, поэтому все хранимые записи считаются активными
+        "active": stats["entries"],
+        "expired": sum(1 for item in cache_items if item["expired"]),
+        "stats": stats,
+        "items": cache_items  # Последние использованные записи для примера
     }
 
 
 @app.delete(
     "/api/cache",
     summary="Очистить кэш ответов",
-    description="Очищает кэш ответов полностью или по фильтрам папки и префикса пути.",
+    description="Очищает кэш ответов полностью или по фильтрам мока, папки и префикса пути (критерии объединяются через И).",
 )
 async def clear_cache(
-    folder: Optional[str] = Query(None, description="Имя папки для очистки кэша"),
+    folder: Optional[str] = Query(None, description="Имя папки для очистки кэша (формат 'name' или 'name|parent_folder')"),
     path_prefix: Optional[str] = Query(None, description="Префикс пути внутри папки"),
+    mock_id: Optional[str] = Query(None, description="ID мока, ответы которого нужно удалить из кэша"),
 ):
-    removed = 0
-    if not RESPONSE_CACHE:
-        return {"message": "cache empty", "removed": 0}
-    keys = list(RESPONSE_CACHE.keys())
-    for key in keys:
-        # Ключ формата mockId:METHOD:/inner/path?query
-        try:
-            _, method, inner = key.split(":", 2)
-        except ValueError:
-            continue
-        if path_prefix and not inner.startswith(path_prefix):
-            continue
-        # Папка в ключ не входит, поэтому фильтрация по папке только приблизительная:
-        # мы просто очищаем все, если указан folder (поведение задокументировано).
-        if folder is not None:
-            RESPONSE_CACHE.pop(key, None)
-            removed += 1
-        elif path_prefix:
-            RESPONSE_CACHE.pop(key, None)
-            removed += 1
-    if folder is None and path_prefix is None:
-        removed = len(RESPONSE_CACHE)
-        RESPONSE_CACHE.clear()
+    if folder is None and path_prefix is None and mock_id is None:
+        removed = await _cache_call("clear")
+        return {"message": "cache cleared", "removed": removed}
+    # Выборка по вторичному индексу: затрагиваются только подходящие записи
+    removed = await _cache_call("invalidate", mock_id, folder, path_prefix)
     return {"message": "cache cleared", "removed": removed}
 
 
@@ -4474,6 +8534,7 @@ def get_request_logs(
                 "path": log.path,
                 "is_proxied": log.is_proxied,
                 "response_time_ms": log.response_time_ms,
+                "simulated_delay_ms": log.simulated_delay_ms,
                 "status_code": log.status_code,
                 "cache_ttl_seconds": log.cache_ttl_seconds,
                 "cache_key": log.cache_key,
@@ -4635,6 +8696,222 @@ def clear_request_logs(
     return {"message": f"Удалено {count} записей", "deleted_count": count}
 
 
+# Системные заголовки запроса, которые не переносятся в условия мока (сравнение по префиксу)
+SYSTEM_REQUEST_HEADERS = {
+    "cdn-loop", "cf-", "rndr-", "true-client-ip", "x-request-start",
+    "x-forwarded-for", "x-forwarded-proto", "postman-token", "host", "user-agent","render-proxy-ttl"
+}
+
+# Системные заголовки ответа, которые не переносятся в ответ мока (сравнение по префиксу)
+SYSTEM_RESPONSE_HEADERS = {
+    "cf-",  # Все заголовки Cloudflare (cf-ray, cf-cache-status, cf-visitor и т.д.)
+    "rndr-",  # Все заголовки Render (rndr-id и т.д.)
+    "vary",
+    "alt-svc",
+    "x-render-origin-server",
+    "cf-cache-status",
+    "cache-status",  # Альтернативный вариант
+    "content-encoding",  # Content-Encoding (br, gzip и т.д.)
+    "cf-ray",  # CF-RAY явно
+    "postman-token",
+    "host",
+    "user-agent",
+    "render-proxy-ttl"
+}
+
+
+def _filter_system_headers(headers: Optional[Dict[str, str]], system_headers: set) -> Dict[str, str]:
+    """Заголовки без системных (по префиксу имени), регистр ключей сохраняется."""
+    prefixes = tuple(h.lower() for h in system_headers)
+    return {k: v for k, v in (headers or {}).items() if not k.lower().startswith(prefixes)}
+
+
+def _recorded_response_body(content: bytes, content_type: Optional[str]) -> Any:
+    """Тело ответа upstream для мока: JSON — объектом, текст — строкой, остальное — как файл (__file__)."""
+    if not content:
+        return {}
+    if content_type in ("application/json", "text/json") or not content_type:
+        try:
+            return json.loads(content)
+        except (UnicodeDecodeError, ValueError):
+            pass
+    try:
+        text = content.decode("utf-8")
+        if '\x00' not in text and all(ord(c) >= 32 or c in '\n\r\t' for c in text[:1000]):
+            return text
+    except UnicodeDecodeError:
+        pass
+    return {
+        "__file__": True,
+        "data_base64": base64.b64encode(content).decode("ascii"),
+        "mime_type": content_type or "application/octet-stream",
+    }
+
+
+def _record_key(method: str, path: str, body: Optional[str]) -> Tuple[str, str, str, str]:
+    """Ключ дедупликации записи: (метод, путь, query с отсортированными параметрами, хэш тела)."""
+    base, _, query = path.partition("?")
+    canonical_query = "&".join(sorted(p for p in query.split("&") if p))
+    body_hash = hashlib.blake2b((body or "").encode("utf-8"), digest_size=16).hexdigest() if body else ""
+    return method.upper(), base.rstrip("/") or "/", canonical_query, body_hash
+
+
+def _record_body_contains(request_body: Optional[bytes]) -> Optional[str]:
+    """Условие body_contains записанного мока: нормализованное тело запроса."""
+    if not request_body:
+        return None
+    try:
+        return _normalize_json_string(request_body.decode("utf-8"))
+    except UnicodeDecodeError:
+        # Бинарное тело нельзя задать условием body_contains
+        return None
+
+
+class ProxyRecorder:
+    """Режим записи: проксированные запросы папки превращаются в моки в фоне.
+
+    В обработчике запроса выполняется только дедупликация по ключу _record_key
+    (метод, путь, query, хэш нормализованного тела) и постановка в очередь.
+    Повторная проверка по уже существующим мокам папки и вставка выполняются фоновой
+    задачей пачками по MOCKL_PROXY_RECORD_BATCH_SIZE — одна транзакция на пачку.
+    Недавние ключи хранятся не более MAX_SEEN_KEYS на папку: вытесненный ключ
+    отсеивается проверкой по мокам папки при сохранении.
+    """
+
+    MAX_SEEN_KEYS = 10000
+
+    def __init__(self):
+        self.pending: deque = deque()
+        self.seen: Dict[str, "OrderedDict[Tuple[str, str, str, str], None]"] = {}
+
+    def submit(
+        self,
+        folder_name: str,
+        folder_parent: str,
+        method: str,
+        full_inner: str,
+        request_body: Optional[bytes],
+        request_headers: Dict[str, str],
+        status_code: int,
+        response_headers: Dict[str, str],
+        content: bytes,
+        content_type: Optional[str],
+        strip_headers: bool,
+    ) -> None:
+        tag = _folder_cache_tag(folder_name, folder_parent)
+        body_contains = _record_body_contains(request_body)
+        key = _record_key(method, full_inner, body_contains)
+        seen = self.seen.setdefault(tag, OrderedDict())
+        if key in seen:
+            seen.move_to_end(key)
+            PROXY_RECORDED.labels(folder=folder_name, result="duplicate").inc()
+            return
+        if len(self.pending) >= PROXY_RECORD_QUEUE_SIZE:
+            PROXY_RECORDED.labels(folder=folder_name, result="dropped").inc()
+            return
+        seen[key] = None
+        while len(seen) > self.MAX_SEEN_KEYS:
+            seen.popitem(last=False)
+        self.pending.append((
+            tag, key, folder_name, method, full_inner, body_contains, request_headers,
+            status_code, response_headers, content, content_type, strip_headers,
+        ))
+
+    def forget(self, tag: str) -> None:
+        """Сбрасывает ключи папки (запись выключена или настройки изменены)."""
+        self.seen.pop(tag, None)
+
+    async def flush(self) -> None:
+        while self.pending:
+            batch = [self.pending.popleft() for _ in range(min(PROXY_RECORD_BATCH_SIZE, len(self.pending)))]
+            await run_in_threadpool(self._save_batch, batch)
+
+    @staticmethod
+    def _build_entry(item: tuple) -> MockEntry:
+        (tag, _, _, method, full_inner, body_contains, request_headers,
+         status_code, response_headers, content, content_type, strip_headers) = item
+        if strip_headers:
+            request_headers = _filter_system_headers(request_headers, SYSTEM_REQUEST_HEADERS)
+            response_headers = _filter_system_headers(response_headers, SYSTEM_RESPONSE_HEADERS)
+        else:
+            response_headers = {k: v for k, v in response_headers.items() if k.lower() != "cache-status"}
+        base, _, query = full_inner.partition("?")
+        path = f"{base}?{'&'.join(sorted(p for p in query.split('&') if p))}" if query else base
+        return MockEntry(
+            folder=tag,
+            name=f"{method.upper()}{base} record",
+            request_condition={
+                "method": method.upper(),
+                "path": path,
+                "headers": request_headers or None,
+                "body_contains": body_contains,
+                "body_contains_required": True,
+            },
+            response_config={
+                "status_code": status_code,
+                "headers": response_headers or None,
+                "body": _recorded_response_body(content, content_type),
+            },
+            active=True,
+            delay_ms=0,
+        )
+
+    def _save_batch(self, batch: List[tuple]) -> None:
+        db = SessionLocal()
+        try:
+            existing: Dict[str, set] = {}
+            saved: Dict[str, int] = {}
+            for item in batch:
+                tag, folder_name = item[0], item[2]
+                keys = existing.get(tag)
+                if keys is None:
+                    # Моки папки, созданные раньше (в том числе до перезапуска), не дублируются
+                    name, _, parent = tag.partition("|")
+                    rows = db.query(Mock.method, Mock.path, Mock.body_contains).filter(
+                        Mock.folder_name == name, Mock.folder_parent == parent
+                    ).all()
+                    keys = existing[tag] = {_record_key(*row) for row in rows}
+                entry = self._build_entry(item)
+                key = item[1]
+                if key in keys:
+                    PROXY_RECORDED.labels(folder=folder_name, result="duplicate").inc()
+                    continue
+                keys.add(key)
+                _save_mock_entry(entry, db)
+                saved[folder_name] = saved.get(folder_name, 0) + 1
+            db.commit()
+            for folder_name, count in saved.items():
+                PROXY_RECORDED.labels(folder=folder_name, result="saved").inc(count)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error saving recorded mocks: {e}", exc_info=True)
+            # Ключи несохранённых запросов освобождаются, чтобы их можно было записать повторно
+            for item in batch:
+                self.seen.get(item[0], {}).pop(item[1], None)
+                PROXY_RECORDED.labels(folder=item[2], result="failed").inc()
+        finally:
+            db.close()
+
+
+PROXY_RECORDER = ProxyRecorder()
+
+
+async def _proxy_record_loop() -> None:
+    """Фоновая задача: сохраняет накопленные режимом записи моки."""
+    while True:
+        await asyncio.sleep(PROXY_RECORD_FLUSH_INTERVAL_SECONDS)
+        try:
+            await PROXY_RECORDER.flush()
+        except Exception as e:
+            logger.warning(f"Proxy record flush failed: {e}")
+
+
+@app.on_event("shutdown")
+async def flush_recorded_mocks():
+    """Сохраняет оставшиеся в очереди записанные моки."""
+    await PROXY_RECORDER.flush()
+
+
 @app.post(
     "/api/mocks/generate-from-proxy",
     summary="Сформировать мок из прокси запроса",
@@ -4657,52 +8934,9 @@ def generate_mock_from_proxy(
         if not log.request_headers or not log.response_headers:
             raise HTTPException(400, "Отсутствуют данные headers для формирования мока")
         
-        # Системные заголовки запроса, которые нужно исключить
-        SYSTEM_REQUEST_HEADERS = {
-            "cdn-loop", "cf-", "rndr-", "true-client-ip", "x-request-start",
-            "x-forwarded-for", "x-forwarded-proto", "postman-token", "host", "user-agent","render-proxy-ttl"
-        }
-        
-        # Системные заголовки ответа, которые нужно исключить
-        SYSTEM_RESPONSE_HEADERS = {
-            "cf-",  # Все заголовки Cloudflare (cf-ray, cf-cache-status, cf-visitor и т.д.)
-            "rndr-",  # Все заголовки Render (rndr-id и т.д.)
-            "vary",
-            "alt-svc",
-            "x-render-origin-server",
-            "cf-cache-status",
-            "cache-status",  # Альтернативный вариант
-            "content-encoding",  # Content-Encoding (br, gzip и т.д.)
-            "cf-ray",  # CF-RAY явно
-            "postman-token",
-            "host",
-            "user-agent",
-            "render-proxy-ttl"
-        }
-        
-        # Фильтруем заголовки запроса (сохраняем регистр)
-        filtered_request_headers = {}
-        for k, v in (log.request_headers or {}).items():
-            k_lower = k.lower()
-            should_exclude = False
-            for sys_header in SYSTEM_REQUEST_HEADERS:
-                if k_lower.startswith(sys_header.lower()):
-                    should_exclude = True
-                    break
-            if not should_exclude:
-                filtered_request_headers[k] = v
-        
-        # Фильтруем заголовки ответа (сохраняем регистр)
-        filtered_response_headers = {}
-        for k, v in (log.response_headers or {}).items():
-            k_lower = k.lower()
-            should_exclude = False
-            for sys_header in SYSTEM_RESPONSE_HEADERS:
-                if k_lower.startswith(sys_header.lower()):
-                    should_exclude = True
-                    break
-            if not should_exclude:
-                filtered_response_headers[k] = v
+        # Фильтруем системные заголовки запроса и ответа (сохраняем регистр)
+        filtered_request_headers = _filter_system_headers(log.request_headers, SYSTEM_REQUEST_HEADERS)
+        filtered_response_headers = _filter_system_headers(log.response_headers, SYSTEM_RESPONSE_HEADERS)
         
         # Формируем имя мока: METHOD+PATH+proxy
         mock_name = f"{log.method.upper()}{log.path} proxy"
@@ -4870,32 +9104,45 @@ def generate_mock_from_proxy(
         raise HTTPException(status_code=500, detail=f"Ошибка при формировании мока: {str(e)}")
 
 
+@app.get(
+    "/api/shadow/drift",
+    summary="Расхождения моков с upstream",
+    description="Последнее расхождение каждого мока с ответом upstream, найденное теневым режимом папки.",
+)
+def list_shadow_drift(
+    folder: Optional[str] = Query(None, description="Имя папки для фильтрации"),
+):
+    """Возвращает последние расхождения моков с upstream (новые — первыми)."""
+    reports = [r for r in reversed(SHADOW_MIRROR.reports.values()) if not folder or r["folder"] == folder]
+    return {"drift": reports, "count": len(reports)}
+
+
 @app.delete(
     "/api/cache/clear",
     summary="Очистить кэш",
-    description="Очищает кэш ответов, опционально по ключу или папке.",
+    description="Очищает кэш ответов, опционально по ключу, моку или папке.",
 )
 def clear_cache(
     cache_key: Optional[str] = Query(None, description="Ключ кэша для удаления конкретной записи"),
-    folder: Optional[str] = Query(None, description="Имя папки для удаления всех записей этой папки"),
+    folder: Optional[str] = Query(None, description="Имя папки для удаления всех записей этой папки (формат 'name' или 'name|parent_folder')"),
+    mock_id: Optional[str] = Query(None, description="ID мока для удаления всех его записей"),
 ):
     """Очищает кэш ответов."""
     if cache_key:
-        if cache_key in RESPONSE_CACHE:
-            del RESPONSE_CACHE[cache_key]
+        if RESPONSE_CACHE.pop(cache_key):
             return {"message": f"Кэш с ключом '{cache_key}' удалён", "deleted_count": 1}
         else:
             raise HTTPException(404, "Ключ кэша не найден")
+    elif mock_id:
+        count = RESPONSE_CACHE.invalidate(mock_id=mock_id)
+        return {"message": f"Удалено {count} записей кэша для мока '{mock_id}'", "deleted_count": count}
     elif folder:
-        # Удаляем все записи кэша для указанной папки
-        keys_to_delete = [k for k in RESPONSE_CACHE.keys() if f"folder={folder}" in k]
-        for key in keys_to_delete:
-            del RESPONSE_CACHE[key]
-        return {"message": f"Удалено {len(keys_to_delete)} записей кэша для папки '{folder}'", "deleted_count": len(keys_to_delete)}
+        # Удаляем все записи кэша для указанной папки по индексу тегов
+        count = RESPONSE_CACHE.invalidate(folder=folder)
+        return {"message": f"Удалено {count} записей кэша для папки '{folder}'", "deleted_count": count}
     else:
         # Удаляем весь кэш
-        count = len(RESPONSE_CACHE)
-        RESPONSE_CACHE.clear()
+        count = RESPONSE_CACHE.clear()
         return {"message": f"Весь кэш очищен ({count} записей)", "deleted_count": count}
 
 
@@ -5185,8 +9432,158 @@ def _get_cache_ttl(m: Mock) -> int:
     return DEFAULT_CACHE_TTL_SECONDS
 
 
-def _get_delay_ms(m: Mock) -> int:
-    """Возвращает задержку в мс — фиксированную или случайную из диапазона."""
+class FolderRandom:
+    """Воспроизводимый генератор задержек и ошибок папки с заданным seed.
+
+    Обычный режим — один поток random.Random(seed) на папку: повтор того же трафика
+    в том же порядке даёт те же сбои. В режиме keyed у каждой пары метод+путь свой
+    счётчик, и генератор запроса выводится из (seed, метод, путь, номер запроса), так
+    что результат не зависит от чередования запросов к разным путям.
+    Состояние хранится в памяти процесса (у каждого воркера своё).
+    """
+
+    def __init__(self, seed: int, keyed: bool):
+        self.seed = seed
+        self.keyed = keyed
+        self.rng = random.Random(seed)
+        self.counters: Dict[str, int] = {}
+
+    def stream(self, method: str, path: str) -> random.Random:
+        if not self.keyed:
+            return self.rng
+        key = f"{method.upper()} {path}"
+        n = self.counters.get(key, 0)
+        self.counters[key] = n + 1
+        digest = hashlib.blake2b(f"{self.seed}\0{key}\0{n}".encode(), digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, "big"))
+
+
+# Генераторы папок с seed по тегу папки; сбрасываются при изменении seed или через API
+FOLDER_RANDOMS: Dict[str, FolderRandom] = {}
+
+
+def _folder_random(folder: Optional[Folder], method: str, path: str) -> Optional[random.Random]:
+    """Генератор для запроса к папке с заданным seed (None — используется модуль random)."""
+    if folder is None or folder.random_seed is None:
+        return None
+    tag = _folder_cache_tag(folder.name, folder.parent_folder)
+    state = FOLDER_RANDOMS.get(tag)
+    keyed = bool(folder.random_keyed)
+    if state is None or state.seed != folder.random_seed or state.keyed != keyed:
+        state = FOLDER_RANDOMS[tag] = FolderRandom(folder.random_seed, keyed)
+    return state.stream(method, path)
+
+
+class DelaySampler:
+    """Буфер заранее сгенерированных задержек по профилю мока.
+
+    Значения генерируются пачками по MOCKL_DELAY_SAMPLE_BUFFER (векторно через
+    NumPy, если он установлен, иначе модулем random), поэтому на запрос приходится
+    только чтение следующего элемента буфера.
+    """
+
+    def __init__(self, profile: Dict[str, Any], base_ms: int, recorded: Optional[List[int]] = None):
+        self.profile = profile
+        self.base_ms = base_ms
+        self.recorded = recorded
+        self.created_at = time.monotonic()
+        self._buffer: List[int] = []
+        self._pos = 0
+
+    def _generate(self, n: int, rng: Optional[random.Random] = None) -> List[int]:
+        p = self.profile
+        kind = p.get("type")
+        base = float(self.base_ms or 100)
+        # Воспроизводимые значения берутся из генератора папки, без NumPy и буфера
+        vector = np is not None and rng is None
+        rng = rng or random
+        if kind == "empirical":
+            if not self.recorded:
+                return [self.base_ms] * n
+            if vector:
+                values = np.random.default_rng().choice(np.asarray(self.recorded, dtype=float), n)
+            else:
+                values = rng.choices(self.recorded, k=n)
+        elif kind == "lognormal":
+            mu = math.log(p.get("median_ms") or base)
+            sigma = p.get("sigma") if p.get("sigma") is not None else 0.5
+            if vector:
+                values = np.random.default_rng().lognormal(mu, sigma, n)
+            else:
+                values = [rng.lognormvariate(mu, sigma) for _ in range(n)]
+        elif kind == "pareto":
+            scale, alpha = p.get("scale_ms") or base, p.get("alpha") or 2.5
+            if vector:
+                values = (np.random.default_rng().pareto(alpha, n) + 1) * scale
+            else:
+                values = [rng.paretovariate(alpha) * scale for _ in range(n)]
+        else:
+            mean = p.get("mean_ms") if p.get("mean_ms") is not None else base
+            sd = p.get("stddev_ms") if p.get("stddev_ms") is not None else mean / 4
+            if vector:
+                values = np.random.default_rng().normal(mean, sd, n)
+            else:
+                values = [rng.gauss(mean, sd) for _ in range(n)]
+        lo = p.get("min_ms") or 0
+        hi = p.get("max_ms")
+        if vector:
+            return np.clip(np.rint(values), lo, hi if hi is not None else np.inf).astype(np.int64).tolist()
+        return [int(min(max(round(v), lo), hi if hi is not None else math.inf)) for v in values]
+
+    def draw(self, rng: Optional[random.Random] = None) -> int:
+        if rng is not None:
+            return self._generate(1, rng)[0]
+        if self._pos >= len(self._buffer):
+            self._buffer = self._generate(DELAY_SAMPLE_BUFFER)
+            self._pos = 0
+        value = self._buffer[self._pos]
+        self._pos += 1
+        return value
+
+
+# Сэмплеры задержек по id мока; удаляются при изменении и удалении мока
+DELAY_SAMPLERS: Dict[str, Tuple[int, DelaySampler]] = {}
+
+
+def _recorded_latencies(db: Session, m: Mock, limit: int) -> List[int]:
+    """Время ответа реального upstream (проксированные запросы) для метода и пути мока."""
+    rows = db.query(RequestLog.response_time_ms).filter(
+        RequestLog.folder_name == m.folder_name,
+        RequestLog.folder_parent == (m.folder_parent or ''),
+        RequestLog.method == m.method,
+        RequestLog.path == (m.path.split("?")[0] or "/"),
+        RequestLog.is_proxied == True,
+        RequestLog.response_time_ms.isnot(None),
+    ).order_by(RequestLog.timestamp.desc()).limit(limit).all()
+    return [r[0] for r in rows]
+
+
+async def _delay_sampler(m: Mock, db: Optional[Session]) -> Optional[DelaySampler]:
+    profile = m.delay_profile
+    if not isinstance(profile, dict) or not profile.get("type"):
+        return None
+    cached = DELAY_SAMPLERS.get(m.id)
+    if cached and cached[0] == (m.version or 0):
+        sampler = cached[1]
+        # Эмпирическое распределение периодически перестраивается по свежим записям
+        if profile["type"] != "empirical" or time.monotonic() - sampler.created_at < DELAY_EMPIRICAL_REFRESH_SECONDS:
+            return sampler
+    recorded = None
+    if profile["type"] == "empirical" and db is not None:
+        recorded = await run_in_threadpool(_recorded_latencies, db, m, profile.get("samples") or 1000)
+    sampler = DelaySampler(profile, m.delay_ms or 0, recorded)
+    DELAY_SAMPLERS[m.id] = (m.version or 0, sampler)
+    return sampler
+
+
+async def _get_delay_ms(m: Mock, db: Optional[Session] = None, rng: Optional[random.Random] = None) -> int:
+    """Возвращает задержку в мс — из профиля задержки, фиксированную или случайную из диапазона.
+
+    rng — генератор папки с заданным seed (см. _folder_random); без него используется модуль random.
+    """
+    sampler = await _delay_sampler(m, db)
+    if sampler is not None:
+        return sampler.draw(rng)
     base = m.delay_ms or 0
     # Если задан диапазон, используем случайное значение из диапазона
     if m.delay_range_min_ms is not None and m.delay_range_max_ms is not None:
@@ -5194,15 +9591,15 @@ def _get_delay_ms(m: Mock) -> int:
             mn = max(0, int(m.delay_range_min_ms))
             mx = max(mn, int(m.delay_range_max_ms))
             if mn != mx:
-                return random.randint(mn, mx)
+                return (rng or random).randint(mn, mx)
             return mn
         except Exception:
             return base
     return base
 
 
-def _maybe_simulate_error(m: Mock, folder_name: str) -> Optional[Dict[str, Any]]:
-    """Пытается сэмулировать ошибку согласно настройкам мока."""
+def _maybe_simulate_error(m: Mock, folder_name: str, rng: Optional[random.Random] = None) -> Optional[Dict[str, Any]]:
+    """Пытается сэмулировать ошибку согласно настройкам мока (rng — генератор папки с seed)."""
     if not m.error_simulation_enabled:
         return None
     # Вероятность может быть числом (float) или строкой
@@ -5219,7 +9616,7 @@ def _maybe_simulate_error(m: Mock, folder_name: str) -> Optional[Dict[str, Any]]
     if prob <= 0 or prob > 1:
         return None
     
-    if random.random() > prob:
+    if (rng or random).random() > prob:
         return None
     
     ERRORS_SIMULATED.labels(folder=folder_name).inc()
@@ -5233,86 +9630,609 @@ def _maybe_simulate_error(m: Mock, folder_name: str) -> Optional[Dict[str, Any]]
     }
 
 
+def _arm_chaos(request: Request, m: Mock, folder_name: str, rng: Optional[random.Random] = None) -> None:
+    """Выбирает сетевой сбой мока (первый, выпавший по вероятности) и передаёт его ChaosMiddleware."""
+    if not m.chaos:
+        return
+    for fault in m.chaos:
+        if (rng or random).random() < (fault.get("probability") or 0):
+            request.scope[CHAOS_SCOPE_KEY] = fault
+            CHAOS_FAULTS.labels(folder=folder_name, fault=fault["type"]).inc()
+            return
+
+
+class TemplateContext(dict):
+    """Контекст подстановок ({method}, {path}, {query}, {header_x}, {query_x} …).
+
+    Значения вычисляются лениво при первом обращении из str.format_map, поэтому
+    заголовки и query‑параметры разбираются только если шаблон на них ссылается.
+    Отсутствующие ключи подставляются пустой строкой.
+    """
+
+    def __init__(self, req: Request, full_inner: str):
+        super().__init__()
+        self._req = req
+        self._full_inner = full_inner
+        self._headers_loaded = False
+        self._query_loaded = False
+
+    def __missing__(self, key: str) -> Any:
+        req = self._req
+        if key == "method":
+            value = req.method
+        elif key == "path":
+            value = req.url.path
+        elif key == "full_path":
+            value = self._full_inner
+        elif key == "query":
+            value = req.url.query
+        elif key.startswith("header_") and not self._headers_loaded:
+            # Заголовки: header_authorization, header_x_custom
+            self._headers_loaded = True
+            for k, v in req.headers.items():
+                self[f"header_{k.replace('-', '_')}"] = v
+            return dict.get(self, key, "")
+        elif key.startswith("query_") and not self._query_loaded:
+            # Query‑параметры: query_param_name
+            self._query_loaded = True
+            for k, v in req.query_params.items():
+                self[f"query_{k}"] = v
+            return dict.get(self, key, "")
+        else:
+            return ""
+        self[key] = value
+        return value
+
+
+def _is_template(value: Any) -> bool:
+    """Может ли строка измениться при подстановке (любые фигурные скобки, включая {{ и }})."""
+    return isinstance(value, str) and ("{" in value or "}" in value)
+
+
+def _format_template(template: str, context: TemplateContext) -> str:
+    try:
+        return template.format_map(context)
+    except Exception:
+        # Если форматирование не удалось, возвращаем исходную строку
+        return template
+
+
 def _apply_templates(value: Any, req: Request, full_inner: str) -> Any:
     """Подстановка простых плейсхолдеров в строках ({method}, {path}, {query} и т.п.)."""
-    context = {
-        "method": req.method,
-        "path": req.url.path,
-        "full_path": full_inner,
-        "query": req.url.query,
-    }
-    # Заголовки: header_Authorization, header_X_Custom
-    for k, v in req.headers.items():
-        context[f"header_{k.replace('-', '_')}"] = v
-    # Query‑параметры: query_param_name
-    for k, v in req.query_params.items():
-        context[f"query_{k}"] = v
-
-    # Создаём безопасный словарь, который возвращает пустую строку для отсутствующих ключей
-    class SafeDict(dict):
-        def __missing__(self, key):
-            return ""
+    context = TemplateContext(req, full_inner)
+
+    def _render(v: Any) -> Any:
+        if isinstance(v, str):
+            return _format_template(v, context)
+        if isinstance(v, dict):
+            return {k: _render(item) for k, item in v.items()}
+        if isinstance(v, list):
+            return [_render(item) for item in v]
+        return v
 
-    safe_context = SafeDict(context)
+    return _render(value)
+
+
+class TemplatePlan:
+    """Скомпилированный план подстановок для JSON‑значения.
+
+    При компиляции запоминаются только пути к строкам с плейсхолдерами. При
+    рендеринге копируются лишь контейнеры на этих путях (copy-on-write), остальные
+    ветви разделяются с исходным значением — результат нельзя изменять на месте.
+    """
 
-    def _fmt(s: str) -> str:
+    def __init__(self, value: Any):
+        self.value = value
+        self.paths: List[Tuple[Tuple[Any, ...], str]] = []
+        self._collect(value, ())
+
+    def _collect(self, value: Any, path: Tuple[Any, ...]) -> None:
+        if _is_template(value):
+            self.paths.append((path, value))
+        elif isinstance(value, dict):
+            for k, v in value.items():
+                self._collect(v, path + (k,))
+        elif isinstance(value, list):
+            for i, v in enumerate(value):
+                self._collect(v, path + (i,))
+
+    @property
+    def static(self) -> bool:
+        return not self.paths
+
+    def render(self, context: TemplateContext) -> Any:
+        if not self.paths:
+            return self.value
+        if not self.paths[0][0]:
+            # Всё значение — одна строка‑шаблон
+            return _format_template(self.value, context)
+        root = copy.copy(self.value)
+        copied: Dict[Tuple[Any, ...], Any] = {(): root}
+        for path, template in self.paths:
+            container = root
+            for depth in range(1, len(path)):
+                prefix = path[:depth]
+                child = copied.get(prefix)
+                if child is None:
+                    child = copy.copy(container[path[depth - 1]])
+                    container[path[depth - 1]] = child
+                    copied[prefix] = child
+                container = child
+            container[path[-1]] = _format_template(template, context)
+        return root
+
+
+def _build_mock_body_response(body: Any, status_code: int) -> Tuple[Response, Optional[bytes]]:
+    """Создаёт Response по телу мока. Возвращает (response, raw), raw — байты файлового ответа или None."""
+    # Поддержка файловых ответов через спец‑структуру
+    is_file = isinstance(body, dict) and body.get("__file__") is True and "data_base64" in body
+    if is_file:
         try:
-            return s.format_map(safe_context)
+            raw = base64.b64decode(body.get("data_base64") or "")
         except Exception:
-            # Если форматирование не удалось, возвращаем исходную строку
-            return s
+            raw = b""
 
-    if isinstance(value, str):
-        return _fmt(value)
-    if isinstance(value, dict):
-        return {k: _apply_templates(v, req, full_inner) for k, v in value.items()}
-    if isinstance(value, list):
-        return [_apply_templates(v, req, full_inner) for v in value]
-    return value
+        resp = Response(
+            content=raw,
+            status_code=status_code,
+            media_type=body.get("mime_type") or "application/octet-stream",
+        )
+        filename = body.get("filename")
+        if filename:
+            # Используем RFC 5987 для поддержки кириллицы и других не-ASCII символов
+            try:
+                # Сначала пробуем стандартное кодирование для ASCII имён
+                filename.encode('ascii')
+                resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+            except UnicodeEncodeError:
+                # Если есть не-ASCII символы, используем RFC 5987
+                encoded_filename = encode_filename_rfc5987(filename)
+                resp.headers["Content-Disposition"] = f"attachment; filename*={encoded_filename}"
+        return resp, raw
+
+    # Обрабатываем тело ответа в зависимости от его типа
+    # Цель: отправлять данные точно так, как они записаны в моке
+    # Если записан JSON (dict/list), отправляем как JSON
+    # Если записана строка JSON, отправляем как JSON
+    # Если записана обычная строка, отправляем как текст
+    if isinstance(body, str):
+        # Проверяем, является ли строка валидным JSON
+        try:
+            json_loads(body)
+            # Если успешно, это JSON строка - отправляем как JSON
+            media_type = "application/json"
+        except (json.JSONDecodeError, ValueError):
+            # Если не JSON, отправляем как обычный текст
+            media_type = "text/plain; charset=utf-8"
+        return Response(content=body.encode('utf-8'), status_code=status_code, media_type=media_type), None
+
+    # dict, list и другие типы (int, float, bool, None) отправляем через ORJSONResponse:
+    # он сериализует тело и устанавливает Content-Type: application/json
+    return ORJSONResponse(content=body, status_code=status_code), None
 
 
-def _rate_limit_exceeded(client_ip: str) -> bool:
-    """Простое rate limiting по IP и окну времени."""
-    if RATE_LIMIT_REQUESTS <= 0:
+# Заголовки мока, которые вычисляются автоматически или не должны попадать в ответ
+MOCK_RESPONSE_SKIP_HEADERS = {
+    "content-length", "connection", "date", "server",
+    "transfer-encoding", "content-encoding", "postman-token", "host", "user-agent", "render-proxy-ttl",
+    "vary", "alt-svc", "x-render-origin-server", "cf-cache-status", "cache-status", "cf-ray"
+}
+MOCK_RESPONSE_SKIP_HEADER_PREFIXES = ("cf-", "rndr-")
+
+
+def _apply_mock_response_headers(resp: Response, headers: Optional[Dict[str, Any]]) -> None:
+    """Переносит заголовки мока в ответ, пропуская системные."""
+    for k, v in (headers or {}).items():
+        kl = k.lower()
+        # Пропускаем системные заголовки и заголовки с префиксами cf-* и rndr-*
+        if kl in MOCK_RESPONSE_SKIP_HEADERS or kl.startswith(MOCK_RESPONSE_SKIP_HEADER_PREFIXES):
+            continue
+        # Пропускаем Content-Type, если он уже установлен автоматически для JSON ответов
+        # Это гарантирует, что JSON ответы всегда имеют правильный Content-Type
+        if kl == "content-type" and resp.media_type and resp.media_type.startswith("application/json"):
+            continue
+        resp.headers[k] = v
+
+
+# Заголовки, которые сохраняются в ответе 304 Not Modified (RFC 9110, 15.4.5)
+NOT_MODIFIED_KEEP_HEADERS = {"etag", "last-modified", "cache-control", "content-location", "date", "expires", "vary"}
+
+
+def _compute_etag(content: bytes) -> str:
+    """Сильный ETag по байтам тела ответа."""
+    return '"' + hashlib.blake2b(content or b"", digest_size=16).hexdigest() + '"'
+
+
+def _add_validators(resp: Response, updated_at: Optional[int]) -> None:
+    """Добавляет ETag и Last-Modified, если они не заданы в заголовках мока явно."""
+    if "etag" not in resp.headers:
+        resp.headers["ETag"] = _compute_etag(resp.body)
+    if updated_at and "last-modified" not in resp.headers:
+        resp.headers["Last-Modified"] = formatdate(updated_at, usegmt=True)
+
+
+def _strip_weak_etag(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _is_not_modified(req: Request, headers) -> bool:
+    """Проверяет If-None-Match / If-Modified-Since запроса против валидаторов ответа."""
+    if req.method not in ("GET", "HEAD"):
         return False
-    now = time.time()
-    state = RATE_LIMIT_STATE.get(client_ip) or {"start": now, "count": 0}
-    window_start = state["start"]
-    if now - window_start > RATE_LIMIT_WINDOW_SECONDS:
-        # новое окно
-        state = {"start": now, "count": 0}
-    state["count"] += 1
-    RATE_LIMIT_STATE[client_ip] = state
-    return state["count"] > RATE_LIMIT_REQUESTS
-
-
-# Catch-all маршрут для обработки моков
-@app.api_route("/{full_path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
+    if_none_match = req.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match приоритетнее If-Modified-Since; сравнение слабое (RFC 9110, 13.1.2)
+        etag = headers.get("etag")
+        if not etag:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        etag = _strip_weak_etag(etag)
+        return any(_strip_weak_etag(tag.strip()) == etag for tag in if_none_match.split(","))
+    if_modified_since = req.headers.get("if-modified-since")
+    last_modified = headers.get("last-modified")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError, IndexError):
+            return False
+    return False
+
+
+def _not_modified_response(headers) -> Response:
+    resp = Response(status_code=304)
+    for k, v in headers.items():
+        if k.lower() in NOT_MODIFIED_KEEP_HEADERS:
+            resp.headers[k] = v
+    return resp
+
+
+def _build_compressors() -> Dict[str, Any]:
+    available = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        available["br"] = lambda data: brotli.compress(data, quality=9)
+    if zstandard is not None:
+        available["zstd"] = lambda data: zstandard.ZstdCompressor(level=10).compress(data)
+    unknown = [e for e in COMPRESSION_ENCODINGS if e not in ("gzip", "br", "zstd")]
+    if unknown:
+        logger.warning(f"Unknown MOCKL_COMPRESSION_ENCODINGS entries ignored: {unknown}")
+    return {e: available[e] for e in COMPRESSION_ENCODINGS if e in available}
+
+
+# Кодеки в порядке предпочтения сервера (только доступные в окружении)
+COMPRESSORS: Dict[str, Any] = _build_compressors()
+
+
+def _negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Выбирает кодек по Accept-Encoding: максимальный q, при равенстве — порядок сервера."""
+    if not accept_encoding or not COMPRESSORS:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in COMPRESSORS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class PrerenderedResponse(Response):
+    """Ответ из заранее сериализованных байтов: без кодирования тела и сборки заголовков."""
+
+    def __init__(self, status_code: int, body: bytes, raw_headers: List[Tuple[bytes, bytes]], media_type: Optional[str]):
+        self.status_code = status_code
+        self.body = body
+        self.media_type = media_type
+        self.background = None
+        # Копия списка: заголовки конкретного ответа можно менять, не затрагивая шаблон
+        self.raw_headers = list(raw_headers)
+
+
+class ThrottledResponse(Response):
+    """Ответ мока с медленной отдачей тела: порциями по chunk_size со скоростью rate байт/с.
+
+    Порции — срезы memoryview исходных байтов, без копирования. Паузы между ними
+    ждут в колесе таймеров, поэтому тысячи медленных соединений не требуют
+    потоков. Если chunked=True, Content-Length не отправляется (chunked transfer).
+    """
+
+    def __init__(self, source: Response, rate: Optional[float], chunk_size: int, chunked: bool, folder_name: str):
+        self.status_code = source.status_code
+        self.body = source.body
+        self.media_type = source.media_type
+        self.background = source.background
+        self.raw_headers = [(k, v) for k, v in source.raw_headers if not (chunked and k.lower() == b"content-length")]
+        self.rate = rate
+        self.chunk_size = max(1, chunk_size)
+        self.folder_name = folder_name
+
+    async def __call__(self, scope, receive, send) -> None:
+        disconnected = False
+
+        async def watch_disconnect() -> None:
+            nonlocal disconnected
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected = True
+
+        watcher = asyncio.ensure_future(watch_disconnect()) if self.rate else None
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            view = memoryview(self.body)
+            total = len(view)
+            started = time.monotonic()
+            sent = 0
+            while sent < total and not disconnected:
+                chunk = view[sent:sent + self.chunk_size]
+                sent += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": sent < total})
+                if self.rate and sent < total:
+                    # Темп считается от начала отдачи, поэтому паузы не накапливают погрешность
+                    wait = started + sent / self.rate - time.monotonic()
+                    if wait > 0:
+                        await _sleep_ms(wait * 1000)
+            THROTTLED_BYTES.labels(folder=self.folder_name).inc(sent)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+        if self.background is not None:
+            await self.background()
+
+
+def _is_throttled(resp: Response, m: Mock) -> bool:
+    if not (m.throttle_kbps or m.throttle_chunked) or resp.status_code == 304:
+        return False
+    return isinstance(getattr(resp, "body", None), (bytes, bytearray)) and bool(resp.body)
+
+
+def _throttle_transfer_ms(resp: Response, m: Mock) -> float:
+    """Время передачи тела с ограничением скорости мока (для виртуального времени)."""
+    if not m.throttle_kbps or not _is_throttled(resp, m):
+        return 0.0
+    return len(resp.body) / (m.throttle_kbps * 1024) * 1000
+
+
+def _throttle_response(resp: Response, m: Mock, folder_name: str, virtual_time: bool = False) -> Response:
+    """Оборачивает ответ мока в ThrottledResponse, если у мока задано ограничение скорости или chunked.
+
+    В режиме виртуального времени тело отдаётся теми же порциями, но без пауз.
+    """
+    if not _is_throttled(resp, m):
+        return resp
+    return ThrottledResponse(
+        resp,
+        m.throttle_kbps * 1024 if m.throttle_kbps and not virtual_time else None,
+        m.throttle_chunk_bytes or THROTTLE_CHUNK_BYTES,
+        bool(m.throttle_chunked),
+        folder_name,
+    )
+
+
+def _virtual_time_enabled(folder: Optional[Folder]) -> bool:
+    """Виртуальное время включено глобально (MOCKL_VIRTUAL_TIME) или для папки."""
+    return VIRTUAL_TIME or bool(folder is not None and folder.virtual_time)
+
+
+def _report_simulated_delay(resp: Response, simulated_ms: float, folder_name: str) -> None:
+    """Сообщает клиенту пропущенную задержку; заголовок есть всегда, даже при 0, — признак виртуального времени."""
+    resp.headers[SIMULATED_DELAY_HEADER] = str(int(round(simulated_ms)))
+    if simulated_ms > 0:
+        VIRTUAL_TIME_SKIPPED.labels(folder=folder_name).inc(simulated_ms / 1000)
+
+
+class CompiledMock:
+    """Результат компиляции мока для горячего пути.
+
+    Для статических моков (без плейсхолдеров в теле и заголовках) ответ собирается
+    один раз: статус, сырые заголовки и байты тела затем отдаются без сериализации.
+    Для остальных хранятся планы подстановок тела и заголовков.
+    """
+
+    def __init__(self, m: Mock):
+        self.mock_id = m.id
+        self.version = m.version or 0
+        self.body = _clean_response_body(m.response_body)
+        self.body_plan = TemplatePlan(self.body)
+        self.headers_plan = TemplatePlan(m.response_headers or {})
+        self.static = self.body_plan.static and self.headers_plan.static
+        self.status_code = m.status_code
+        self.updated_at = m.updated_at
+        # ETag / Last-Modified и 304 имеют смысл только для успешных ответов
+        self.conditional = m.conditional_requests_enabled is not False and 200 <= m.status_code < 300
+        self.content: Optional[bytes] = None
+        self.raw_headers: List[Tuple[bytes, bytes]] = []
+        self.media_type: Optional[str] = None
+        self.raw: Optional[bytes] = None
+        # Сжатые варианты: encoding -> (тело, сырые заголовки, время сжатия) или None, если сжатие не выгодно
+        self.variants: Dict[str, Optional[Tuple[bytes, List[Tuple[bytes, bytes]], float]]] = {}
+        self.compressible = False
+        if self.static:
+            try:
+                resp, self.raw = _build_mock_body_response(self.body, m.status_code)
+                _apply_mock_response_headers(resp, m.response_headers)
+                _remove_system_headers(resp)
+                if self.conditional:
+                    _add_validators(resp, self.updated_at)
+                self.compressible = bool(COMPRESSORS) and len(resp.body) >= COMPRESSION_MIN_BYTES
+                if self.compressible:
+                    resp.headers.add_vary_header("Accept-Encoding")
+            except Exception as e:
+                # Тело или заголовки не сериализуются заранее — отдаём их обычным путём
+                logger.debug(f"Mock {m.id} cannot be pre-rendered: {e}")
+                self.static = False
+            else:
+                self.content = resp.body
+                self.raw_headers = list(resp.raw_headers)
+                self.media_type = resp.media_type
+
+    @property
+    def kind(self) -> str:
+        return "static" if self.static else "dynamic"
+
+    def to_response(self, encoding: Optional[str] = None) -> PrerenderedResponse:
+        variant = self.variants.get(encoding) if encoding else None
+        if variant is not None:
+            return PrerenderedResponse(self.status_code, variant[0], variant[1], self.media_type)
+        return PrerenderedResponse(self.status_code, self.content, self.raw_headers, self.media_type)
+
+    def build_variant(self, encoding: str) -> None:
+        """Сжимает тело один раз на версию мока; невыгодное сжатие запоминается как None."""
+        started = time.perf_counter()
+        data = COMPRESSORS[encoding](self.content)
+        elapsed = time.perf_counter() - started
+        COMPRESSION_RATIO.labels(encoding=encoding).observe(len(data) / len(self.content))
+        if len(data) >= len(self.content):
+            self.variants[encoding] = None
+            return
+        headers = MutableHeaders(raw=list(self.raw_headers))
+        headers["content-encoding"] = encoding
+        headers["content-length"] = str(len(data))
+        etag = headers.get("etag")
+        if etag and etag.endswith('"'):
+            # Сильный ETag различается для каждого представления
+            headers["etag"] = f'{etag[:-1]}-{encoding}"'
+        self.variants[encoding] = (data, headers.raw, elapsed)
+
+    def render(self, req: Request, full_inner: str) -> Tuple[Any, Response, Optional[bytes]]:
+        """Рендерит динамический мок по планам. Возвращает (тело, response, raw файлового ответа)."""
+        context = TemplateContext(req, full_inner)
+        body = self.body_plan.render(context)
+        resp, raw = _build_mock_body_response(body, self.status_code)
+        _apply_mock_response_headers(resp, self.headers_plan.render(context))
+        return body, resp, raw
+
+
+async def _select_compressed_variant(compiled: CompiledMock, req: Request, folder_name: str) -> Optional[str]:
+    """Выбирает сжатый вариант статического мока по Accept-Encoding (сжимая при первом запросе)."""
+    if not compiled.compressible:
+        return None
+    encoding = _negotiate_encoding(req.headers.get("accept-encoding"))
+    if not encoding:
+        return None
+    if encoding in compiled.variants:
+        variant = compiled.variants[encoding]
+        if variant is not None:
+            # Сжатие уже выполнено для этой версии мока — экономим его время
+            COMPRESSION_TIME_SAVED.labels(encoding=encoding).inc(variant[2])
+    else:
+        await run_in_threadpool(compiled.build_variant, encoding)
+        variant = compiled.variants[encoding]
+    if variant is None:
+        return None
+    COMPRESSED_RESPONSES.labels(folder=folder_name, encoding=encoding).inc()
+    COMPRESSION_BYTES_SAVED.labels(encoding=encoding).inc(len(compiled.content) - len(variant[0]))
+    return encoding
+
+
+def _get_compiled_mock(m: Mock) -> CompiledMock:
+    """Возвращает скомпилированный мок, перекомпилируя его при смене версии."""
+    compiled = COMPILED_MOCKS.get(m.id)
+    if compiled is not None and compiled.version == (m.version or 0):
+        return compiled
+    if compiled is not None:
+        COMPILED_MOCKS_GAUGE.labels(kind=compiled.kind).dec()
+    compiled = CompiledMock(m)
+    COMPILED_MOCKS[m.id] = compiled
+    COMPILED_MOCKS_GAUGE.labels(kind=compiled.kind).inc()
+    return compiled
+
+
+def _forget_compiled_mock(mock_id: str) -> None:
+    compiled = COMPILED_MOCKS.pop(mock_id, None)
+    if compiled is not None:
+        COMPILED_MOCKS_GAUGE.labels(kind=compiled.kind).dec()
+
+
+# Глобальный лимит из переменных окружения: отдельный для каждого клиента
+GLOBAL_RATE_LIMIT: Optional[Dict[str, Any]] = {
+    "requests": RATE_LIMIT_REQUESTS,
+    "window_seconds": RATE_LIMIT_WINDOW_SECONDS,
+    "algorithm": RATE_LIMIT_ALGORITHM,
+    "burst": RATE_LIMIT_BURST or None,
+    "per_client": True,
+} if RATE_LIMIT_REQUESTS > 0 else None
+
+
+def _rate_limit_headers(policy: Dict[str, Any], remaining: int, reset: float) -> List[Tuple[bytes, bytes]]:
+    """Заголовки RateLimit-* (draft-ietf-httpapi-ratelimit-headers)."""
+    window = policy.get("window_seconds") or 60
+    return [
+        (b"ratelimit-limit", str(policy["requests"]).encode()),
+        (b"ratelimit-remaining", str(max(0, remaining)).encode()),
+        (b"ratelimit-reset", str(max(0, math.ceil(reset))).encode()),
+        (b"ratelimit-policy", f"{policy['requests']};w={window:g}".encode()),
+    ]
+
+
+async def _check_rate_limit(
+    request: Request, scope: str, ident: str, policy: Dict[str, Any], folder_name: str
+) -> Optional[Response]:
+    """Учитывает запрос в лимите области (global, folder, mock); при превышении возвращает ответ 429.
+
+    Ключ клиента (per_client) — значение заголовка key_header (или MOCKL_RATE_LIMIT_KEY_HEADER),
+    иначе IP. Заголовки RateLimit-* самого строгого из пройденных лимитов добавляются к ответу.
+    Если хранилище недоступно, запрос пропускается.
+    """
+    key = f"{scope}:{ident}"
+    if policy.get("per_client"):
+        header = policy.get("key_header") or RATE_LIMIT_KEY_HEADER
+        client = request.headers.get(header) if header else None
+        key += ":" + (client or (request.client.host if request.client else "unknown"))
+    try:
+        if RATE_LIMIT_STORE.blocking:
+            allowed, remaining, reset, retry = await run_in_threadpool(RATE_LIMIT_STORE.hit, key, policy, time.time())
+        else:
+            allowed, remaining, reset, retry = RATE_LIMIT_STORE.hit(key, policy, time.time())
+    except Exception as e:
+        logger.warning(f"Rate limit check failed for {key}: {e}")
+        return None
+    headers = _rate_limit_headers(policy, remaining, reset)
+    if not allowed:
+        RATE_LIMITED.inc()
+        RATE_LIMIT_REJECTED.labels(scope=scope, folder=folder_name).inc()
+        REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="rate_limited").inc()
+        resp = ORJSONResponse(content={"detail": "Too Many Requests"}, status_code=429)
+        resp.raw_headers.extend(headers)
+        resp.headers["Retry-After"] = str(max(1, math.ceil(retry)))
+        # Заголовки пройденных лимитов уже в ответе 429 не нужны
+        request.scope.pop(EXTRA_HEADERS_SCOPE_KEY, None)
+        return resp
+    current = request.scope.get(EXTRA_HEADERS_SCOPE_KEY)
+    # current[1] — ratelimit-remaining ранее пройденного лимита
+    if current is None or remaining < int(current[1][1]):
+        request.scope[EXTRA_HEADERS_SCOPE_KEY] = headers
+    return None
+
+
+# Catch-all маршрут для обработки моков (регистрируется ниже, если основное приложение обслуживает моки)
 async def mock_handler(request: Request, full_path: str, db: Session = Depends(get_db)):
     """Обработчик всех запросов, не совпадающих с API маршрутами."""
     folder_name = "default"
     start_time = time.time()
 
-    # Rate limiting
-    client_ip = request.client.host if request.client else "unknown"
-    if _rate_limit_exceeded(client_ip):
-        RATE_LIMITED.inc()
-        REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="rate_limited").inc()
-        raise HTTPException(status_code=429, detail="Too Many Requests")
+    # Rate limiting (глобальный лимит на клиента)
+    if GLOBAL_RATE_LIMIT is not None:
+        limited = await _check_rate_limit(request, "global", "*", GLOBAL_RATE_LIMIT, folder_name)
+        if limited is not None:
+            return limited
 
     # Исключаем API пути из обработки моков
     if full_path.startswith("api/"):
         raise HTTPException(404, "No matching mock found")
     
-    # Читаем тело запроса один раз для всех проверок
-    body_bytes = await request.body()
-    
-    # Ограничение размера тела
-    if MAX_REQUEST_BODY_BYTES > 0:
-        if len(body_bytes) > MAX_REQUEST_BODY_BYTES:
-            REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="too_large").inc()
-            raise HTTPException(status_code=413, detail="Request entity too large")
-
     # Определяем папку по URL префиксу
     # Поддерживаем пути вида /parent/sub/... для подпапок
     path = request.url.path  # например "/nikita/cnsgate-t/api/login" или "/auth/api/login"
@@ -5373,6 +10293,42 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
         # Пустой путь - используем default (уже установлено выше)
         pass
 
+    # Лимит запросов папки
+    if folder is not None and folder.rate_limit:
+        limited = await _check_rate_limit(
+            request, "folder", _folder_cache_tag(folder.name, folder.parent_folder), folder.rate_limit, folder_name
+        )
+        if limited is not None:
+            return limited
+
+    # Бюджеты папки: медленная папка ждёт в своей очереди и не занимает ресурсы остальных
+    rejected = await _enter_bulkhead(request, db, folder, folder_name)
+    if rejected is not None:
+        return rejected
+
+    # Читаем тело запроса один раз для всех проверок.
+    # Для папок с потоковым прокси тело читается только если оно нужно моку (body_contains),
+    # иначе оно передаётся upstream прямо из ASGI‑потока
+    # Режим записи сохраняет тело ответа целиком, поэтому потоковая передача при нём не используется
+    stream_proxy = bool(
+        folder and folder.proxy_enabled and folder.proxy_base_url and folder.proxy_streaming
+        and not folder.proxy_record_enabled
+    )
+    body_bytes = None if stream_proxy else await request.body()
+    
+    # Ограничение размера тела (для потокового прокси — по Content-Length и при передаче)
+    if MAX_REQUEST_BODY_BYTES > 0:
+        if body_bytes is not None:
+            body_size = len(body_bytes)
+        else:
+            try:
+                body_size = int(request.headers.get("content-length") or 0)
+            except ValueError:
+                body_size = 0
+        if body_size > MAX_REQUEST_BODY_BYTES:
+            REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="too_large").inc()
+            raise HTTPException(status_code=413, detail="Request entity too large")
+
 
     query_suffix = f"?{request.url.query}" if request.url.query else ""
     full_inner = f"{inner_path}{query_suffix}"
@@ -5425,10 +10381,22 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
         logger.warning(f"No mocks found in folder '{folder_name}' with folder_parent='{folder_parent}'")
     
     for m in mocks:
+        if body_bytes is None and m.body_contains:
+            body_bytes = await request.body()
         matched = await match_condition(request, m, full_inner, body_bytes)
         logger.info(f"Mock {m.id} ({m.method} {m.path}): matched={matched}, mock_headers={m.headers}, mock_body_contains={'yes' if m.body_contains else 'no'}, request_path={full_inner}")
         if matched:
-            body = _clean_response_body(m.response_body)
+            # Лимит запросов мока (в том числе для имитации троттлинга upstream)
+            if m.rate_limit:
+                limited = await _check_rate_limit(request, "mock", m.id, m.rate_limit, folder_name)
+                if limited is not None:
+                    return limited
+            if body_bytes is None:
+                body_bytes = await request.body()
+            # Скомпилированный мок (очищенное тело, готовый ответ для статических моков)
+            compiled = _get_compiled_mock(m)
+            # Генератор папки с seed: задержки, ошибки и сетевые сбои воспроизводимы
+            rng = _folder_random(folder, request.method, full_inner.split('?')[0])
 
             # Попытка отдать из кэша
             ttl = _get_cache_ttl(m)
@@ -5436,7 +10404,7 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
             if ttl > 0:
                 cache_key = _cache_key_for_mock(m, request.method, full_inner)
                 logger.info(f"Cache check for mock {m.id}: ttl={ttl}, cache_key={cache_key}")
-                cached = RESPONSE_CACHE.get(cache_key)
+                cached = await _cache_call("get", cache_key)
                 if cached:
                     expires_at, cached_payload = cached
                     current_time = time.time()
@@ -5444,14 +10412,31 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                         logger.info(f"Cache HIT for mock {m.id}: expires_at={expires_at}, current_time={current_time}, ttl_remaining={expires_at - current_time:.2f}s")
                         CACHE_HITS.labels(folder=folder_name).inc()
                         REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="cache_hit").inc()
-                        # Восстанавливаем Response из кэша
-                        resp = Response(
-                            content=cached_payload["content"],
-                            status_code=cached_payload["status_code"],
-                            media_type=cached_payload["media_type"],
-                        )
-                        for k, v in cached_payload.get("headers", {}).items():
-                            resp.headers[k] = v
+                        cached_headers = cached_payload.get("headers", {})
+                        # Для статических моков в кэше те же байты, что и в скомпилированном ответе
+                        encoding = await _select_compressed_variant(compiled, request, folder_name)
+                        if encoding:
+                            resp = compiled.to_response(encoding)
+                        elif _is_not_modified(request, cached_headers):
+                            # У клиента актуальная версия — тело не отправляем
+                            resp = _not_modified_response(cached_headers)
+                        else:
+                            # Восстанавливаем Response из кэша
+                            resp = Response(
+                                content=cached_payload["content"],
+                                status_code=cached_payload["status_code"],
+                                media_type=cached_payload["media_type"],
+                            )
+                            for k, v in cached_headers.items():
+                                resp.headers[k] = v
+                        if encoding and _is_not_modified(request, resp.headers):
+                            resp = _not_modified_response(resp.headers)
+                        if resp.status_code == 304:
+                            NOT_MODIFIED.labels(folder=folder_name, source="cache").inc()
+                        virtual_time = _virtual_time_enabled(folder)
+                        simulated_delay_ms = _throttle_transfer_ms(resp, m) if virtual_time else 0.0
+                        if virtual_time:
+                            _report_simulated_delay(resp, simulated_delay_ms, folder_name)
                         response_time = time.time() - start_time
                         RESPONSE_TIME.labels(folder=folder_name).observe(response_time)
                         
@@ -5500,14 +10485,15 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                                 method=request.method,
                                 path=full_inner.split('?')[0],
                                 is_proxied=False,
-                                response_time_ms=int(response_time * 1000),
+                                response_time_ms=int(response_time * 1000 + simulated_delay_ms),
                                 status_code=resp.status_code,
                                 cache_ttl_seconds=ttl if ttl > 0 else None,
                                 cache_key=cache_key,
                                 request_headers=request_headers_dict,
                                 request_body=request_body_str,
                                 response_headers=response_headers_dict,
-                                response_body=response_body_str
+                                response_body=response_body_str,
+                                simulated_delay_ms=int(simulated_delay_ms) if virtual_time else None
                             )
                             db.add(request_log)
                             db.commit()
@@ -5528,37 +10514,52 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                                 f"  Mock ID: {m.id}\n"
                                 f"  Метод: {request.method}\n"
                                 f"  Путь: {full_inner}\n"
-                                f"  Заголовки запроса: {json.dumps(request_headers_formatted, ensure_ascii=False, indent=2)}\n"
+                                f"  Заголовки запроса: {json_dumps(request_headers_formatted, indent=True)}\n"
                                 f"  Тело запроса:\n{request_body_formatted}\n"
                                 f"  Статус ответа: {resp.status_code}\n"
-                                f"  Заголовки ответа: {json.dumps(response_headers_formatted, ensure_ascii=False, indent=2)}\n"
+                                f"  Заголовки ответа: {json_dumps(response_headers_formatted, indent=True)}\n"
                                 f"  Тело ответа:\n{response_body_formatted}"
                             )
                         except Exception as e:
                             logger.warning(f"[ВРЕМЕННОЕ ЛОГИРОВАНИЕ] Ошибка при логировании вызова мока из кэша: {e}", exc_info=True)
                         
                         # Удаляем системные заголовки из ответа из кэша
-                        _remove_system_headers(resp)
+                        # (ответы статических моков очищены при компиляции)
+                        if not compiled.static:
+                            _remove_system_headers(resp)
                         
-                        return resp
+                        _arm_chaos(request, m, folder_name, rng)
+                        return _throttle_response(resp, m, folder_name, virtual_time)
                     else:
                         logger.info(f"Cache EXPIRED for mock {m.id}: expires_at={expires_at}, current_time={current_time}")
                         # Удаляем истекший кеш
-                        RESPONSE_CACHE.pop(cache_key, None)
+                        await _cache_call("pop", cache_key)
+                        CACHE_MISSES.labels(folder=folder_name).inc()
                 else:
                     logger.info(f"Cache MISS for mock {m.id}: key not found in cache")
+                    CACHE_MISSES.labels(folder=folder_name).inc()
 
             # Задержка ответа при необходимости
             # (фиксированная или диапазон)
-            delay_ms = _get_delay_ms(m)
+            delay_ms = await _get_delay_ms(m, db, rng)
+            # В виртуальном времени задержки не выполняются, а накапливаются и сообщаются клиенту
+            virtual_time = _virtual_time_enabled(folder)
+            simulated_delay_ms = 0.0
 
             # Имитация ошибок
-            err_cfg = _maybe_simulate_error(m, folder_name)
+            err_cfg = _maybe_simulate_error(m, folder_name, rng)
             if err_cfg:
                 if err_cfg["delay_ms"] > 0:
-                    await asyncio.sleep(err_cfg["delay_ms"] / 1000.0)
+                    if virtual_time:
+                        simulated_delay_ms += err_cfg["delay_ms"]
+                    else:
+                        _bulkhead_pause(request, db)
+                        await _sleep_ms(err_cfg["delay_ms"])
+                        await _bulkhead_resume(request)
                 resp_body = _apply_templates(err_cfg["body"], request, full_inner)
-                resp = JSONResponse(content=resp_body, status_code=err_cfg["status_code"])
+                resp = ORJSONResponse(content=resp_body, status_code=err_cfg["status_code"])
+                if virtual_time:
+                    _report_simulated_delay(resp, simulated_delay_ms, folder_name)
                 response_time = time.time() - start_time
                 RESPONSE_TIME.labels(folder=folder_name).observe(response_time)
                 REQUESTS_TOTAL.labels(method=request.method, path=request.url.path, folder=folder_name, outcome="error_simulated").inc()
@@ -5593,7 +10594,7 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                     # Сохраняем тело ответа
                     response_body_str = None
                     if isinstance(resp_body, (dict, list)):
-                        response_body_str = json.dumps(resp_body, ensure_ascii=False)
+                        response_body_str = json_dumps(resp_body)
                     else:
                         response_body_str = str(resp_body)
                     response_body_str = _remove_nul_chars(response_body_str)
@@ -5605,14 +10606,15 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                         method=request.method,
                         path=full_inner.split('?')[0],
                         is_proxied=False,
-                        response_time_ms=int(response_time * 1000),
+                        response_time_ms=int(response_time * 1000 + simulated_delay_ms),
                         status_code=err_cfg["status_code"],
                         cache_ttl_seconds=None,
                         cache_key=None,
                         request_headers=request_headers_dict,
                         request_body=request_body_str,
                         response_headers=response_headers_dict,
-                        response_body=response_body_str
+                        response_body=response_body_str,
+                        simulated_delay_ms=int(simulated_delay_ms) if virtual_time else None
                     )
                     db.add(request_log)
                     db.commit()
@@ -5625,17 +10627,17 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                     request_headers_formatted = dict(request.headers)
                     request_body_formatted = _format_body_for_logging(body_bytes)
                     response_headers_formatted = dict(resp.headers)
-                    response_body_formatted = json.dumps(resp_body, ensure_ascii=False, indent=2) if isinstance(resp_body, (dict, list)) else str(resp_body)
+                    response_body_formatted = json_dumps(resp_body, indent=True) if isinstance(resp_body, (dict, list)) else str(resp_body)
                     
                     logger.info(
                         "[ВРЕМЕННОЕ ЛОГИРОВАНИЕ] Вызов мока (имитация ошибки):\n"
                         f"  Mock ID: {m.id}\n"
                         f"  Метод: {request.method}\n"
                         f"  Путь: {full_inner}\n"
-                        f"  Заголовки запроса: {json.dumps(request_headers_formatted, ensure_ascii=False, indent=2)}\n"
+                        f"  Заголовки запроса: {json_dumps(request_headers_formatted, indent=True)}\n"
                         f"  Тело запроса:\n{request_body_formatted}\n"
                         f"  Статус ответа: {resp.status_code}\n"
-                        f"  Заголовки ответа: {json.dumps(response_headers_formatted, ensure_ascii=False, indent=2)}\n"
+                        f"  Заголовки ответа: {json_dumps(response_headers_formatted, indent=True)}\n"
                         f"  Тело ответа:\n{response_body_formatted}"
                     )
                 except Exception as e:
@@ -5644,125 +10646,87 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                 # Удаляем системные заголовки из ответа с имитацией ошибки
                 _remove_system_headers(resp)
                 
+                _arm_chaos(request, m, folder_name, rng)
                 return resp
 
             if delay_ms and delay_ms > 0:
-                await asyncio.sleep(delay_ms / 1000.0)
-
-            body = _apply_templates(body, request, full_inner)
-
-
-            # Поддержка файловых ответов через спец‑структуру
-            is_file = isinstance(body, dict) and body.get("__file__") is True and "data_base64" in body
-            raw = None  # Инициализируем для использования в логировании
-            if is_file:
-                try:
-                    raw = base64.b64decode(body.get("data_base64") or "")
-                except Exception:
-                    raw = b""
-
-
-                resp = Response(
-                    content=raw,
-                    status_code=m.status_code,
-                    media_type=body.get("mime_type") or "application/octet-stream",
-                )
-                filename = body.get("filename")
-                if filename:
-                    # Используем RFC 5987 для поддержки кириллицы и других не-ASCII символов
-                    try:
-                        # Сначала пробуем стандартное кодирование для ASCII имён
-                        filename.encode('ascii')
-                        resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
-                    except UnicodeEncodeError:
-                        # Если есть не-ASCII символы, используем RFC 5987
-                        encoded_filename = encode_filename_rfc5987(filename)
-                        resp.headers["Content-Disposition"] = f"attachment; filename*={encoded_filename}"
-            else:
-                # Обрабатываем тело ответа в зависимости от его типа
-                # Цель: отправлять данные точно так, как они записаны в моке
-                # Если записан JSON (dict/list), отправляем как JSON
-                # Если записана строка JSON, отправляем как JSON
-                # Если записана обычная строка, отправляем как текст
-                
-                if isinstance(body, str):
-                    # Проверяем, является ли строка валидным JSON
-                    try:
-                        # Пытаемся распарсить строку как JSON
-                        parsed_json = json.loads(body)
-                        # Если успешно, это JSON строка - отправляем как JSON
-                        # Кодируем в bytes для Response
-                        resp = Response(
-                            content=body.encode('utf-8'),
-                            status_code=m.status_code,
-                            media_type="application/json",
-                        )
-                    except (json.JSONDecodeError, ValueError):
-                        # Если не JSON, отправляем как обычный текст
-                        resp = Response(
-                            content=body.encode('utf-8'),
-                            status_code=m.status_code,
-                            media_type="text/plain; charset=utf-8",
-                        )
-                elif isinstance(body, (dict, list)):
-                    # Если это dict или list, отправляем через JSONResponse
-                    # JSONResponse автоматически сериализует в JSON и устанавливает правильный Content-Type: application/json
-                    resp = JSONResponse(
-                        content=body,
-                        status_code=m.status_code
-                    )
+                if virtual_time:
+                    simulated_delay_ms += delay_ms
                 else:
-                    # Для других типов (int, float, bool, None) также отправляем как JSON
-                    resp = JSONResponse(
-                        content=body,
-                        status_code=m.status_code
-                    )
-
-
-            # Заголовки ответа с подстановками
-            # Игнорируем системные заголовки, которые вычисляются автоматически или не должны попадать в ответ
-            system_headers = {
-                "content-length", "connection", "date", "server", 
-                "transfer-encoding", "content-encoding", "postman-token", "host", "user-agent", "render-proxy-ttl",
-                "vary", "alt-svc", "x-render-origin-server", "cf-cache-status", "cache-status", "cf-ray"
-            }
-            # Проверяем префиксы для cf-* и rndr-*
-            system_header_prefixes = ["cf-", "rndr-"]
-            
-            for k, v in (m.response_headers or {}).items():
-                kl = k.lower()
-                # Пропускаем системные заголовки (точное совпадение)
-                if kl in system_headers:
-                    continue
-                # Пропускаем заголовки с префиксами cf-* и rndr-*
-                if any(kl.startswith(prefix) for prefix in system_header_prefixes):
-                    continue
-                # Пропускаем Content-Type, если он уже установлен автоматически для JSON ответов
-                # Это гарантирует, что JSON ответы всегда имеют правильный Content-Type
-                if kl == "content-type" and resp.media_type and resp.media_type.startswith("application/json"):
-                    continue
-                if isinstance(v, str):
-                    v = _apply_templates(v, request, full_inner)
-                resp.headers[k] = v
+                    _bulkhead_pause(request, db)
+                    await _sleep_ms(delay_ms)
+                    await _bulkhead_resume(request)
+
+            encoding = None
+            if compiled.static:
+                # Статический мок: отдаём заранее сериализованные статус, заголовки и тело
+                encoding = await _select_compressed_variant(compiled, request, folder_name)
+                resp = compiled.to_response(encoding)
+                body, raw, is_file = compiled.body, compiled.raw, compiled.raw is not None
+                MOCK_RENDERS.labels(folder=folder_name, kind="static").inc()
+            else:
+                body, resp, raw = compiled.render(request, full_inner)
+                is_file = raw is not None
+                if compiled.conditional:
+                    _add_validators(resp, compiled.updated_at)
+                MOCK_RENDERS.labels(folder=folder_name, kind="dynamic").inc()
+
+            if (
+                folder is not None and folder.proxy_shadow_enabled and folder.proxy_enabled
+                and folder.proxy_base_url and request.method.upper() in PROXY_SHADOW_METHODS
+                and random.random() < (folder.proxy_shadow_sample_rate or 0)
+            ):
+                # Копия запроса уходит upstream в фоне; ответ клиенту её не ждёт.
+                # Сравнивается полный ответ мока, поэтому условные заголовки не копируются
+                SHADOW_MIRROR.submit({
+                    "folder": folder_name,
+                    "mock_id": m.id,
+                    "base_url": folder.proxy_base_url.rstrip("/"),
+                    "method": request.method,
+                    "full_inner": full_inner,
+                    "headers": {
+                        k: v for k, v in _proxy_request_headers(request).items()
+                        if k.lower() not in SHADOW_SKIP_REQUEST_HEADERS
+                    },
+                    "body": body_bytes,
+                    "status_code": resp.status_code,
+                    "response_headers": m.response_headers,
+                    "response_body": None if is_file else body,
+                })
 
-            # Сохраняем в кэш, если включено
+            # Сохраняем в кэш, если включено (несжатое представление)
             if cache_key and ttl > 0:
-                expires_at = time.time() + ttl
-                RESPONSE_CACHE[cache_key] = (
-                    expires_at,
+                cache_resp = compiled.to_response() if encoding else resp
+                stored = await _cache_call(
+                    "set",
+                    cache_key,
                     {
-                        "status_code": resp.status_code,
-                        "content": resp.body,
-                        "media_type": resp.media_type,
-                        "headers": dict(resp.headers),
+                        "status_code": cache_resp.status_code,
+                        "content": cache_resp.body,
+                        "media_type": cache_resp.media_type,
+                        "headers": dict(cache_resp.headers),
                     },
+                    ttl,
+                    (m.id, _folder_cache_tag(folder_name, folder_parent), full_inner),
                 )
-                logger.info(f"Cache SAVED for mock {m.id}: cache_key={cache_key}, ttl={ttl}s, expires_at={expires_at}")
+                if stored:
+                    logger.info(f"Cache SAVED for mock {m.id}: cache_key={cache_key}, ttl={ttl}s")
+                else:
+                    logger.info(f"Cache SKIPPED for mock {m.id}: response exceeds MOCKL_CACHE_MAX_BYTES")
             elif ttl == 0:
                 logger.debug(f"Cache DISABLED for mock {m.id}: ttl=0")
             elif not cache_key:
                 logger.debug(f"Cache SKIPPED for mock {m.id}: cache_key not generated")
 
+            # Условный запрос: полный ответ уже сохранён в кэш, клиенту отдаём 304 без тела
+            if compiled.conditional and _is_not_modified(request, resp.headers):
+                resp = _not_modified_response(resp.headers)
+                NOT_MODIFIED.labels(folder=folder_name, source="mock").inc()
+
+            if virtual_time:
+                simulated_delay_ms += _throttle_transfer_ms(resp, m)
+                _report_simulated_delay(resp, simulated_delay_ms, folder_name)
+
             response_time = time.time() - start_time
             status_code = resp.status_code
 
@@ -5822,7 +10786,7 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                 else:
                     # Для JSON ответов - сериализуем в JSON
                     try:
-                        response_body_str = json.dumps(body, ensure_ascii=False)
+                        response_body_str = json_dumps(body)
                         response_body_str = _remove_nul_chars(response_body_str)
                     except (TypeError, ValueError):
                         response_body_str = str(body)
@@ -5835,14 +10799,15 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                     method=request.method,
                     path=full_inner.split('?')[0],
                     is_proxied=False,
-                    response_time_ms=int(response_time * 1000),
+                    response_time_ms=int(response_time * 1000 + simulated_delay_ms),
                     status_code=status_code,
                     cache_ttl_seconds=ttl if ttl > 0 else None,
                     cache_key=cache_key,
                     request_headers=request_headers_dict,
                     request_body=request_body_str,
                     response_headers=response_headers_dict,
-                    response_body=response_body_str
+                    response_body=response_body_str,
+                    simulated_delay_ms=int(simulated_delay_ms) if virtual_time else None
                 )
                 db.add(request_log)
                 db.commit()
@@ -5873,7 +10838,7 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                 else:
                     # Для JSON ответов - сериализуем в JSON
                     try:
-                        response_body_formatted = json.dumps(body, ensure_ascii=False, indent=2)
+                        response_body_formatted = json_dumps(body, indent=True)
                     except (TypeError, ValueError):
                         response_body_formatted = str(body)
                 
@@ -5882,35 +10847,32 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                     f"  Mock ID: {m.id}\n"
                     f"  Метод: {request.method}\n"
                     f"  Путь: {full_inner}\n"
-                    f"  Заголовки запроса: {json.dumps(request_headers_formatted, ensure_ascii=False, indent=2)}\n"
+                    f"  Заголовки запроса: {json_dumps(request_headers_formatted, indent=True)}\n"
                     f"  Тело запроса:\n{request_body_formatted}\n"
                     f"  Статус ответа: {resp.status_code}\n"
-                    f"  Заголовки ответа: {json.dumps(response_headers_formatted, ensure_ascii=False, indent=2)}\n"
+                    f"  Заголовки ответа: {json_dumps(response_headers_formatted, indent=True)}\n"
                     f"  Тело ответа:\n{response_body_formatted}"
                 )
             except Exception as e:
                 logger.warning(f"[ВРЕМЕННОЕ ЛОГИРОВАНИЕ] Ошибка при логировании вызова мока: {e}", exc_info=True)
             
             # Удаляем системные заголовки из ответа, если они были добавлены автоматически
-            # (Cloudflare, Render или другие прокси могут добавлять эти заголовки)
-            _remove_system_headers(resp)
+            # (Cloudflare, Render или другие прокси могут добавлять эти заголовки).
+            # У статических моков это уже сделано при компиляции.
+            if not compiled.static:
+                _remove_system_headers(resp)
             
-            return resp
+            _arm_chaos(request, m, folder_name, rng)
+            return _throttle_response(resp, m, folder_name, virtual_time)
 
 
     # Если мок не найден, пробуем прокси для папки
     if folder and getattr(folder, "proxy_enabled", False) and getattr(folder, "proxy_base_url", None):
-        target_url = f'{folder.proxy_base_url.rstrip("/")}{full_inner}'
+        policy = ProxyPolicy(folder, folder_name, folder_parent)
 
-        # Ограничение на список разрешённых хостов для прокси (если настроено)
-        if ALLOWED_PROXY_HOSTS:
-            try:
-                parsed = urlparse(folder.proxy_base_url)
-                host = (parsed.hostname or "").lower()
-            except Exception:
-                host = ""
-            if host not in ALLOWED_PROXY_HOSTS:
-                raise HTTPException(403, "Proxy target host is not allowed")
+        # Ограничение на список разрешённых хостов для прокси (если настроено) — для всех реплик
+        if not all(_proxy_host_allowed(upstream) for upstream in policy.upstreams):
+            raise HTTPException(403, "Proxy target host is not allowed")
 
         # Сохраняем данные запроса для логирования (до проксирования)
         # Очищаем заголовки от NUL символов
@@ -5920,6 +10882,9 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
             clean_value = _remove_nul_chars(v) if v else v
             request_headers_dict[clean_key] = clean_value
         
+        # Кэш прокси (GET): тело ответа нужно целиком, поэтому он приоритетнее потокового режима
+        proxy_cache = bool(folder.proxy_cache_enabled) and not _proxy_cache_bypassed(request)
+
         request_body_str = None
         if body_bytes:
             try:
@@ -5931,18 +10896,42 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                 request_body_str = base64.b64encode(body_bytes).decode("ascii")
                 request_body_str = _remove_nul_chars(request_body_str)
         
+        proxy_cache_result = None
+        proxy_cache_key = None
+        # Пока идёт запрос к upstream, соединение с БД не удерживается
+        _bulkhead_pause(request, db)
         try:
-            # Настраиваем httpx клиент с автоматическим декодированием сжатых ответов
-            # follow_redirects=True - автоматически следовать редиректам
-            async with httpx.AsyncClient(follow_redirects=True) as client:
-                proxied = await client.request(
-                    method=request.method,
-                    url=target_url,
-                    headers={k: v for k, v in request.headers.items() if k.lower() != "host"},
+            if stream_proxy and not proxy_cache:
+                return await _proxy_streaming(
+                    request, policy, folder_name, folder_parent, full_inner,
+                    start_time, request_headers_dict, body_bytes,
+                )
+            if proxy_cache:
+                proxied, proxy_cache_result, proxy_cache_key = await _proxy_fetch_cached(
+                    request, policy, folder, folder_name, folder_parent, full_inner
+                )
+            else:
+                # Общий клиент upstream из пула: keep-alive соединения переиспользуются между запросами,
+                # сжатые ответы декодируются автоматически, редиректы отслеживаются (follow_redirects=True)
+                proxied = await _proxy_send(
+                    policy,
+                    request.method,
+                    full_inner,
+                    headers=_proxy_request_headers(request),
                     content=body_bytes
                 )
+        except HTTPException:
+            raise
+        except CircuitOpenError as e:
+            # Пока цепь разомкнута, отвечаем резервным моком папки, если он задан
+            await _bulkhead_resume(request)
+            fallback = _proxy_fallback_response(db, policy, request, full_inner, folder_name)
+            if fallback is None:
+                raise _proxy_error(e)
+            return fallback
         except Exception as e:
-            raise HTTPException(502, f"Proxy error: {str(e)}")
+            raise _proxy_error(e)
+        await _bulkhead_resume(request)
 
         # Полностью переработанная логика обработки проксированного ответа
         # Цель: корректно обработать ответ любого формата и передать его клиенту без искажений
@@ -5991,19 +10980,19 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                 response_text = response_content.decode(encoding)
                 
                 # Парсим JSON
-                parsed_json = json.loads(response_text)
+                parsed_json = json_loads(response_text)
                 
                 # Используем JSONResponse - это гарантирует правильную сериализацию
                 # JSONResponse автоматически устанавливает Content-Type: application/json
-                resp = JSONResponse(content=parsed_json, status_code=proxied.status_code)
+                resp = ORJSONResponse(content=parsed_json, status_code=proxied.status_code)
                 
             except (UnicodeDecodeError, LookupError) as e:
                 # Если не удалось декодировать с указанной кодировкой, пробуем UTF-8
                 logger.warning(f"Failed to decode JSON response with encoding {encoding}, trying UTF-8: {e}")
                 try:
                     response_text = response_content.decode("utf-8")
-                    parsed_json = json.loads(response_text)
-                    resp = JSONResponse(content=parsed_json, status_code=proxied.status_code)
+                    parsed_json = json_loads(response_text)
+                    resp = ORJSONResponse(content=parsed_json, status_code=proxied.status_code)
                 except Exception as e2:
                     logger.error(f"Failed to decode JSON response as UTF-8: {e2}, content_type={content_type_header}")
                     # Отправляем как бинарные данные с оригинальным Content-Type
@@ -6070,8 +11059,8 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                 
                 # Пытаемся распарсить как JSON
                 try:
-                    parsed_json = json.loads(response_text)
-                    resp = JSONResponse(content=parsed_json, status_code=proxied.status_code)
+                    parsed_json = json_loads(response_text)
+                    resp = ORJSONResponse(content=parsed_json, status_code=proxied.status_code)
                 except (json.JSONDecodeError, ValueError):
                     # Если не JSON, отправляем как текст
                     resp = Response(content=response_text.encode('utf-8'), status_code=proxied.status_code, media_type="text/plain; charset=utf-8")
@@ -6088,58 +11077,23 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
         
         # Копируем заголовки, исключая hop-by-hop;
         # При редиректах переписываем Location на текущий хост (умная обработка редиректов).
-        # ВАЖНО: httpx возвращает заголовки в нижнем регистре через .items(), но мы должны сохранить оригинальный регистр
-        # Пытаемся получить оригинальные заголовки из httpx Response
         response_headers_dict = {}
-        # Создаем словарь для быстрого поиска оригинальных ключей заголовков
-        original_headers_map = {}
-        try:
-            # httpx использует Headers с _list для хранения оригинальных ключей
-            if hasattr(proxied, 'headers') and hasattr(proxied.headers, '_list'):
-                for header_tuple in proxied.headers._list:
-                    if len(header_tuple) == 2:
-                        original_key, value = header_tuple
-                        original_headers_map[original_key.lower()] = original_key
-        except Exception:
-            # Если не удалось получить оригинальные заголовки, используем стандартные имена
-            pass
-        
-        for k, v in proxied.headers.items():
-            kl = k.lower()
-            # Исключаем системные заголовки
-            # Точное совпадение
-            if kl in {"content-length", "transfer-encoding", "connection", "vary", "alt-svc", 
-                      "x-render-origin-server", "cf-cache-status", "cache-status", 
-                      "content-encoding", "cf-ray"}:
-                continue
-            # Проверяем префиксы (cf-*, rndr-*)
-            if any(kl.startswith(prefix) for prefix in ["cf-", "rndr-"]):
-                continue
-            if kl == "location":
-                try:
-                    loc = urlparse(v)
-                    if loc.scheme and loc.netloc:
-                        # Переписываем только хост/схему, путь и query оставляем
-                        current = request.base_url
-                        new_loc = f"{current.scheme}://{current.netloc}{loc.path or ''}"
-                        if loc.query:
-                            new_loc += f"?{loc.query}"
-                        v = new_loc
-                except Exception:
-                    pass
-            # Пропускаем Content-Type, если он уже установлен через media_type
-            # Это гарантирует, что JSON ответы всегда имеют правильный Content-Type
-            if kl == "content-type":
-                # Уже установлен через media_type, пропускаем
-                continue
-            
-            # Используем оригинальный ключ заголовка, если доступен, иначе восстанавливаем регистр
-            original_key = original_headers_map.get(kl) or _restore_header_case(kl)
+        for original_key, v in _proxy_response_headers(proxied, request):
             resp.headers[original_key] = v
             # Очищаем заголовки от NUL символов перед сохранением
             clean_key = _remove_nul_chars(original_key) if original_key else original_key
             clean_value = _remove_nul_chars(v) if v else v
             response_headers_dict[clean_key] = clean_value
+
+        if proxy_cache_result is not None:
+            # Cache-Status (RFC 9211): hit — из кэша, fwd=… — ответ получен от upstream
+            if proxy_cache_result in ("hit", "stale", "stale_if_error"):
+                resp.headers["Cache-Status"] = "mockl; hit" if proxy_cache_result == "hit" else "mockl; hit; fwd=stale"
+            else:
+                resp.headers["Cache-Status"] = "mockl; fwd=miss" + ("; collapsed" if proxy_cache_result == "coalesced" else "")
+            response_headers_dict["Cache-Status"] = resp.headers["Cache-Status"]
+            if _is_not_modified(request, resp.headers):
+                resp = _not_modified_response(resp.headers)
         
         # Сохраняем тело ответа для логирования
         # ВАЖНО: Сохраняем как JSON объект, если это JSON, иначе как строку или base64
@@ -6165,9 +11119,9 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                     # Пытаемся декодировать как UTF-8 (используем errors='replace' для более мягкой обработки)
                     decoded = proxied.content.decode("utf-8", errors='replace')
                     # Проверяем, что это валидный JSON и парсим его
-                    parsed_json = json.loads(decoded)
+                    parsed_json = json_loads(decoded)
                     # Сохраняем как JSON строку (нормализованную) для последующего парсинга
-                    response_body_str = json.dumps(parsed_json, ensure_ascii=False)
+                    response_body_str = json_dumps(parsed_json)
                     response_body_str = _remove_nul_chars(response_body_str)
                 except (UnicodeDecodeError, json.JSONDecodeError, ValueError) as e:
                     # Если не валидный JSON или не UTF-8, логируем ошибку и сохраняем как base64
@@ -6190,7 +11144,7 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                     response_body_str = base64.b64encode(proxied.content).decode("ascii")
 
         response_time = time.time() - start_time
-        status_code = proxied.status_code
+        status_code = resp.status_code
 
         PROXY_REQUESTS.labels(folder=folder_name).inc()
         RESPONSE_TIME.labels(folder=folder_name).observe(response_time)
@@ -6228,7 +11182,7 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
                 response_time_ms=int(response_time * 1000),
                 status_code=status_code,
                 cache_ttl_seconds=None,
-                cache_key=None,
+                cache_key=proxy_cache_key,
                 request_headers=request_headers_dict,
                 request_body=request_body_str,
                 response_headers=response_headers_dict,
@@ -6239,6 +11193,19 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
         except Exception as e:
             logger.error(f"Error logging proxied request: {e}", exc_info=True)
             db.rollback()
+
+        if folder.proxy_record_enabled and proxied.status_code < 500:
+            # Ошибки upstream не записываются; разбор тел и вставка — в фоновой задаче
+            content_type = proxied.headers.get("content-type")
+            recorded_headers = dict(response_headers_dict)
+            if content_type:
+                recorded_headers["Content-Type"] = content_type
+            PROXY_RECORDER.submit(
+                folder_name, folder_parent, request.method, full_inner, body_bytes, request_headers_dict,
+                proxied.status_code, recorded_headers, proxied.content,
+                content_type.split(";")[0].strip().lower() if content_type else None,
+                folder.proxy_record_strip_headers is not False,
+            )
         
         return resp
 
@@ -6285,7 +11252,7 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
         
         # Формируем ответ 404 для логирования
         error_response = {"error": "No matching mock found", "path": full_inner.split('?')[0], "method": request.method}
-        response_body_str = json.dumps(error_response, ensure_ascii=False)
+        response_body_str = json_dumps(error_response)
         response_headers_dict = {"Content-Type": "application/json"}
         
         request_log = RequestLog(
@@ -6311,3 +11278,105 @@ async def mock_handler(request: Request, full_path: str, db: Session = Depends(g
         db.rollback()
     
     raise HTTPException(404, "No matching mock found")
+
+
+# Плоскость данных: мок‑трафик без FastAPI (маршрутизации по API, разбора параметров и Depends)
+DATA_PLANE_METHODS = frozenset(("GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"))
+# Служебные пути, которые плоскость данных передаёт основному приложению (проверки здоровья и метрики)
+DATA_PLANE_ADMIN_PATHS = frozenset(("/healthz", "/readyz", "/metrics"))
+
+
+class DataPlaneApp:
+    """Минимальное ASGI‑приложение, обслуживающее только моки.
+
+    Запрос сразу попадает в mock_handler: без перебора маршрутов API, валидации
+    параметров и внедрения зависимостей; пути /api/* отвечают 404. Набор ASGI‑слоёв
+    тот же, что у основного приложения (CORS, сетевые сбои, заголовки лимитов,
+    защита от перегрузки, бюджеты папок). Запускается отдельным процессом
+    (uvicorn app:data_plane_app) или на MOCKL_DATA_PLANE_PORT рядом с основным.
+    """
+
+    def __init__(self):
+        handler = self._handle
+        handler = ChaosMiddleware(handler)
+        handler = ExtraHeadersMiddleware(handler)
+        if ADMISSION_GLOBAL is not None or MAX_IN_FLIGHT_PER_FOLDER > 0:
+            handler = AdmissionControlMiddleware(handler)
+        handler = BulkheadMiddleware(handler)
+        self.handler = CORSMiddleware(
+            handler,
+            allow_origins=["*"],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+            expose_headers=["*"],
+        )
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and scope["path"] not in DATA_PLANE_ADMIN_PATHS:
+            await self.handler(scope, receive, send)
+        else:
+            # Жизненный цикл (отдельный процесс) и служебные пути обслуживает основное приложение
+            await app(scope, receive, send)
+
+    async def _handle(self, scope, receive, send) -> None:
+        request = Request(scope, receive)
+        if request.method not in DATA_PLANE_METHODS:
+            response = JSONResponse({"detail": "Method Not Allowed"}, status_code=405)
+            await response(scope, receive, send)
+            return
+        db = SessionLocal()
+        try:
+            try:
+                response = await mock_handler(request, scope["path"][1:], db)
+            except HTTPException as e:
+                response = await http_exception_handler(request, e)
+            except Exception as e:
+                logger.error(f"Data plane request {request.method} {scope['path']} failed: {e}", exc_info=True)
+                response = PlainTextResponse("Internal Server Error", status_code=500)
+            await response(scope, receive, send)
+        finally:
+            db.close()
+
+
+data_plane_app = DataPlaneApp()
+# Сервер плоскости данных, запущенный в процессе основного приложения, и его задача
+DATA_PLANE_SERVER: Dict[str, Any] = {}
+
+
+@app.on_event("startup")
+async def start_data_plane():
+    """Запускает плоскость данных на MOCKL_DATA_PLANE_PORT в том же процессе (если задан)."""
+    if not DATA_PLANE_PORT:
+        return
+    if uvicorn is None:
+        logger.warning("MOCKL_DATA_PLANE_PORT requires uvicorn; data plane is not started")
+        return
+
+    class EmbeddedServer(uvicorn.Server):
+        """Сигналы завершения обрабатывает основной сервер, а не встроенный."""
+
+        @contextlib.contextmanager
+        def capture_signals(self):
+            yield
+
+    config = uvicorn.Config(
+        data_plane_app, host=DATA_PLANE_HOST, port=DATA_PLANE_PORT, lifespan="off", log_level="warning",
+    )
+    server = EmbeddedServer(config)
+    DATA_PLANE_SERVER.update(server=server, task=asyncio.create_task(server.serve()))
+    logger.info(f"Data plane listening on {DATA_PLANE_HOST}:{DATA_PLANE_PORT}")
+
+
+@app.on_event("shutdown")
+async def stop_data_plane():
+    """Останавливает плоскость данных, дав ей завершить текущие ответы."""
+    server = DATA_PLANE_SERVER.pop("server", None)
+    task = DATA_PLANE_SERVER.pop("task", None)
+    if server is not None:
+        server.should_exit = True
+        await task
+
+
+if ADMIN_SERVES_MOCKS:
+    app.add_api_route("/{full_path:path}", mock_handler, methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
@@ -0,0 +1,124 @@
+"""Микробенчмарк сериализации JSON: модуль json стандартной библиотеки против orjson.
+
+Запуск из каталога backend:
+
+    python bench_serialization.py [--number N]
+
+Для типичных тел моков (ответ авторизации, список пользователей, большой вложенный
+документ, тело с кириллицей) измеряются операции горячих путей: компактная
+сериализация ответа (ORJSONResponse), нормализация body_contains (loads + dumps),
+форматирование тела для журнала (indent=2) и разбор ответа upstream.
+Без установленного orjson печатаются только результаты json.
+"""
+
+import argparse
+import json
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+
+def typical_bodies() -> Dict[str, Any]:
+    """Тела, похожие на моки из реальных папок."""
+    login = {
+        "access_token": "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9." + "a" * 120,
+        "token_type": "Bearer",
+        "expires_in": 3600,
+        "user": {"id": 42, "login": "nikita", "roles": ["admin", "qa"], "active": True},
+    }
+    users = [
+        {
+            "id": i,
+            "name": f"User {i}",
+            "email": f"user{i}@example.com",
+            "balance": round(i * 13.37, 2),
+            "tags": ["beta", "ru"] if i % 3 else [],
+            "address": {"city": "Moscow", "zip": f"{100000 + i}", "geo": [55.75 + i / 1000, 37.61]},
+            "deleted": None,
+        }
+        for i in range(100)
+    ]
+    catalog = {
+        "page": 1,
+        "total": 500,
+        "items": [
+            {
+                "sku": f"SKU-{i:05d}",
+                "title": f"Товар {i}",
+                "price": {"amount": 1000 + i, "currency": "RUB"},
+                "attributes": {f"attr_{j}": f"value {j}" for j in range(10)},
+                "stock": [{"warehouse": w, "count": i * w} for w in range(3)],
+            }
+            for i in range(200)
+        ],
+    }
+    cyrillic = {
+        "message": "Заказ успешно оформлен",
+        "details": ["Доставка курьером", "Оплата при получении"],
+        "comment": "Позвоните за час до доставки, пожалуйста",
+    }
+    return {"login": login, "users_100": users, "catalog_200": catalog, "cyrillic": cyrillic}
+
+
+def stdlib_operations() -> Dict[str, Callable[[Any, str], Any]]:
+    return {
+        "response": lambda obj, text: json.dumps(
+            obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8"),
+        "normalize": lambda obj, text: json.dumps(json.loads(text), ensure_ascii=False, separators=(",", ":")),
+        "log_indent": lambda obj, text: json.dumps(obj, ensure_ascii=False, indent=2),
+        "parse": lambda obj, text: json.loads(text),
+    }
+
+
+def orjson_operations() -> Dict[str, Callable[[Any, str], Any]]:
+    return {
+        "response": lambda obj, text: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS),
+        "normalize": lambda obj, text: orjson.dumps(orjson.loads(text)).decode("utf-8"),
+        "log_indent": lambda obj, text: orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8"),
+        "parse": lambda obj, text: orjson.loads(text),
+    }
+
+
+def measure(operation: Callable[[Any, str], Any], obj: Any, text: str, number: int) -> float:
+    """Лучшее из пяти повторов, микросекунды на операцию."""
+    timings = timeit.repeat(lambda: operation(obj, text), number=number, repeat=5)
+    return min(timings) / number * 1e6
+
+
+def run(number: int) -> List[Tuple[str, str, int, float, float]]:
+    backends = {"json": stdlib_operations()}
+    if orjson is not None:
+        backends["orjson"] = orjson_operations()
+    rows = []
+    for body_name, obj in typical_bodies().items():
+        text = json.dumps(obj, ensure_ascii=False, indent=2)
+        size = len(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        # Маленькие тела измеряются большим числом повторов
+        repeats = max(10, number * 1000 // max(size, 1000))
+        for op_name in backends["json"]:
+            stdlib_us = measure(backends["json"][op_name], obj, text, repeats)
+            orjson_us = measure(backends["orjson"][op_name], obj, text, repeats) if orjson is not None else float("nan")
+            rows.append((body_name, op_name, size, stdlib_us, orjson_us))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200, help="базовое число повторов (для тела ~1 КБ)")
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("orjson не установлен (pip install orjson): измеряется только json")
+    print(f"{'тело':<12} {'операция':<11} {'байт':>8} {'json, мкс':>11} {'orjson, мкс':>12} {'ускорение':>10}")
+    for body_name, op_name, size, stdlib_us, orjson_us in run(args.number):
+        speedup = f"{stdlib_us / orjson_us:.1f}x" if orjson is not None else "-"
+        print(f"{body_name:<12} {op_name:<11} {size:>8} {stdlib_us:>11.1f} {orjson_us:>12.1f} {speedup:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Сериализация JSON для горячих путей mockl.
+
+Если установлен orjson (pip install orjson), используется он, иначе — модуль json
+стандартной библиотеки. Результат совпадает с json.dumps(..., ensure_ascii=False):
+компактный вывод — с разделителями (',', ':'), форматированный — с отступом 2
+(orjson лишь короче записывает экспоненту: 1e-7 вместо 1e-07).
+Значения, которые orjson не сериализует (целые больше 64 бит, ключи-кортежи и т.п.),
+сериализуются модулем json. Целые больше 64 бит orjson разбирает как float с потерей
+точности, поэтому текст с целыми от 19 цифр (номера счетов и т.п.) разбирается модулем json.
+
+NaN и ±Infinity не входят в JSON: loads отвергает их при любом варианте, поэтому
+разбор (и нормализация body_contains) от наличия orjson не зависит. При сериализации
+модуль json, как JSONResponse Starlette (allow_nan=False), выбрасывает ValueError,
+а orjson записывает такие числа как null — это единственное расхождение вариантов.
+MOCKL_JSON_BACKEND=stdlib отключает orjson.
+"""
+
+import json
+import os
+import re
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+if os.getenv("MOCKL_JSON_BACKEND", "auto").lower() == "stdlib":
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "stdlib"
+
+JSONDecodeError = json.JSONDecodeError
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+_ORJSON_INDENT_OPTIONS = _ORJSON_OPTIONS | orjson.OPT_INDENT_2 if orjson is not None else 0
+
+# Целое из 19+ цифр может не поместиться в int64/uint64 (цифры дробной части не считаются)
+_LONG_INT = re.compile(rb"(?<![0-9.])[0-9]{19,}(?![0-9.eE])")
+_DIGITS_TO_ZERO = bytes.maketrans(b"0123456789", b"0" * 10)
+_LONG_DIGIT_RUN = b"0" * 19
+
+
+def _stdlib_dumps(obj: Any, indent: bool) -> str:
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=2)
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def _reject_constant(name: str) -> Any:
+    raise JSONDecodeError(f"{name} is not valid JSON", name, 0)
+
+
+def dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+    """JSON в UTF-8: компактный или с отступом 2."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_INDENT_OPTIONS if indent else _ORJSON_OPTIONS)
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj, indent).encode("utf-8")
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """JSON‑строка: компактная или с отступом 2 (как json.dumps с ensure_ascii=False)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_INDENT_OPTIONS if indent else _ORJSON_OPTIONS).decode("utf-8")
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj, indent)
+
+
+def _has_long_int(data: Union[str, bytes, bytearray, memoryview]) -> bool:
+    if isinstance(data, str):
+        data = data.encode("utf-8", "surrogatepass")
+    elif isinstance(data, memoryview):
+        data = data.tobytes()
+    # Быстрый отсев (translate + find в разы дешевле regex по всему тексту),
+    # точная проверка — только если в тексте есть 19 цифр подряд
+    if data.translate(_DIGITS_TO_ZERO).find(_LONG_DIGIT_RUN) < 0:
+        return False
+    return _LONG_INT.search(data) is not None
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Разбирает JSON; при ошибке (в том числе NaN/Infinity) выбрасывает JSONDecodeError."""
+    if orjson is not None and not _has_long_int(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Повтор модулем json даёт привычное сообщение об ошибке
+            pass
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data, parse_constant=_reject_constant)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse с сериализацией через dumps_bytes (orjson, если установлен)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)